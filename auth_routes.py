@@ -3,7 +3,7 @@
 """
 from fastapi import APIRouter, HTTPException, status, Depends
 from pydantic import BaseModel
-from database import get_db_connection
+from database import get_async_db_connection
 from auth import hash_password, verify_password, create_access_token, get_current_user
 
 router = APIRouter(prefix="/api/auth", tags=["Authentication"])
@@ -25,15 +25,15 @@ class TokenResponse(BaseModel):
 @router.post("/login", response_model=TokenResponse)
 async def login(request: LoginRequest):
     """Вход в систему"""
-    with get_db_connection() as conn:
+    async with get_async_db_connection() as conn:
         cursor = conn.cursor()
         
         # Находим пользователя
-        cursor.execute(
+        await cursor.execute(
             "SELECT id, username, password_hash FROM users WHERE username = %s",
             (request.username,)
         )
-        user = cursor.fetchone()
+        user = await cursor.fetchone()
         
         if not user or not verify_password(request.password, user['password_hash']):
             raise HTTPException(
@@ -63,15 +63,15 @@ async def register(request: RegisterRequest):
             detail="Пароль должен быть не менее 6 символов"
         )
     
-    with get_db_connection() as conn:
+    async with get_async_db_connection() as conn:
         cursor = conn.cursor()
         
         # Проверяем, существует ли пользователь
-        cursor.execute(
+        await cursor.execute(
             "SELECT id FROM users WHERE username = %s",
             (request.username,)
         )
-        existing_user = cursor.fetchone()
+        existing_user = await cursor.fetchone()
         
         if existing_user:
             raise HTTPException(
@@ -81,12 +81,12 @@ async def register(request: RegisterRequest):
         
         # Создаем пользователя
         password_hash = hash_password(request.password)
-        cursor.execute(
+        await cursor.execute(
             "INSERT INTO users (username, password_hash) VALUES (%s, %s) RETURNING id",
             (request.username, password_hash)
         )
-        user_id = cursor.fetchone()['id']
-        conn.commit()
+        user_id = (await cursor.fetchone())['id']
+        await conn.commit()
         
         # Создаем токен
         access_token = create_access_token({
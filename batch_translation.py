@@ -0,0 +1,203 @@
+"""
+Пакетный перевод предложений
+
+Предложения без готового перевода в памяти переводов группируются
+в запросы к модели по её бюджету токенов. Запросы выполняются параллельно,
+но не больше TRANSLATE_BATCH_CONCURRENCY одновременно. Ошибка одного
+запроса отмечается только у его предложений.
+"""
+import asyncio
+import os
+from typing import AsyncIterator, List
+import httpx
+from fastapi import HTTPException
+from dotenv import load_dotenv
+from translation_memory import translation_memory, make_key
+from single_flight import translation_flights
+from translators import (
+    translation_backends,
+    TRANSLATE_BATCH_MAX_SEGMENTS,
+    BatchFormatError,
+    estimate_tokens
+)
+
+load_dotenv()
+
+# Сколько запросов к модели выполняется одновременно (на каждый воркер uvicorn)
+TRANSLATE_BATCH_CONCURRENCY = int(os.getenv('TRANSLATE_BATCH_CONCURRENCY', 4))
+TRANSLATE_BATCH_MAX_ITEMS = int(os.getenv('TRANSLATE_BATCH_MAX_ITEMS', 200))
+
+_semaphore = None
+
+def _get_semaphore() -> asyncio.Semaphore:
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(max(1, TRANSLATE_BATCH_CONCURRENCY))
+    return _semaphore
+
+def group_by_token_budget(texts: List[str], model: str) -> List[List[str]]:
+    """
+    Делит тексты на группы, каждая из которых укладывается в бюджет токенов модели
+
+    Текст больше бюджета уходит отдельной группой.
+    """
+    backend = translation_backends.get(model)
+    if not backend.supports_batch:
+        return [[text] for text in texts]
+
+    budget = backend.batch_tokens
+
+    groups = []
+    current = []
+    current_tokens = 0
+    for text in texts:
+        tokens = estimate_tokens(text)
+        if current and (current_tokens + tokens > budget or len(current) >= TRANSLATE_BATCH_MAX_SEGMENTS):
+            groups.append(current)
+            current = []
+            current_tokens = 0
+        current.append(text)
+        current_tokens += tokens
+    if current:
+        groups.append(current)
+    return groups
+
+async def _coalesced(text: str, source_language: str, target_language: str, model: str, call):
+    """Один вызов модели на одинаковые предложения из одновременных запросов"""
+    return await translation_flights.run(
+        ("sentence", make_key(text, source_language, target_language, model)), call
+    )
+
+def describe_error(error: Exception) -> dict:
+    """Ошибка перевода в виде поля ответа"""
+    if isinstance(error, HTTPException):
+        return {"status_code": error.status_code, "error": error.detail}
+    if isinstance(error, httpx.TimeoutException):
+        return {"status_code": 504, "error": "Translation service timeout"}
+    if isinstance(error, httpx.RequestError):
+        return {"status_code": 503, "error": f"Translation service error: {str(error)}"}
+    return {"status_code": 500, "error": f"Error translating text: {str(error)}"}
+
+async def translate_batch(items: list, source_language: str, target_language: str, model: str) -> dict:
+    """
+    Переводит список {sentence_id, text}
+
+    Returns:
+        {"results": [...], "translated", "failed", "cached", "upstream_requests"}
+        results идут в порядке items: {"sentence_id", "success", "text", "cached"}
+        или {"sentence_id", "success": False, "status_code", "error"}
+    """
+    unique_texts = list(dict.fromkeys(item.text for item in items))
+    translations = await translation_memory.get_many(unique_texts, source_language, target_language, model)
+    cached_texts = set(translations)
+    errors = {}
+    upstream_requests = 0
+
+    async def translate_one(text: str):
+        async def call():
+            nonlocal upstream_requests
+            async with _get_semaphore():
+                upstream_requests += 1
+                return await translation_backends.get(model).translate(text, source_language, target_language)
+
+        try:
+            translations[text] = await _coalesced(text, source_language, target_language, model, call)
+        except Exception as e:
+            errors[text] = describe_error(e)
+
+    async def translate_group(group: List[str]):
+        nonlocal upstream_requests
+        if len(group) == 1:
+            await translate_one(group[0])
+            return
+
+        async with _get_semaphore():
+            upstream_requests += 1
+            try:
+                results = await translation_backends.get(model).translate_batch(group, source_language, target_language)
+                translations.update(zip(group, results))
+                return
+            except BatchFormatError as e:
+                print(f"[WARNING] Batch of {len(group)} segment(s) returned bad format, "
+                      f"translating one by one: {str(e)}")
+            except Exception as e:
+                error = describe_error(e)
+                for text in group:
+                    errors[text] = error
+                return
+
+        # Модель не сохранила формат ответа - переводим группу по одному
+        await asyncio.gather(*(translate_one(text) for text in group))
+
+    pending = [text for text in unique_texts if text not in translations]
+    await asyncio.gather(*(translate_group(group) for group in group_by_token_budget(pending, model)))
+
+    await translation_memory.put_many(
+        {text: translations[text] for text in pending if text in translations},
+        source_language, target_language, model
+    )
+
+    results = []
+    for item in items:
+        if item.text in translations:
+            results.append({
+                "sentence_id": item.sentence_id,
+                "success": True,
+                "text": translations[item.text],
+                "cached": item.text in cached_texts
+            })
+        else:
+            results.append({"sentence_id": item.sentence_id, "success": False, **errors[item.text]})
+
+    failed = sum(1 for result in results if not result["success"])
+    return {
+        "results": results,
+        "translated": len(results) - failed,
+        "failed": failed,
+        "cached": sum(1 for result in results if result.get("cached")),
+        "upstream_requests": upstream_requests
+    }
+
+async def translate_as_completed(items: list, source_language: str, target_language: str,
+                                 model: str) -> AsyncIterator[dict]:
+    """
+    Переводит список {sentence_id, text}, отдавая результат каждого предложения сразу по готовности
+
+    Найденные в памяти переводов идут первыми, остальные - в порядке завершения
+    запросов к модели (по одному предложению на запрос, под общим лимитом).
+    Формат результатов как в translate_batch.
+    """
+    items_by_text = {}
+    for item in items:
+        items_by_text.setdefault(item.text, []).append(item)
+
+    translations = await translation_memory.get_many(list(items_by_text), source_language, target_language, model)
+    for text, translated_text in translations.items():
+        for item in items_by_text.pop(text):
+            yield {"sentence_id": item.sentence_id, "success": True, "text": translated_text, "cached": True}
+
+    async def translate_one(text: str) -> tuple:
+        async def call():
+            async with _get_semaphore():
+                translated_text = await translation_backends.get(model).translate(text, source_language, target_language)
+            await translation_memory.put(text, translated_text, source_language, target_language, model)
+            return translated_text
+
+        try:
+            return text, await _coalesced(text, source_language, target_language, model, call), None
+        except Exception as e:
+            return text, None, describe_error(e)
+
+    tasks = [asyncio.create_task(translate_one(text)) for text in items_by_text]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            text, translated_text, error = await next_done
+            for item in items_by_text[text]:
+                if error:
+                    yield {"sentence_id": item.sentence_id, "success": False, **error}
+                else:
+                    yield {"sentence_id": item.sentence_id, "success": True, "text": translated_text, "cached": False}
+    finally:
+        # Клиент отключился - незавершенные запросы не нужны
+        for task in tasks:
+            task.cancel()
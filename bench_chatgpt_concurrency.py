@@ -0,0 +1,105 @@
+"""
+Нагрузочная проверка /api/chatgpt и /api/translate (model=chatgpt) на локальной заглушке
+
+Поднимает заглушку OpenAI Chat Completions с фиксированной задержкой и
+отправляет N одновременных запросов в приложение. Если обработчики не
+блокируют event loop, N запросов завершаются примерно за время одного.
+
+Использование:
+    python bench_chatgpt_concurrency.py              # 20 запросов, задержка 0.5 с
+    python bench_chatgpt_concurrency.py 50 1.0       # 50 запросов, задержка 1 с
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+import uvicorn
+import httpx
+from fastapi import FastAPI, Request
+
+STUB_PORT = int(os.getenv('STUB_PORT', 8799))
+STUB_DELAY = float(sys.argv[2]) if len(sys.argv) > 2 else 0.5
+
+stub = FastAPI()
+
+@stub.post("/v1/chat/completions")
+async def stub_chat_completions(request: Request):
+    body = await request.json()
+    await asyncio.sleep(STUB_DELAY)
+    return {
+        "id": "stub",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body["model"],
+        "choices": [{
+            "index": 0,
+            "finish_reason": "stop",
+            "message": {"role": "assistant", "content": body["messages"][-1]["content"][::-1]}
+        }],
+        "usage": {"prompt_tokens": 10, "completion_tokens": 10, "total_tokens": 20}
+    }
+
+def start_stub() -> uvicorn.Server:
+    server = uvicorn.Server(uvicorn.Config(stub, port=STUB_PORT, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+async def measure(client: httpx.AsyncClient, path: str, payload, requests: int, offset: int = 0) -> float:
+    """payload(i) - тело i-го запроса: тексты разные, чтобы запросы не склеивались"""
+    started = time.perf_counter()
+    responses = await asyncio.gather(*(
+        client.post(path, json=payload(offset + i)) for i in range(requests)
+    ))
+    elapsed = time.perf_counter() - started
+    failed = [r for r in responses if r.status_code != 200]
+    if failed:
+        print(f"[ERROR] {len(failed)} request(s) to {path} failed: {failed[0].text}")
+        sys.exit(1)
+    return elapsed
+
+async def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+
+    os.environ['OPENAI_API_KEY'] = 'stub'
+    os.environ['OPENAI_BASE_URL'] = f'http://127.0.0.1:{STUB_PORT}/v1'
+    # Иначе прогрев заполнит память переводов и замер пойдет мимо заглушки
+    os.environ['TRANSLATION_MEMORY_ENABLED'] = 'false'
+    from main import app
+    from http_clients import http_clients
+
+    server = start_stub()
+    http_clients.open()
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://app", timeout=None) as client:
+            checks = [
+                ("/api/chatgpt", lambda i: {"message": f"Hello there {i}."}),
+                ("/api/translate", lambda i: {"text": f"Hello there {i}.", "model": "chatgpt"})
+            ]
+            print(f"Requests: {requests} concurrent, stub latency {STUB_DELAY * 1000:.0f} ms")
+            slow = False
+            skipped_stub = False
+            for path, payload in checks:
+                await measure(client, path, payload, 1, offset=requests)
+                elapsed = await measure(client, path, payload, requests)
+                print(f"{path:16} {elapsed * 1000:.0f} ms ({elapsed / STUB_DELAY:.1f}x one request)")
+                # Последовательное выполнение заняло бы requests * STUB_DELAY
+                slow = slow or elapsed > STUB_DELAY * max(2, requests / 4)
+                # Быстрее одного ответа заглушки - ответы пришли не из нее (кеш)
+                skipped_stub = skipped_stub or elapsed < STUB_DELAY
+    finally:
+        await http_clients.close()
+        server.should_exit = True
+
+    if skipped_stub:
+        print("[ERROR] Requests were answered without calling the stub")
+        sys.exit(1)
+    if slow:
+        print("[ERROR] Concurrent requests were serialized")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    asyncio.run(main())
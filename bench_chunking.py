@@ -0,0 +1,109 @@
+"""
+Проверка перевода длинного текста по частям на локальной заглушке
+
+Заглушки KazLLM и Claude возвращают текст в верхнем регистре и отвечают тем
+дольше, чем длиннее текст. Длинный текст /api/translate должен уйти частями
+не больше chunk_tokens сервиса, параллельно, и собраться в исходном
+порядке; max_tokens запроса к Claude - укладываться в лимит модели.
+
+Использование:
+    python bench_chunking.py            # 200 предложений
+    python bench_chunking.py 500
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+import uvicorn
+import httpx
+from fastapi import FastAPI, Request
+
+STUB_PORT = int(os.getenv('STUB_PORT', 8795))
+# Задержка заглушки на 1000 символов текста
+STUB_DELAY_PER_1K = 0.1
+
+stub = FastAPI()
+stub_texts = []
+stub_max_tokens = []
+
+@stub.post("/translate")
+async def stub_translate(request: Request):
+    body = await request.json()
+    stub_texts.append(body["text"])
+    await asyncio.sleep(STUB_DELAY_PER_1K * len(body["text"]) / 1000)
+    return {"text": body["text"].upper()}
+
+@stub.post("/v1/messages")
+async def stub_messages(request: Request):
+    body = await request.json()
+    text = body["messages"][-1]["content"].split("\n\n", 1)[1]
+    stub_texts.append(text)
+    stub_max_tokens.append(body["max_tokens"])
+    await asyncio.sleep(STUB_DELAY_PER_1K * len(text) / 1000)
+    return {"content": [{"type": "text", "text": text.upper()}], "usage": {"input_tokens": 1, "output_tokens": 1}}
+
+def start_stub() -> uvicorn.Server:
+    server = uvicorn.Server(uvicorn.Config(stub, port=STUB_PORT, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+async def main():
+    sentences = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+
+    os.environ['TRANSLATION_API_KEY'] = 'stub'
+    os.environ['TRANSLATION_API_URL'] = f'http://127.0.0.1:{STUB_PORT}/translate'
+    os.environ['CLAUDE_API_KEY'] = 'stub'
+    os.environ['CLAUDE_API_URL'] = f'http://127.0.0.1:{STUB_PORT}/v1/messages'
+    os.environ['TRANSLATION_MEMORY_ENABLED'] = 'false'
+    from main import app
+    from http_clients import http_clients
+    from translators import translation_backends, estimate_tokens
+
+    paragraphs = []
+    for p in range(0, sentences, 10):
+        paragraphs.append(' '.join(
+            f"Sentence number {i} of the long text, with «a quote» and some more words." for i in range(p, p + 10)
+        ))
+    text = '\n\n'.join(paragraphs)
+
+    server = start_stub()
+    http_clients.open()
+    errors = []
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://app", timeout=None) as client:
+            print(f"Text: {len(text)} chars, ~{estimate_tokens(text)} tokens")
+            for model in ("kazllm", "claude"):
+                stub_texts.clear()
+                started = time.perf_counter()
+                response = await client.post("/api/translate", json={"text": text, "model": model})
+                elapsed = time.perf_counter() - started
+                if response.status_code != 200:
+                    errors.append(f"{model}: {response.status_code} {response.text}")
+                    continue
+
+                largest = max(estimate_tokens(chunk) for chunk in stub_texts)
+                sequential = STUB_DELAY_PER_1K * len(text) / 1000
+                print(f"{model:7} {len(stub_texts):3} chunk(s), largest ~{largest} tokens "
+                      f"(limit {translation_backends.get(model).chunk_tokens}), {elapsed * 1000:.0f} ms "
+                      f"(one call would take ~{sequential * 1000:.0f} ms)")
+                if response.json()["text"] != text.upper():
+                    errors.append(f"{model}: reassembled translation differs from the input order")
+                if largest > translation_backends.get(model).chunk_tokens:
+                    errors.append(f"{model}: chunk of ~{largest} tokens is over the limit")
+            if stub_max_tokens and max(stub_max_tokens) > 16000:
+                errors.append(f"claude: max_tokens {max(stub_max_tokens)} is over the model limit")
+    finally:
+        await http_clients.close()
+        server.should_exit = True
+
+    for error in errors:
+        print(f"[ERROR] {error}")
+    if errors:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,65 @@
+"""
+Проверка конкурентности асинхронного слоя БД на локальном Postgres
+
+Запускает N одновременных запросов с pg_sleep внутри одного event loop:
+через синхронный get_db_connection они выполняются по очереди (блокируют loop),
+через get_async_db_connection - параллельно, в пределах размера пула.
+
+Использование:
+    python bench_db_concurrency.py                # 20 запросов по 0.1 с
+    python bench_db_concurrency.py 50 0.2         # 50 запросов по 0.2 с
+"""
+import asyncio
+import sys
+import time
+from database import (
+    get_db_connection,
+    get_async_db_connection,
+    async_db_pool,
+    async_db_pool_stats
+)
+
+async def sync_query(delay: float):
+    """Так роутеры работали раньше: синхронный вызов внутри async def"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT pg_sleep(%s)", (delay,))
+
+async def async_query(delay: float):
+    async with get_async_db_connection() as conn:
+        cursor = conn.cursor()
+        await cursor.execute("SELECT pg_sleep(%s)", (delay,))
+
+async def measure(query, requests: int, delay: float) -> float:
+    started = time.perf_counter()
+    await asyncio.gather(*(query(delay) for _ in range(requests)))
+    return time.perf_counter() - started
+
+async def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    delay = float(sys.argv[2]) if len(sys.argv) > 2 else 0.1
+
+    await async_db_pool.open(wait=True)
+    try:
+        # Прогрев: соединения обоих пулов уже открыты
+        await sync_query(0)
+        await asyncio.gather(*(async_query(0) for _ in range(async_db_pool.max_size)))
+
+        sync_time = await measure(sync_query, requests, delay)
+        async_time = await measure(async_query, requests, delay)
+        ideal = delay * -(-requests // async_db_pool.max_size)
+
+        print(f"Requests: {requests} x pg_sleep({delay}), async pool max_size={async_db_pool.max_size}")
+        print(f"Sync (blocking loop): {sync_time * 1000:.0f} ms")
+        print(f"Async pool:           {async_time * 1000:.0f} ms (ideal {ideal * 1000:.0f} ms)")
+        print(f"Speedup:              {sync_time / async_time:.2f}x")
+        print(f"Pool stats:           {async_db_pool_stats()}")
+
+        if async_time >= sync_time:
+            print("[ERROR] Async queries did not run concurrently")
+            sys.exit(1)
+    finally:
+        await async_db_pool.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,70 @@
+"""
+Бенчмарк обработки DOCX: однопроходный конвейер против исходной цепочки
+
+Использование:
+    python bench_pipeline.py                  # синтетическая книга
+    python bench_pipeline.py book.docx        # реальный файл
+    python bench_pipeline.py book.docx 10     # 10 повторов
+"""
+import sys
+import time
+from docx_pipeline import (
+    convert_docx_to_html,
+    build_book_pages,
+    build_book_pages_multipass
+)
+
+def make_synthetic_html(paragraphs: int = 6000) -> str:
+    """HTML в том виде, в каком его отдает mammoth (примерно 300 страниц)"""
+    parts = []
+    for i in range(paragraphs):
+        if i % 200 == 0:
+            parts.append(f'<h1 class="heading-1">Глава {i // 200 + 1}</h1>')
+        elif i % 50 == 0:
+            parts.append('<p class="normal"><img src="data:image/png;base64,iVBORw0KGgo=" /></p>')
+        elif i % 37 == 0:
+            parts.append('<ul><li>Первый пункт списка.</li><li>Второй <strong>пункт</strong>.</li></ul>')
+        elif i % 23 == 0:
+            parts.append('<p class="normal"></p>')
+        else:
+            parts.append(
+                f'<p class="normal">Абзац {i}. The quick brown fox jumps over the lazy dog, '
+                f'<em>көңілді</em> түлкі &amp; <strong>жалқау</strong> ит.</p>'
+            )
+    return ''.join(parts)
+
+def measure(func, html: str, repeats: int) -> float:
+    best = float('inf')
+    for _ in range(repeats):
+        started = time.perf_counter()
+        func(html)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+def main():
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], 'rb') as f:
+            html = convert_docx_to_html(f.read())
+        source = sys.argv[1]
+    else:
+        html = make_synthetic_html()
+        source = 'synthetic'
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    pages, total_sentences = build_book_pages(html)
+    if (pages, total_sentences) != build_book_pages_multipass(html):
+        print("[ERROR] Results differ from the multipass chain")
+        sys.exit(1)
+
+    print(f"Source: {source} ({len(html)} chars of HTML)")
+    print(f"Pages: {len(pages)}, sentences: {total_sentences}")
+
+    multipass = measure(build_book_pages_multipass, html, repeats)
+    single_pass = measure(build_book_pages, html, repeats)
+
+    print(f"Multipass chain:  {multipass * 1000:.1f} ms")
+    print(f"Single pass:      {single_pass * 1000:.1f} ms")
+    print(f"Speedup:          {multipass / single_pass:.2f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""
+Проверка планов запросов к книгам на заполненном локальном Postgres
+
+Создает отдельную базу <имя из DATABASE_URL>_query_plans, создает схему через
+init_database (с миграциями), заполняет её книгами, страницами, переводами
+и версиями, выполняет ANALYZE. Затем находит все SQL-запросы в cursor.execute(...)
+модулей из QUERY_MODULES и для каждого делает EXPLAIN (GENERIC_PLAN) - план
+с неизвестными параметрами, как у подготовленного запроса (нужен Postgres 16+).
+Если план читает большую таблицу целиком (Seq Scan), скрипт завершается с ошибкой.
+В f-строках подставленные фрагменты опускаются (проверяется вариант без них).
+База удаляется в конце.
+
+Использование:
+    python bench_query_plans.py            # 500 книг x 20 страниц x 40 предложений
+    python bench_query_plans.py 2000
+"""
+import ast
+import os
+import re
+import sys
+import time
+import psycopg
+from psycopg.conninfo import conninfo_to_dict, make_conninfo
+from dotenv import load_dotenv
+
+load_dotenv()
+
+QUERY_MODULES = ["books_routes.py", "book_storage.py", "book_translation_jobs.py", "ingestion_jobs.py"]
+# Обслуживающие команды, которым разрешено читать таблицы целиком
+FULL_SCAN_ALLOWED = {"reconcile_book_counters", "dedupe_translation_versions", "prune_all_translation_versions"}
+# Таблицы меньше этого (строк) Postgres законно читает целиком
+LARGE_TABLE_ROWS = 1000
+
+PAGES_PER_BOOK = 20
+SENTENCES_PER_PAGE = 40
+VERSIONS_PER_SENTENCE = 2
+BOOKS_PER_USER = 10
+
+def extract_queries(path: str) -> list:
+    """[(функция, строка, SQL)] для каждого cursor.execute / executemany с SQL-литералом"""
+    tree = ast.parse(open(path, encoding="utf-8").read())
+    queries = []
+
+    def visit(node, function):
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            function = node.name
+        if (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute)
+                and node.func.attr in ("execute", "executemany") and node.args):
+            sql = node.args[0]
+            if isinstance(sql, ast.Constant) and isinstance(sql.value, str):
+                queries.append((function, node.lineno, sql.value))
+            elif isinstance(sql, ast.JoinedStr):
+                text = ''.join(part.value for part in sql.values if isinstance(part, ast.Constant))
+                queries.append((function, node.lineno, text))
+        for child in ast.iter_child_nodes(node):
+            visit(child, function)
+
+    visit(tree, None)
+    return queries
+
+def numbered_placeholders(sql: str) -> str:
+    """%s -> $1, $2, ... для EXPLAIN (GENERIC_PLAN)"""
+    counter = iter(range(1, 1000))
+    return re.sub(r'%s', lambda _: f'${next(counter)}', sql)
+
+def seq_scans(plan: dict) -> list:
+    """Таблицы, которые план читает через Seq Scan"""
+    found = []
+    if plan.get("Node Type") == "Seq Scan":
+        found.append(plan["Relation Name"])
+    for child in plan.get("Plans", []):
+        found.extend(seq_scans(child))
+    return found
+
+def seed(conninfo: str, books: int):
+    """Заполняет базу данными в масштабе books книг"""
+    users = max(1, books // BOOKS_PER_USER)
+    with psycopg.connect(conninfo) as conn:
+        conn.execute(
+            "INSERT INTO users (username, password_hash) SELECT 'plan_user_' || u, 'x' FROM generate_series(1, %s) u",
+            (users,)
+        )
+        conn.execute(
+            """
+            INSERT INTO books (user_id, title, s3_key, total_pages, total_sentences, content_hash, uploaded_at)
+            SELECT 1 + b %% %s, 'Book ' || b, 'users/plans/books/' || b || '.docx', %s, %s,
+                   md5(b::text), now() - b * interval '1 minute'
+            FROM generate_series(1, %s) b
+            """,
+            (users, PAGES_PER_BOOK, PAGES_PER_BOOK * SENTENCES_PER_PAGE, books)
+        )
+        conn.execute(
+            """
+            INSERT INTO book_pages (book_id, page_number, html_content)
+            SELECT b.id, p, repeat('<p>page text</p>', 20)
+            FROM books b CROSS JOIN generate_series(1, %s) p
+            """,
+            (PAGES_PER_BOOK,)
+        )
+        conn.execute(
+            """
+            INSERT INTO translations (book_id, page_number, sentence_id, original_text, current_translation, is_approved)
+            SELECT b.id, p, 'sent-' || p || '-' || s, 'Original sentence ' || s, 'Translation ' || s, s %% 3 = 0
+            FROM books b CROSS JOIN generate_series(1, %s) p CROSS JOIN generate_series(1, %s) s
+            """,
+            (PAGES_PER_BOOK, SENTENCES_PER_PAGE)
+        )
+        conn.execute(
+            """
+            INSERT INTO translation_versions (translation_id, text, model, created_at)
+            SELECT t.id, t.current_translation || ' v' || v, 'claude', now() - v * interval '1 hour'
+            FROM translations t CROSS JOIN generate_series(1, %s) v
+            """,
+            (VERSIONS_PER_SENTENCE,)
+        )
+        conn.execute(
+            """
+            INSERT INTO ingestion_jobs (user_id, book_id, filename, s3_key, status, stage, progress)
+            SELECT user_id, id, title || '.docx', s3_key, 'done', 'done', 100 FROM books
+            """
+        )
+        conn.execute(
+            """
+            INSERT INTO book_translation_jobs (user_id, book_id, model, source_language, target_language, status)
+            SELECT user_id, id, 'claude', 'eng', 'kaz', 'done' FROM books
+            """
+        )
+    with psycopg.connect(conninfo, autocommit=True) as conn:
+        conn.execute("VACUUM ANALYZE")
+
+def main():
+    books = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+
+    base_conninfo = os.getenv('DATABASE_URL')
+    if not base_conninfo:
+        print("[ERROR] DATABASE_URL is not set")
+        sys.exit(1)
+    plans_db = f"{conninfo_to_dict(base_conninfo)['dbname']}_query_plans"
+    conninfo = make_conninfo(base_conninfo, dbname=plans_db)
+
+    with psycopg.connect(base_conninfo, autocommit=True) as conn:
+        conn.execute(f'DROP DATABASE IF EXISTS "{plans_db}"')
+        conn.execute(f'CREATE DATABASE "{plans_db}"')
+
+    errors = []
+    try:
+        # Схема создается тем же кодом, что и в рабочей базе
+        os.environ['DATABASE_URL'] = conninfo
+        from database import init_database, db_pool
+        init_database()
+        db_pool.close_all()
+
+        started = time.perf_counter()
+        seed(conninfo, books)
+        print(f"Seeded {books} books in {time.perf_counter() - started:.1f} s")
+
+        # Без автоматической подготовки повторяющихся запросов: EXPLAIN идет без параметров
+        with psycopg.connect(conninfo, prepare_threshold=None) as conn:
+            row_counts = dict(conn.execute(
+                "SELECT relname, reltuples::bigint FROM pg_class WHERE relkind = 'r' AND relnamespace = 'public'::regnamespace"
+            ).fetchall())
+            print("Rows: " + ", ".join(f"{name} {rows}" for name, rows in sorted(row_counts.items()) if rows > 0))
+
+            checked = 0
+            for module in QUERY_MODULES:
+                for function, line, sql in extract_queries(module):
+                    location = f"{module}:{line} {function}"
+                    try:
+                        plan = conn.execute(
+                            "EXPLAIN (GENERIC_PLAN, FORMAT JSON) " + numbered_placeholders(sql)
+                        ).fetchone()[0][0]["Plan"]
+                    except psycopg.Error as e:
+                        conn.rollback()
+                        errors.append(f"{location}: EXPLAIN failed: {str(e).splitlines()[0]}")
+                        continue
+                    checked += 1
+
+                    scanned = [
+                        table for table in seq_scans(plan)
+                        if row_counts.get(table, 0) >= LARGE_TABLE_ROWS
+                    ]
+                    status = "ok"
+                    if scanned and function in FULL_SCAN_ALLOWED:
+                        status = "full scan (maintenance)"
+                    elif scanned:
+                        status = "SEQ SCAN " + ", ".join(sorted(set(scanned)))
+                        errors.append(f"{location}: sequential scan on {', '.join(sorted(set(scanned)))}")
+                    print(f"{location:60} {status}")
+            print(f"Checked {checked} queries")
+    finally:
+        with psycopg.connect(base_conninfo, autocommit=True) as conn:
+            conn.execute(f'DROP DATABASE IF EXISTS "{plans_db}" WITH (FORCE)')
+
+    for error in errors:
+        print(f"[ERROR] {error}")
+    if errors:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+Проверка ограничения частоты запросов к KazLLM на локальной заглушке
+
+Заглушка пропускает не больше UPSTREAM_RPS запросов за любую секунду,
+остальным отвечает 429 с Retry-After. В приложение одновременно уходит
+N запросов перевода (память переводов отключена), четыре прогона:
+
+    без governor      - часть запросов получает 429
+    без лимита RPM    - governor ловит 429, делает паузы и повторяет запросы
+    KAZLLM_RPM ниже лимита заглушки - запросы ждут в очереди, 429 нет
+    ChatGPT без лимита RPM - как второй прогон, но через клиент OpenAI SDK:
+                        governor должен увидеть каждый 429 заглушки
+
+Использование:
+    python bench_rate_limiter.py            # 40 запросов, заглушка 12 запросов/с
+    python bench_rate_limiter.py 60 20      # 60 запросов, заглушка 20 запросов/с
+"""
+import asyncio
+import collections
+import os
+import sys
+import threading
+import time
+import uvicorn
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+STUB_PORT = int(os.getenv('STUB_PORT', 8798))
+UPSTREAM_RPS = int(sys.argv[2]) if len(sys.argv) > 2 else 12
+STUB_DELAY = 0.05
+
+stub = FastAPI()
+stub_requests = collections.deque()
+stub_throttled = collections.Counter()
+
+def stub_over_limit(model: str) -> bool:
+    """Не больше UPSTREAM_RPS запросов за секунду, лишние считаются как 429"""
+    now = time.monotonic()
+    while stub_requests and stub_requests[0] <= now - 1:
+        stub_requests.popleft()
+    if len(stub_requests) >= UPSTREAM_RPS:
+        stub_throttled[model] += 1
+        return True
+    stub_requests.append(now)
+    return False
+
+@stub.post("/translate")
+async def stub_translate(request: Request):
+    body = await request.json()
+    if stub_over_limit("kazllm"):
+        return JSONResponse({"detail": "Too many requests"}, status_code=429, headers={"Retry-After": "1"})
+    await asyncio.sleep(STUB_DELAY)
+    return {"text": body["text"][::-1]}
+
+@stub.post("/v1/chat/completions")
+async def stub_chat_completions(request: Request):
+    body = await request.json()
+    if stub_over_limit("chatgpt"):
+        return JSONResponse(
+            {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+            status_code=429,
+            headers={"Retry-After": "1"}
+        )
+    await asyncio.sleep(STUB_DELAY)
+    return {
+        "id": "stub", "object": "chat.completion", "created": 0, "model": body["model"],
+        "choices": [{
+            "index": 0, "finish_reason": "stop",
+            "message": {"role": "assistant", "content": body["messages"][-1]["content"][::-1]}
+        }],
+        "usage": {"prompt_tokens": 10, "completion_tokens": 10, "total_tokens": 20}
+    }
+
+def start_stub() -> uvicorn.Server:
+    server = uvicorn.Server(uvicorn.Config(stub, port=STUB_PORT, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+async def measure(client: httpx.AsyncClient, requests: int, run: int, model: str) -> tuple:
+    started = time.perf_counter()
+    responses = await asyncio.gather(*(
+        client.post("/api/translate", json={"text": f"Sentence {run}-{i}.", "model": model})
+        for i in range(requests)
+    ))
+    elapsed = time.perf_counter() - started
+    return elapsed, sum(1 for r in responses if r.status_code != 200)
+
+async def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+
+    os.environ['TRANSLATION_API_KEY'] = 'stub'
+    os.environ['TRANSLATION_API_URL'] = f'http://127.0.0.1:{STUB_PORT}/translate'
+    os.environ['OPENAI_API_KEY'] = 'stub'
+    os.environ['OPENAI_BASE_URL'] = f'http://127.0.0.1:{STUB_PORT}/v1'
+    os.environ['TRANSLATION_MEMORY_ENABLED'] = 'false'
+    os.environ['RATE_LIMIT_BURST_SECONDS'] = '1'
+    from main import app
+    from http_clients import http_clients
+    import rate_limiter
+    import translation_policy
+    from rate_limiter import RateGovernor, rate_governors
+
+    # Лимит чуть ниже лимита заглушки: запас на burst token bucket
+    rpm = UPSTREAM_RPS * 60 // 2
+    runs = [
+        ("no governor", "kazllm", False, 0),
+        ("adaptive, no RPM", "kazllm", True, 0),
+        (f"KAZLLM_RPM={rpm}", "kazllm", True, rpm),
+        ("chatgpt, no RPM", "chatgpt", True, 0)
+    ]
+
+    server = start_stub()
+    http_clients.open()
+    errors = []
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://app", timeout=None) as client:
+            print(f"Requests: {requests} concurrent, upstream limit {UPSTREAM_RPS} req/s")
+            for run, (name, model, enabled, limit) in enumerate(runs):
+                rate_limiter.RATE_LIMIT_ENABLED = enabled
+                # Без запасных моделей: 429 после всех повторов доходит до клиента
+                translation_policy.TRANSLATE_FALLBACK_CHAIN = [model]
+                rate_governors[model] = RateGovernor(model, limit, 0)
+                await asyncio.sleep(1)  # окно заглушки освобождается
+                stub_throttled.clear()
+
+                elapsed, failed = await measure(client, requests, run, model)
+                stats = rate_governors[model].stats()
+                print(f"{name:18} {elapsed * 1000:6.0f} ms  failed {failed:3}  throttled {stats['throttled']:3}  "
+                      f"upstream 429 {stub_throttled[model]:3}  queued {stats['queued_calls']:3}  "
+                      f"wait avg {stats['queue_wait_avg_ms']} ms")
+
+                if enabled and failed:
+                    errors.append(f"{name}: {failed} request(s) failed")
+                if limit and stats['throttled']:
+                    errors.append(f"{name}: upstream throttled {stats['throttled']} request(s)")
+                if enabled and stats['throttled'] != stub_throttled[model]:
+                    errors.append(f"{name}: governor saw {stats['throttled']} of {stub_throttled[model]} upstream 429 responses")
+    finally:
+        await http_clients.close()
+        server.should_exit = True
+
+    for error in errors:
+        print(f"[ERROR] {error}")
+    if errors:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    asyncio.run(main())
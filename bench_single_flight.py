@@ -0,0 +1,90 @@
+"""
+Проверка объединения одинаковых одновременных переводов на локальной заглушке
+
+N одинаковых запросов /api/translate и два одновременных одинаковых пакета
+/api/translate/batch (KazLLM, память переводов отключена) должны стоить
+по одному вызову заглушки на каждый уникальный текст.
+
+Использование:
+    python bench_single_flight.py           # 20 одинаковых запросов
+    python bench_single_flight.py 50
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+import uvicorn
+import httpx
+from fastapi import FastAPI, Request
+
+STUB_PORT = int(os.getenv('STUB_PORT', 8796))
+STUB_DELAY = 0.3
+
+stub = FastAPI()
+stub_calls = 0
+
+@stub.post("/translate")
+async def stub_translate(request: Request):
+    global stub_calls
+    stub_calls += 1
+    body = await request.json()
+    await asyncio.sleep(STUB_DELAY)
+    return {"text": body["text"][::-1]}
+
+def start_stub() -> uvicorn.Server:
+    server = uvicorn.Server(uvicorn.Config(stub, port=STUB_PORT, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+async def main():
+    global stub_calls
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+
+    os.environ['TRANSLATION_API_KEY'] = 'stub'
+    os.environ['TRANSLATION_API_URL'] = f'http://127.0.0.1:{STUB_PORT}/translate'
+    os.environ['TRANSLATION_MEMORY_ENABLED'] = 'false'
+    from main import app
+    from http_clients import http_clients
+    from single_flight import translation_flights
+
+    server = start_stub()
+    http_clients.open()
+    errors = []
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://app", timeout=None) as client:
+            responses = await asyncio.gather(*(
+                client.post("/api/translate", json={"text": "Same sentence.", "model": "kazllm"})
+                for _ in range(requests)
+            ))
+            failed = sum(1 for r in responses if r.status_code != 200)
+            print(f"/api/translate        {requests} identical requests -> {stub_calls} upstream call(s), "
+                  f"failed {failed}, {translation_flights.stats()}")
+            if stub_calls != 1 or failed:
+                errors.append(f"/api/translate: expected 1 upstream call, got {stub_calls} ({failed} failed)")
+
+            stub_calls = 0
+            items = [{"sentence_id": f"s{i}", "text": f"Sentence {i % 5}."} for i in range(10)]
+            responses = await asyncio.gather(*(
+                client.post("/api/translate/batch", json={"items": items, "model": "kazllm"})
+                for _ in range(2)
+            ))
+            upstream = [r.json()["upstream_requests"] for r in responses]
+            print(f"/api/translate/batch  2 identical batches of 10 (5 unique) -> {stub_calls} upstream call(s), "
+                  f"upstream_requests {upstream}")
+            if stub_calls != 5:
+                errors.append(f"/api/translate/batch: expected 5 upstream calls, got {stub_calls}")
+    finally:
+        await http_clients.close()
+        server.should_exit = True
+
+    for error in errors:
+        print(f"[ERROR] {error}")
+    if errors:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,158 @@
+"""
+Проверка повторов, hedging и запасных моделей /api/translate на локальной заглушке
+
+Заглушка KazLLM работает в одном из режимов, заглушка Claude всегда отвечает:
+
+    flaky  - каждый второй запрос KazLLM получает 503: спасают повторы
+    down   - KazLLM всегда 503: отвечает Claude (model в ответе)
+    tail   - каждый 10-й ответ KazLLM идет TAIL_DELAY секунд:
+             hedging срезает хвост задержек
+
+Заглушка ChatGPT всегда отвечает 429: запрос к chatgpt должен стоить ровно
+1 + RATE_LIMIT_MAX_RETRIES обращений (повторы только у governor, без повторов
+SDK и translation_policy), затем отвечает KazLLM.
+
+Использование:
+    python bench_translation_policy.py          # 40 запросов на режим
+    python bench_translation_policy.py 100
+"""
+import asyncio
+import itertools
+import os
+import sys
+import threading
+import time
+import uvicorn
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+STUB_PORT = int(os.getenv('STUB_PORT', 8797))
+STUB_DELAY = 0.05
+TAIL_DELAY = 1.0
+
+stub = FastAPI()
+stub_mode = "flaky"
+stub_counter = itertools.count()
+chatgpt_counter = itertools.count()
+
+@stub.post("/translate")
+async def stub_translate(request: Request):
+    body = await request.json()
+    call = next(stub_counter)
+    if stub_mode == "down" or (stub_mode == "flaky" and call % 2 == 0):
+        return JSONResponse({"detail": "Service unavailable"}, status_code=503)
+    await asyncio.sleep(TAIL_DELAY if stub_mode == "tail" and call % 10 == 9 else STUB_DELAY)
+    return {"text": body["text"][::-1]}
+
+@stub.post("/v1/chat/completions")
+async def stub_chat_completions():
+    next(chatgpt_counter)
+    return JSONResponse(
+        {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+        status_code=429,
+        headers={"retry-after-ms": "10"}
+    )
+
+@stub.post("/v1/messages")
+async def stub_messages(request: Request):
+    body = await request.json()
+    await asyncio.sleep(STUB_DELAY)
+    return {
+        "content": [{"type": "text", "text": body["messages"][-1]["content"][::-1]}],
+        "usage": {"input_tokens": 10, "output_tokens": 10}
+    }
+
+def start_stub() -> uvicorn.Server:
+    server = uvicorn.Server(uvicorn.Config(stub, port=STUB_PORT, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+async def translate(client: httpx.AsyncClient, text: str, model: str = "kazllm") -> tuple:
+    started = time.perf_counter()
+    response = await client.post("/api/translate", json={"text": text, "model": model})
+    return time.perf_counter() - started, response
+
+async def main():
+    global stub_mode
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+
+    os.environ['TRANSLATION_API_KEY'] = 'stub'
+    os.environ['TRANSLATION_API_URL'] = f'http://127.0.0.1:{STUB_PORT}/translate'
+    os.environ['CLAUDE_API_KEY'] = 'stub'
+    os.environ['CLAUDE_API_URL'] = f'http://127.0.0.1:{STUB_PORT}/v1/messages'
+    os.environ['OPENAI_API_KEY'] = 'stub'
+    os.environ['OPENAI_BASE_URL'] = f'http://127.0.0.1:{STUB_PORT}/v1'
+    os.environ['TRANSLATION_MEMORY_ENABLED'] = 'false'
+    os.environ['TRANSLATE_RETRY_BASE_DELAY'] = '0.05'
+    # Медленный каждый 10-й ответ: порог hedging ниже 90-го перцентиля
+    os.environ['TRANSLATE_HEDGE_PERCENTILE'] = '80'
+    from main import app
+    from http_clients import http_clients
+    import translation_policy
+    from translation_policy import translation_policy as policy
+    from rate_limiter import rate_governors, RATE_LIMIT_MAX_RETRIES
+
+    server = start_stub()
+    http_clients.open()
+    errors = []
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://app", timeout=None) as client:
+            for mode in ("flaky", "down"):
+                stub_mode = mode
+                results = await asyncio.gather(*(translate(client, f"{mode} {i}.") for i in range(requests)))
+                failed = sum(1 for _, r in results if r.status_code != 200)
+                models = sorted({r.json()["model"] for _, r in results if r.status_code == 200})
+                stats = policy.stats()
+                print(f"{mode:6} failed {failed:3}  answered by {','.join(models):14} "
+                      f"retries {stats['retries']:3}  fallbacks {stats['fallbacks']:3}")
+                if failed:
+                    errors.append(f"{mode}: {failed} request(s) failed")
+            if models != ["claude"]:
+                errors.append(f"down: expected answers from claude, got {models}")
+
+            # ChatGPT всегда 429: последовательные запросы, счетчик обращений точный
+            stub_mode = "ok"
+            chatgpt_requests = min(requests, 5)
+            calls_before = next(chatgpt_counter)
+            throttled_before = rate_governors["chatgpt"].throttled
+            results = [(await translate(client, f"throttled {i}.", "chatgpt"))[1] for i in range(chatgpt_requests)]
+            upstream_calls = next(chatgpt_counter) - calls_before - 1
+            throttled = rate_governors["chatgpt"].throttled - throttled_before
+            models = sorted({r.json()["model"] for r in results if r.status_code == 200})
+            expected = chatgpt_requests * (1 + RATE_LIMIT_MAX_RETRIES)
+            print(f"429    failed {sum(1 for r in results if r.status_code != 200):3}  answered by {','.join(models):14} "
+                  f"chatgpt calls {upstream_calls:3}  throttled {throttled:3}  expected {expected}")
+            if upstream_calls != expected:
+                errors.append(f"429: expected {expected} ChatGPT calls (one per governor attempt), got {upstream_calls}")
+            if throttled != upstream_calls:
+                errors.append(f"429: governor saw {throttled} of {upstream_calls} ChatGPT 429 responses")
+            if models != ["kazllm"]:
+                errors.append(f"429: expected answers from kazllm, got {models}")
+
+            # Хвост задержек: последовательные запросы, чтобы hedge не мешал очередь
+            stub_mode = "tail"
+            for hedge in (False, True):
+                translation_policy.TRANSLATE_HEDGE_ENABLED = hedge
+                latencies = sorted([
+                    (await translate(client, f"tail {hedge} {i}."))[0] for i in range(requests)
+                ])
+                worst = latencies[-1]
+                print(f"tail   hedge {'on ' if hedge else 'off'}  p50 {latencies[len(latencies) // 2] * 1000:5.0f} ms  "
+                      f"max {worst * 1000:5.0f} ms  hedged {policy.hedged}  hedge wins {policy.hedge_wins}")
+            if worst >= TAIL_DELAY:
+                errors.append(f"tail: hedging did not cut the slow responses ({worst * 1000:.0f} ms)")
+    finally:
+        await http_clients.close()
+        server.should_exit = True
+
+    for error in errors:
+        print(f"[ERROR] {error}")
+    if errors:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    asyncio.run(main())
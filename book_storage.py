@@ -0,0 +1,470 @@
+"""
+Сохранение обработанных книг в БД
+
+Пересчет счетчиков переведенных/одобренных предложений, если они разошлись с translations:
+    python book_storage.py reconcile
+    python book_storage.py reconcile --book 12
+
+Применение политики хранения к уже накопленной истории версий:
+    python book_storage.py prune-versions
+"""
+from typing import Awaitable, Callable, List, Optional
+import argparse
+import asyncio
+import hashlib
+import os
+from database import async_db_pool, get_async_db_connection
+
+# Сколько страниц отправляется в БД за один раунд (executemany в pipeline-режиме)
+PAGE_BATCH_SIZE = 100
+
+# Сколько последних версий перевода хранить (0 - без ограничения)
+TRANSLATION_VERSIONS_KEEP = int(os.getenv('TRANSLATION_VERSIONS_KEEP', 50))
+# Версии одной модели, сохраненные в пределах окна (секунд) от предыдущей,
+# сливаются в одну (0 - не сливать). Ручные правки (model не задан) не сливаются
+TRANSLATION_VERSIONS_COLLAPSE_SECONDS = float(os.getenv('TRANSLATION_VERSIONS_COLLAPSE_SECONDS', 0))
+
+async def _upsert_book(
+    cursor,
+    user_id: int,
+    title: str,
+    s3_key: str,
+    total_pages: int,
+    total_sentences: int,
+    content_hash: Optional[str]
+) -> int:
+    """Создает/обновляет запись книги"""
+    await cursor.execute(
+        """
+        INSERT INTO books (user_id, title, s3_key, total_pages, total_sentences, content_hash)
+        VALUES (%s, %s, %s, %s, %s, %s)
+        ON CONFLICT (user_id, s3_key)
+        DO UPDATE SET title = EXCLUDED.title,
+                      total_pages = EXCLUDED.total_pages,
+                      total_sentences = EXCLUDED.total_sentences,
+                      content_hash = EXCLUDED.content_hash
+        RETURNING id
+        """,
+        (user_id, title, s3_key, total_pages, total_sentences, content_hash)
+    )
+    return (await cursor.fetchone())['id']
+
+async def find_converted_book(cursor, content_hash: str, user_id: int, s3_key: str) -> Optional[dict]:
+    """
+    Ищет книгу, уже сконвертированную из DOCX с тем же SHA-256
+
+    Предпочитает книгу с тем же S3 ключом - тогда страницы вообще не нужно переписывать.
+    """
+    await cursor.execute(
+        """
+        SELECT id, total_pages, total_sentences
+        FROM books
+        WHERE content_hash = %s AND total_pages > 0
+        ORDER BY (user_id = %s AND s3_key = %s) DESC, uploaded_at DESC
+        LIMIT 1
+        """,
+        (content_hash, user_id, s3_key)
+    )
+    return await cursor.fetchone()
+
+async def _delete_extra_pages(cursor, book_id: int, total_pages: int) -> int:
+    """Удаляет страницы, которых больше нет в новой версии книги"""
+    await cursor.execute(
+        "DELETE FROM book_pages WHERE book_id = %s AND page_number > %s",
+        (book_id, total_pages)
+    )
+    return cursor.rowcount
+
+async def save_book_from_cache(
+    cursor,
+    user_id: int,
+    title: str,
+    s3_key: str,
+    source_book: dict,
+    content_hash: str
+) -> dict:
+    """
+    Сохраняет книгу, копируя страницы ранее сконвертированной книги
+
+    Если source_book - эта же книга, страницы не трогаются.
+
+    Returns:
+        {"book_id", "pages_written", "pages_deleted"}
+    """
+    book_id = await _upsert_book(
+        cursor, user_id, title, s3_key,
+        source_book['total_pages'], source_book['total_sentences'], content_hash
+    )
+
+    pages_written = 0
+    if book_id != source_book['id']:
+        await cursor.execute(
+            """
+            INSERT INTO book_pages (book_id, page_number, html_content)
+            SELECT %s, page_number, html_content
+            FROM book_pages
+            WHERE book_id = %s
+            ON CONFLICT (book_id, page_number)
+            DO UPDATE SET html_content = EXCLUDED.html_content
+            WHERE book_pages.html_content IS DISTINCT FROM EXCLUDED.html_content
+            """,
+            (book_id, source_book['id'])
+        )
+        pages_written = cursor.rowcount
+
+    return {
+        "book_id": book_id,
+        "pages_written": pages_written,
+        "pages_deleted": await _delete_extra_pages(cursor, book_id, source_book['total_pages'])
+    }
+
+async def load_book_pages(cursor, book_id: int) -> List[str]:
+    """HTML страниц книги по порядку"""
+    await cursor.execute(
+        "SELECT html_content FROM book_pages WHERE book_id = %s ORDER BY page_number",
+        (book_id,)
+    )
+    return [page['html_content'] for page in await cursor.fetchall()]
+
+async def save_book(
+    cursor,
+    user_id: int,
+    title: str,
+    s3_key: str,
+    pages: List[str],
+    total_sentences: int,
+    on_progress: Optional[Callable[[int, int], Awaitable[None]]] = None,
+    content_hash: Optional[str] = None
+) -> dict:
+    """
+    Создает/обновляет запись книги и сохраняет её страницы
+
+    Записываются только новые и изменившиеся страницы (по md5 HTML),
+    лишние страницы от прошлой версии удаляются.
+    Выполняется в транзакции вызывающего кода.
+
+    Args:
+        on_progress: вызывается после каждой пачки как on_progress(записано, всего_к_записи)
+        content_hash: SHA-256 исходного DOCX, по нему переиспользуется конвертация
+
+    Returns:
+        {"book_id", "pages_written", "pages_deleted"}
+    """
+    book_id = await _upsert_book(cursor, user_id, title, s3_key, len(pages), total_sentences, content_hash)
+
+    # Сравниваем с уже сохраненными страницами, чтобы не переписывать неизменные
+    await cursor.execute(
+        "SELECT page_number, md5(html_content) AS digest FROM book_pages WHERE book_id = %s",
+        (book_id,)
+    )
+    stored_digests = {row['page_number']: row['digest'] for row in await cursor.fetchall()}
+
+    changed_pages = [
+        (book_id, page_num, page_html)
+        for page_num, page_html in enumerate(pages, start=1)
+        if stored_digests.get(page_num) != hashlib.md5(page_html.encode('utf-8')).hexdigest()
+    ]
+
+    # Сохраняем изменившиеся страницы пачками
+    for start in range(0, len(changed_pages), PAGE_BATCH_SIZE):
+        batch = changed_pages[start:start + PAGE_BATCH_SIZE]
+        await cursor.executemany(
+            """
+            INSERT INTO book_pages (book_id, page_number, html_content)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (book_id, page_number)
+            DO UPDATE SET html_content = EXCLUDED.html_content
+            """,
+            batch
+        )
+        if on_progress:
+            await on_progress(start + len(batch), len(changed_pages))
+
+    return {
+        "book_id": book_id,
+        "pages_written": len(changed_pages),
+        "pages_deleted": await _delete_extra_pages(cursor, book_id, len(pages))
+    }
+
+async def save_translations(cursor, book_id: int, rows: List[tuple], overwrite: bool = True) -> List[dict]:
+    """
+    Сохраняет переводы предложений и их версии одним запросом (upsert + вставка версий)
+
+    Счетчик books.translated_sentences увеличивается на число новых предложений.
+    Версия, совпадающая с последней, не записывается; версия той же модели
+    в пределах TRANSLATION_VERSIONS_COLLAPSE_SECONDS от последней заменяет её
+    (окно отсчитывается заново). Версии без модели (ручные правки) не заменяются.
+    Затем у сохраненных переводов остается не больше TRANSLATION_VERSIONS_KEEP версий.
+
+    rows - кортежи (page_number, sentence_id, original_text, translation, model).
+    Повтор sentence_id в rows - сохраняется последний.
+    overwrite=False - предложения, у которых уже есть перевод, не трогаются.
+
+    Returns:
+        [{"id", "sentence_id"}] сохраненных переводов
+    """
+    rows = list({row[1]: row for row in rows}.values())
+    if not rows:
+        return []
+
+    only_missing = "" if overwrite else "WHERE translations.current_translation IS NULL"
+    await cursor.execute(
+        f"""
+        WITH items AS (
+            SELECT * FROM unnest(%s::int[], %s::text[], %s::text[], %s::text[], %s::text[])
+                AS t(page_number, sentence_id, original_text, translation, model)
+        ), saved AS (
+            INSERT INTO translations (book_id, page_number, sentence_id, original_text, current_translation)
+            SELECT %s, page_number, sentence_id, original_text, translation FROM items
+            ON CONFLICT (book_id, sentence_id)
+            DO UPDATE SET current_translation = EXCLUDED.current_translation, updated_at = CURRENT_TIMESTAMP
+            {only_missing}
+            RETURNING id, sentence_id, current_translation, (xmax = 0) AS inserted
+        ), latest AS (
+            SELECT DISTINCT ON (tv.translation_id) tv.id, tv.translation_id, tv.text, tv.model, tv.created_at
+            FROM translation_versions tv JOIN saved ON saved.id = tv.translation_id
+            ORDER BY tv.translation_id, tv.created_at DESC, tv.id DESC
+        ), changes AS (
+            SELECT saved.id AS translation_id, saved.current_translation AS text, items.model,
+                   latest.id AS latest_id,
+                   latest.text IS NOT DISTINCT FROM saved.current_translation AS duplicate,
+                   %s > 0 AND latest.id IS NOT NULL AND items.model IS NOT NULL
+                       AND latest.model = items.model AND latest.created_at > CURRENT_TIMESTAMP - make_interval(secs => %s) AS collapse
+            FROM saved
+            JOIN items USING (sentence_id)
+            LEFT JOIN latest ON latest.translation_id = saved.id
+        ), collapsed AS (
+            UPDATE translation_versions tv SET text = changes.text, created_at = CURRENT_TIMESTAMP
+            FROM changes
+            WHERE tv.id = changes.latest_id AND changes.collapse AND NOT changes.duplicate
+        ), versions AS (
+            INSERT INTO translation_versions (translation_id, text, model)
+            SELECT translation_id, text, model FROM changes
+            WHERE NOT changes.duplicate AND NOT changes.collapse
+        ), counters AS (
+            UPDATE books SET translated_sentences = translated_sentences + (SELECT COUNT(*) FROM saved WHERE inserted)
+            WHERE id = %s AND EXISTS (SELECT 1 FROM saved WHERE inserted)
+        )
+        SELECT id, sentence_id FROM saved
+        """,
+        (
+            [row[0] for row in rows],
+            [row[1] for row in rows],
+            [row[2] for row in rows],
+            [row[3] for row in rows],
+            [row[4] for row in rows],
+            book_id,
+            TRANSLATION_VERSIONS_COLLAPSE_SECONDS,
+            TRANSLATION_VERSIONS_COLLAPSE_SECONDS,
+            book_id
+        )
+    )
+    saved = await cursor.fetchall()
+    await prune_translation_versions(cursor, [row['id'] for row in saved])
+    return saved
+
+async def prune_translation_versions(cursor, translation_ids: List[int], keep: Optional[int] = None) -> int:
+    """
+    Оставляет у переводов translation_ids только keep последних версий
+    (по умолчанию TRANSLATION_VERSIONS_KEEP)
+
+    Returns:
+        сколько версий удалено
+    """
+    keep = TRANSLATION_VERSIONS_KEEP if keep is None else keep
+    if keep <= 0 or not translation_ids:
+        return 0
+
+    await cursor.execute(
+        """
+        DELETE FROM translation_versions tv
+        USING (
+            SELECT id, row_number() OVER (
+                PARTITION BY translation_id ORDER BY created_at DESC, id DESC
+            ) AS position
+            FROM translation_versions
+            WHERE translation_id = ANY(%s::int[])
+        ) ranked
+        WHERE tv.id = ranked.id AND ranked.position > %s
+        """,
+        (translation_ids, keep)
+    )
+    return cursor.rowcount
+
+async def prune_all_translation_versions(cursor, keep: Optional[int] = None) -> int:
+    """
+    То же, что prune_translation_versions, для всех переводов (разовая чистка истории)
+
+    Returns:
+        сколько версий удалено
+    """
+    keep = TRANSLATION_VERSIONS_KEEP if keep is None else keep
+    if keep <= 0:
+        return 0
+
+    await cursor.execute(
+        """
+        DELETE FROM translation_versions tv
+        USING (
+            SELECT id, row_number() OVER (
+                PARTITION BY translation_id ORDER BY created_at DESC, id DESC
+            ) AS position
+            FROM translation_versions
+        ) ranked
+        WHERE tv.id = ranked.id AND ranked.position > %s
+        """,
+        (keep,)
+    )
+    return cursor.rowcount
+
+async def dedupe_translation_versions(cursor) -> int:
+    """
+    Удаляет версии, повторяющие текст предыдущей версии того же перевода
+
+    Нужна для истории, записанной до дедупликации при сохранении.
+
+    Returns:
+        сколько версий удалено
+    """
+    await cursor.execute(
+        """
+        DELETE FROM translation_versions tv
+        USING (
+            SELECT id, text IS NOT DISTINCT FROM lag(text) OVER (
+                PARTITION BY translation_id ORDER BY created_at, id
+            ) AS repeated
+            FROM translation_versions
+        ) ordered
+        WHERE tv.id = ordered.id AND ordered.repeated
+        """
+    )
+    return cursor.rowcount
+
+async def approve_translations(
+    cursor,
+    book_id: int,
+    sentence_ids: Optional[List[str]] = None,
+    page_number: Optional[int] = None
+) -> List[dict]:
+    """
+    Одобряет переводы одним UPDATE: по списку sentence_id, по странице или всю книгу
+
+    Без sentence_ids и page_number одобряются все переводы книги.
+    Счетчики book_pages.approved_sentences и books.approved_sentences увеличиваются
+    в том же запросе только на действительно одобренные сейчас предложения.
+
+    Returns:
+        [{"page_number", "approved", "approved_sentences"}] по затронутым страницам
+    """
+    conditions = ""
+    params = [book_id]
+    if sentence_ids is not None:
+        conditions += " AND sentence_id = ANY(%s::text[])"
+        params.append(list(sentence_ids))
+    if page_number is not None:
+        conditions += " AND page_number = %s"
+        params.append(page_number)
+    params += [book_id, book_id]
+
+    await cursor.execute(
+        f"""
+        WITH approved AS (
+            UPDATE translations SET is_approved = TRUE
+            WHERE book_id = %s AND is_approved IS NOT TRUE{conditions}
+            RETURNING page_number
+        ), counts AS (
+            SELECT page_number, COUNT(*) AS approved FROM approved GROUP BY page_number
+        ), pages AS (
+            UPDATE book_pages p SET approved_sentences = p.approved_sentences + counts.approved
+            FROM counts
+            WHERE p.book_id = %s AND p.page_number = counts.page_number
+            RETURNING p.page_number, p.approved_sentences
+        ), book_counter AS (
+            UPDATE books SET approved_sentences = approved_sentences + (SELECT COUNT(*) FROM approved)
+            WHERE id = %s AND EXISTS (SELECT 1 FROM approved)
+        )
+        SELECT counts.page_number, counts.approved, pages.approved_sentences
+        FROM counts LEFT JOIN pages USING (page_number)
+        ORDER BY counts.page_number
+        """,
+        params
+    )
+    return await cursor.fetchall()
+
+async def reconcile_book_counters(cursor, book_id: Optional[int] = None) -> dict:
+    """
+    Пересчитывает счетчики переведенных/одобренных предложений по таблице translations
+
+    Исправляет расхождения в books и book_pages (например, после ручных правок в БД).
+    Без book_id проверяются все книги.
+
+    Returns:
+        {"books": сколько книг исправлено, "pages": сколько страниц исправлено}
+    """
+    await cursor.execute(
+        """
+        UPDATE books b SET translated_sentences = c.translated, approved_sentences = c.approved
+        FROM (
+            SELECT b.id, COUNT(t.id) AS translated, COUNT(t.id) FILTER (WHERE t.is_approved) AS approved
+            FROM books b LEFT JOIN translations t ON t.book_id = b.id
+            WHERE %s::int IS NULL OR b.id = %s
+            GROUP BY b.id
+        ) c
+        WHERE b.id = c.id
+          AND (b.translated_sentences, b.approved_sentences) IS DISTINCT FROM (c.translated, c.approved)
+        """,
+        (book_id, book_id)
+    )
+    books_fixed = cursor.rowcount
+
+    await cursor.execute(
+        """
+        UPDATE book_pages p SET approved_sentences = c.approved
+        FROM (
+            SELECT p.id, COUNT(t.id) AS approved
+            FROM book_pages p
+            LEFT JOIN translations t
+                ON t.book_id = p.book_id AND t.page_number = p.page_number AND t.is_approved
+            WHERE %s::int IS NULL OR p.book_id = %s
+            GROUP BY p.id
+        ) c
+        WHERE p.id = c.id AND p.approved_sentences <> c.approved
+        """,
+        (book_id, book_id)
+    )
+    return {"books": books_fixed, "pages": cursor.rowcount}
+
+async def _reconcile_command(book_id: Optional[int]):
+    await async_db_pool.open(wait=True)
+    try:
+        async with get_async_db_connection() as conn:
+            fixed = await reconcile_book_counters(conn.cursor(), book_id)
+        print(f"[OK] Book counters reconciled: {fixed['books']} book(s), {fixed['pages']} page(s) fixed")
+    finally:
+        await async_db_pool.close()
+
+async def _prune_versions_command(keep: Optional[int]):
+    await async_db_pool.open(wait=True)
+    try:
+        async with get_async_db_connection() as conn:
+            cursor = conn.cursor()
+            repeated = await dedupe_translation_versions(cursor)
+            pruned = await prune_all_translation_versions(cursor, keep)
+        print(f"[OK] Translation versions pruned: {repeated} repeated, {pruned} over the limit")
+    finally:
+        await async_db_pool.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Хранение книг")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    reconcile_parser = subparsers.add_parser("reconcile", help="пересчитать счетчики переводов книг")
+    reconcile_parser.add_argument("--book", type=int, help="id книги (по умолчанию все книги)")
+    prune_parser = subparsers.add_parser("prune-versions", help="удалить повторы и лишние версии переводов")
+    prune_parser.add_argument("--keep", type=int,
+                              help="сколько последних версий оставить (по умолчанию TRANSLATION_VERSIONS_KEEP)")
+    args = parser.parse_args()
+
+    if args.command == "reconcile":
+        asyncio.run(_reconcile_command(args.book))
+    else:
+        asyncio.run(_prune_versions_command(args.keep))
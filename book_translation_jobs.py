@@ -0,0 +1,327 @@
+"""
+Фоновый перевод всей книги
+
+Задача проходит по страницам книги, берет предложения без перевода,
+переводит их пакетами (память переводов, группировка по токенам и общий
+лимит одновременных запросов из batch_translation) и сохраняет переводы
+и версии несколькими строками за раз. Прогресс и последняя обработанная
+страница хранятся в book_translation_jobs, поэтому задача продолжается
+после перезапуска и может быть отменена.
+"""
+import asyncio
+import os
+from collections import namedtuple
+from typing import List, Optional
+from bs4 import BeautifulSoup
+from dotenv import load_dotenv
+from database import get_async_db_connection
+from batch_translation import translate_batch
+from book_storage import save_translations
+
+load_dotenv()
+
+# Сколько страниц переводится за один шаг задачи
+BOOK_TRANSLATION_PAGES_PER_STEP = int(os.getenv('BOOK_TRANSLATION_PAGES_PER_STEP', 5))
+BOOK_TRANSLATION_JOB_STALE_SECONDS = int(os.getenv('BOOK_TRANSLATION_JOB_STALE_SECONDS', 600))
+BOOK_TRANSLATION_JOB_MAX_ATTEMPTS = int(os.getenv('BOOK_TRANSLATION_JOB_MAX_ATTEMPTS', 3))
+BOOK_TRANSLATION_JOB_RETRY_DELAY_SECONDS = int(os.getenv('BOOK_TRANSLATION_JOB_RETRY_DELAY_SECONDS', 10))
+
+ACTIVE_STATUSES = ('pending', 'processing')
+
+Sentence = namedtuple('Sentence', ['sentence_id', 'page_number', 'text'])
+
+# Запущенные задачи по ID, чтобы их не собрал сборщик мусора и можно было отменить
+_running_tasks = {}
+
+def extract_sentences(page_number: int, html: str) -> List[Sentence]:
+    """Предложения страницы (span.sentence) с их текстом"""
+    soup = BeautifulSoup(html, 'html.parser')
+    sentences = []
+    for span in soup.find_all('span', {'class': 'sentence'}):
+        sentence_id = span.get('data-sentence-id')
+        text = span.get_text().strip()
+        if sentence_id and text:
+            sentences.append(Sentence(sentence_id, page_number, text))
+    return sentences
+
+async def create_book_translation_job(user_id: int, book_id: int, model: str,
+                                      source_language: str, target_language: str) -> Optional[dict]:
+    """
+    Создает задачу перевода книги
+
+    Если у книги уже есть активная задача, возвращает её.
+    """
+    async with get_async_db_connection() as conn:
+        cursor = conn.cursor()
+        await cursor.execute(
+            """
+            INSERT INTO book_translation_jobs
+                (user_id, book_id, model, source_language, target_language, total_sentences)
+            SELECT %s, id, %s, %s, %s, total_sentences FROM books WHERE id = %s
+            ON CONFLICT (book_id) WHERE status IN ('pending', 'processing') DO NOTHING
+            RETURNING id, status
+            """,
+            (user_id, model, source_language, target_language, book_id)
+        )
+        job = await cursor.fetchone()
+        if job:
+            return {"job_id": job['id'], "status": job['status'], "created": True}
+
+        await cursor.execute(
+            "SELECT id, status FROM book_translation_jobs WHERE book_id = %s AND status = ANY(%s)",
+            (book_id, list(ACTIVE_STATUSES))
+        )
+        job = await cursor.fetchone()
+        if not job:
+            return None
+        return {"job_id": job['id'], "status": job['status'], "created": False}
+
+async def get_book_translation_job(book_id: int, user_id: int) -> Optional[dict]:
+    """Последняя задача перевода книги пользователя"""
+    async with get_async_db_connection() as conn:
+        cursor = conn.cursor()
+        await cursor.execute(
+            """
+            SELECT id, book_id, model, source_language, target_language, status,
+                   total_sentences, translated_sentences, failed_sentences, last_page,
+                   error, attempts, created_at, updated_at
+            FROM book_translation_jobs
+            WHERE book_id = %s AND user_id = %s
+            ORDER BY created_at DESC
+            LIMIT 1
+            """,
+            (book_id, user_id)
+        )
+        job = await cursor.fetchone()
+
+    if job:
+        total = job['total_sentences']
+        job['progress'] = 100 if job['status'] == 'done' else (
+            min(99, job['translated_sentences'] * 100 // total) if total else 0
+        )
+    return job
+
+async def cancel_book_translation_job(book_id: int, user_id: int) -> Optional[int]:
+    """Отменяет активную задачу перевода книги. Уже сохраненные переводы остаются"""
+    async with get_async_db_connection() as conn:
+        cursor = conn.cursor()
+        await cursor.execute(
+            """
+            UPDATE book_translation_jobs
+            SET status = 'cancelled', updated_at = CURRENT_TIMESTAMP
+            WHERE book_id = %s AND user_id = %s AND status = ANY(%s)
+            RETURNING id
+            """,
+            (book_id, user_id, list(ACTIVE_STATUSES))
+        )
+        job = await cursor.fetchone()
+
+    if not job:
+        return None
+
+    # Задача этого процесса останавливается сразу, задача другого процесса -
+    # при следующем обновлении прогресса
+    task = _running_tasks.get(job['id'])
+    if task:
+        task.cancel()
+    return job['id']
+
+async def _claim_job(job_id: int) -> Optional[dict]:
+    """Захватывает задачу: ожидающую или брошенную другим процессом"""
+    async with get_async_db_connection() as conn:
+        cursor = conn.cursor()
+        await cursor.execute(
+            """
+            UPDATE book_translation_jobs
+            SET status = 'processing', attempts = attempts + 1, updated_at = CURRENT_TIMESTAMP
+            WHERE id = %s
+              AND (status = 'pending'
+                   OR (status = 'processing'
+                       AND updated_at < CURRENT_TIMESTAMP - make_interval(secs => %s)))
+            RETURNING id, user_id, book_id, model, source_language, target_language,
+                      last_page, attempts
+            """,
+            (job_id, BOOK_TRANSLATION_JOB_STALE_SECONDS)
+        )
+        return await cursor.fetchone()
+
+async def _load_step(book_id: int, first_page: int) -> tuple:
+    """
+    Предложения без перевода на следующих BOOK_TRANSLATION_PAGES_PER_STEP страницах
+
+    Returns:
+        (номер последней прочитанной страницы или None, список Sentence)
+    """
+    async with get_async_db_connection() as conn:
+        cursor = conn.cursor()
+        await cursor.execute(
+            """
+            SELECT page_number, html_content
+            FROM book_pages
+            WHERE book_id = %s AND page_number >= %s
+            ORDER BY page_number
+            LIMIT %s
+            """,
+            (book_id, first_page, BOOK_TRANSLATION_PAGES_PER_STEP)
+        )
+        pages = await cursor.fetchall()
+        if not pages:
+            return None, []
+
+        sentences = []
+        for page in pages:
+            sentences.extend(extract_sentences(page['page_number'], page['html_content']))
+
+        await cursor.execute(
+            """
+            SELECT sentence_id FROM translations
+            WHERE book_id = %s AND sentence_id = ANY(%s) AND current_translation IS NOT NULL
+            """,
+            (book_id, [sentence.sentence_id for sentence in sentences])
+        )
+        translated = {row['sentence_id'] for row in await cursor.fetchall()}
+
+    return pages[-1]['page_number'], [s for s in sentences if s.sentence_id not in translated]
+
+async def _save_step(job: dict, sentences: List[Sentence], results: list) -> int:
+    """
+    Сохраняет переводы шага: translations и translation_versions в одной транзакции
+
+    Предложение, которое пользователь успел перевести сам, не перезаписывается.
+    """
+    translated = [
+        (sentence, result['text'])
+        for sentence, result in zip(sentences, results)
+        if result['success']
+    ]
+    if not translated:
+        return 0
+
+    async with get_async_db_connection() as conn:
+        cursor = conn.cursor()
+        saved = await save_translations(
+            cursor,
+            job['book_id'],
+            [
+                (sentence.page_number, sentence.sentence_id, sentence.text, text, job['model'])
+                for sentence, text in translated
+            ],
+            overwrite=False
+        )
+        return len(saved)
+
+async def _record_progress(job: dict, last_page: int, failed: int) -> bool:
+    """
+    Сохраняет прогресс (заодно служит heartbeat)
+
+    Число переведенных предложений берется из счетчика books.translated_sentences,
+    который ведет save_translations, а не пересчитывается по translations.
+
+    Returns:
+        False, если задача была отменена
+    """
+    async with get_async_db_connection() as conn:
+        cursor = conn.cursor()
+        await cursor.execute(
+            """
+            UPDATE book_translation_jobs
+            SET last_page = %s,
+                failed_sentences = failed_sentences + %s,
+                translated_sentences = (SELECT translated_sentences FROM books WHERE id = %s),
+                updated_at = CURRENT_TIMESTAMP
+            WHERE id = %s AND status = 'processing'
+            RETURNING id
+            """,
+            (last_page, failed, job['book_id'], job['id'])
+        )
+        return await cursor.fetchone() is not None
+
+async def _finish_job(job_id: int, status: str, error: str = None):
+    async with get_async_db_connection() as conn:
+        cursor = conn.cursor()
+        await cursor.execute(
+            """
+            UPDATE book_translation_jobs
+            SET status = %s, error = %s, updated_at = CURRENT_TIMESTAMP
+            WHERE id = %s AND status = 'processing'
+            """,
+            (status, error, job_id)
+        )
+
+async def run_book_translation_job(job_id: int):
+    """Выполняет задачу перевода книги"""
+    job = await _claim_job(job_id)
+    if not job:
+        # Задачу уже выполняет другой процесс, она завершена или отменена
+        return
+
+    try:
+        next_page = job['last_page'] + 1
+        while True:
+            last_page, sentences = await _load_step(job['book_id'], next_page)
+            if last_page is None:
+                break
+
+            failed = 0
+            if sentences:
+                result = await translate_batch(
+                    sentences, job['source_language'], job['target_language'], job['model']
+                )
+                await _save_step(job, sentences, result['results'])
+                failed = result['failed']
+
+            if not await _record_progress(job, last_page, failed):
+                print(f"[BOOK TRANSLATION] Job {job_id} cancelled")
+                return
+            next_page = last_page + 1
+
+        await _finish_job(job_id, 'done')
+    except Exception as e:
+        print(f"[BOOK TRANSLATION] Job {job_id} failed (attempt {job['attempts']}): {str(e)}")
+        if job['attempts'] >= BOOK_TRANSLATION_JOB_MAX_ATTEMPTS:
+            await _finish_job(job_id, 'failed', str(e))
+            return
+
+        # Повторяем позже с последней сохраненной страницы
+        await _finish_job(job_id, 'pending', str(e))
+        await asyncio.sleep(BOOK_TRANSLATION_JOB_RETRY_DELAY_SECONDS * job['attempts'])
+        start_book_translation_job(job_id)
+
+def _forget_task(job_id: int, task: asyncio.Task):
+    """Убирает завершенную задачу, если её уже не сменил повтор той же задачи"""
+    if _running_tasks.get(job_id) is task:
+        del _running_tasks[job_id]
+
+def start_book_translation_job(job_id: int):
+    """Запускает задачу в фоне текущего event loop"""
+    task = asyncio.create_task(run_book_translation_job(job_id))
+    _running_tasks[job_id] = task
+    task.add_done_callback(lambda done: _forget_task(job_id, done))
+
+async def _find_resumable_jobs() -> list:
+    async with get_async_db_connection() as conn:
+        cursor = conn.cursor()
+        await cursor.execute(
+            """
+            SELECT id FROM book_translation_jobs
+            WHERE status = 'pending'
+               OR (status = 'processing'
+                   AND updated_at < CURRENT_TIMESTAMP - make_interval(secs => %s))
+            ORDER BY created_at
+            """,
+            (BOOK_TRANSLATION_JOB_STALE_SECONDS,)
+        )
+        return [row['id'] for row in await cursor.fetchall()]
+
+async def resume_book_translation_jobs():
+    """Подхватывает незавершенные задачи после перезапуска"""
+    try:
+        job_ids = await _find_resumable_jobs()
+    except Exception as e:
+        print(f"[WARNING] Failed to resume book translation jobs: {str(e)}")
+        return
+
+    for job_id in job_ids:
+        start_book_translation_job(job_id)
+    if job_ids:
+        print(f"[BOOK TRANSLATION] Resumed {len(job_ids)} job(s)")
@@ -1,78 +1,42 @@
 """
 Роуты для работы с книгами и переводами
 """
-from fastapi import APIRouter, UploadFile, File, HTTPException, Depends
+from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Query
 from pydantic import BaseModel
 from typing import List, Optional
-from database import get_db_connection
-from s3_storage import upload_file_to_s3, download_file_from_s3, delete_file_from_s3
+import hashlib
+import os
+from database import get_async_db_connection
+from s3_storage import upload_file_to_s3, download_file_from_s3, delete_file_from_s3, get_file_sha256_from_s3
 from auth import get_current_user
-import mammoth
-import io
-from bs4 import BeautifulSoup
-import re
+from docx_pipeline import process_book_docx
+from process_pool import docx_pool
+from book_storage import (
+    save_book,
+    find_converted_book,
+    save_book_from_cache,
+    load_book_pages,
+    save_translations,
+    approve_translations
+)
+from ingestion_jobs import create_ingestion_job, get_ingestion_job, start_ingestion_job
+from book_translation_jobs import (
+    extract_sentences,
+    create_book_translation_job,
+    get_book_translation_job,
+    cancel_book_translation_job,
+    start_book_translation_job
+)
+from translators import resolve_model
+from batch_translation import translate_as_completed
+from sse import stream_response
 
 router = APIRouter(prefix="/api/books", tags=["Books"])
 
-def wrap_sentences_in_html(html: str, sentence_counter: list = None) -> str:
-    """Оборачивает абзацы в span теги для подсветки с уникальными ID"""
-    if sentence_counter is None:
-        sentence_counter = [0]
-
-    soup = BeautifulSoup(html, 'html.parser')
-
-    # Ищем все параграфы и заголовки
-    for element in soup.find_all(['p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'li']):
-        # Пропускаем пустые элементы
-        if not element.get_text(strip=True):
-            continue
-        
-        sentence_counter[0] += 1
-        
-        # Извлекаем весь контент элемента (включая вложенные теги)
-        content = ''.join(str(child) for child in element.children)
-        
-        # Очищаем элемент и добавляем span с контентом
-        element.clear()
-        from bs4 import BeautifulSoup as BS
-        span = BS(f'<span class="sentence" data-sentence-id="sent-{sentence_counter[0]}">{content}</span>', 'html.parser')
-        element.append(span)
-    
-    return str(soup)
-
-def paginate_html(html: str, chars_per_page: int = 1800) -> List[str]:
-    """Разбивает HTML на страницы"""
-    soup = BeautifulSoup(html, 'html.parser')
-    
-    if soup.body:
-        elements = list(soup.body.children)
-    else:
-        elements = list(soup.children)
-    
-    pages = []
-    current_page = ''
-    current_chars = 0
-    
-    for element in elements:
-        if element.name is None:
-            continue
-            
-        element_html = str(element)
-        element_text = element.get_text()
-        element_length = len(element_text)
-        
-        if current_chars > 0 and current_chars + element_length > chars_per_page:
-            pages.append(current_page)
-            current_page = element_html
-            current_chars = element_length
-        else:
-            current_page += element_html
-            current_chars += element_length
-    
-    if current_page:
-        pages.append(current_page)
-    
-    return pages if pages else [html]
+# Сколько страниц можно запросить за один раз через /{book_id}/pages
+BOOK_PAGES_MAX_RANGE = int(os.getenv('BOOK_PAGES_MAX_RANGE', 20))
+# Сколько предложений можно сохранить за один запрос /translation/save-batch
+TRANSLATION_SAVE_BATCH_MAX_ITEMS = int(os.getenv('TRANSLATION_SAVE_BATCH_MAX_ITEMS', 1000))
 
 class TranslationSaveRequest(BaseModel):
     book_id: int
@@ -82,16 +46,55 @@ class TranslationSaveRequest(BaseModel):
     translation: str
     model: Optional[str] = None
 
+class TranslationSaveItem(BaseModel):
+    page_number: int
+    sentence_id: str
+    original_text: str
+    translation: str
+    model: Optional[str] = None
+
+class TranslationSaveBatchRequest(BaseModel):
+    book_id: int
+    items: List[TranslationSaveItem]
+
+class BookTranslateRequest(BaseModel):
+    source_language: str = "eng"
+    target_language: str = "kaz"
+    model: str = "kazllm"  # "kazllm", "claude" или "chatgpt"
+
+class PageTranslateRequest(BaseModel):
+    sentence_ids: Optional[List[str]] = None  # по умолчанию все предложения страницы
+    source_language: str = "eng"
+    target_language: str = "kaz"
+    model: str = "kazllm"  # "kazllm", "claude" или "chatgpt"
+
+class TranslationVersionsRequest(BaseModel):
+    book_id: int
+    sentence_ids: List[str]
+
 class ApproveTranslationRequest(BaseModel):
     book_id: int
     sentence_id: str
 
+class ApproveTranslationsBatchRequest(BaseModel):
+    book_id: int
+    # Ровно одно из трех: список предложений, страница или вся книга
+    sentence_ids: Optional[List[str]] = None
+    page_number: Optional[int] = None
+    whole_book: bool = False
+
 @router.post("/upload")
 async def upload_book(
     file: UploadFile = File(...),
+    background: bool = False,
     current_user: dict = Depends(get_current_user)
 ):
-    """Загрузка книги в S3, обработка и сохранение в БД"""
+    """
+    Загрузка книги в S3, обработка и сохранение в БД
+
+    С ?background=true возвращает job_id сразу после записи в S3,
+    прогресс обработки доступен через GET /api/books/jobs/{job_id}
+    """
     if not file.filename.endswith('.docx'):
         raise HTTPException(status_code=400, detail="Только DOCX файлы поддерживаются")
     
@@ -103,157 +106,196 @@ async def upload_book(
     # Создаем S3 ключ
     s3_key = f"users/{user_id}/books/{file.filename}"
     
+    # Хеш содержимого: по нему пропускаем повторную загрузку в S3 и конвертацию
+    content_hash = hashlib.sha256(file_content).hexdigest()
+    
     try:
-        # Загружаем в S3
-        upload_file_to_s3(
-            file_content, 
-            s3_key, 
-            'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
-        )
-        
-        # Конвертируем DOCX в HTML и обрабатываем
-        style_map = """
-        p[style-name='Heading 1'] => h1.heading-1:fresh
-        p[style-name='Heading 2'] => h2.heading-2:fresh
-        p[style-name='Heading 3'] => h3.heading-3:fresh
-        p[style-name='Title'] => h1.title:fresh
-        p[style-name='Subtitle'] => h2.subtitle:fresh
-        r[style-name='Strong'] => strong
-        p[style-name='Quote'] => blockquote:fresh
-        p[style-name='Normal'] => p.normal:fresh
-        p[style-name='Body Text'] => p.body-text:fresh
-        p[style-name='List Paragraph'] => p.list-paragraph:fresh
-        """
-        
-        result = mammoth.convert_to_html(
-            io.BytesIO(file_content),
-            style_map=style_map,
-            include_default_style_map=True,
-            include_embedded_style_map=True
-        )
-        html_content = result.value
-        
-        # Удаляем все изображения из HTML
-        soup = BeautifulSoup(html_content, 'html.parser')
-        for img in soup.find_all('img'):
-            img.decompose()
-        
-        # Обрабатываем пустые параграфы
-        paragraphs = soup.find_all('p')
-        for p in paragraphs:
-            if not p.get_text(strip=True):
-                p.string = '\u00a0'
-        html_content = str(soup)
-        
-        # Оборачиваем предложения в span для подсветки
-        html_with_spans = wrap_sentences_in_html(html_content)
-        
-        # Разбиваем на страницы
-        pages = paginate_html(html_with_spans)
+        # Загружаем в S3, если там еще нет объекта с таким же содержимым
+        if get_file_sha256_from_s3(s3_key) != content_hash:
+            upload_file_to_s3(
+                file_content, 
+                s3_key, 
+                'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+                metadata={'sha256': content_hash}
+            )
         
-        # Подсчитываем общее количество предложений
-        total_sentences = 0
-        for page_html in pages:
-            page_soup = BeautifulSoup(page_html, 'html.parser')
-            sentences = page_soup.find_all('span', {'class': 'sentence'})
-            total_sentences += len(sentences)
+        if background:
+            job_id = await create_ingestion_job(user_id, file.filename, s3_key, content_hash)
+            start_ingestion_job(job_id)
+            return {
+                "success": True,
+                "job_id": job_id,
+                "s3_key": s3_key,
+                "status": "pending"
+            }
         
-        # Сохраняем в БД
-        with get_db_connection() as conn:
+        # Если такой же DOCX уже конвертировался - берем готовые страницы
+        async with get_async_db_connection() as conn:
             cursor = conn.cursor()
-            
-            # Создаем/обновляем запись книги
-            cursor.execute(
-                """
-                INSERT INTO books (user_id, title, s3_key, total_pages, total_sentences) 
-                VALUES (%s, %s, %s, %s, %s) 
-                ON CONFLICT (user_id, s3_key) 
-                DO UPDATE SET title = EXCLUDED.title, 
-                              total_pages = EXCLUDED.total_pages,
-                              total_sentences = EXCLUDED.total_sentences
-                RETURNING id
-                """,
-                (user_id, file.filename, s3_key, len(pages), total_sentences)
-            )
-            book_id = cursor.fetchone()['id']
-            
-            # Удаляем старые страницы если они были
-            cursor.execute("DELETE FROM book_pages WHERE book_id = %s", (book_id,))
-            
-            # Сохраняем страницы
-            for page_num, page_html in enumerate(pages, start=1):
-                cursor.execute(
-                    """
-                    INSERT INTO book_pages (book_id, page_number, html_content)
-                    VALUES (%s, %s, %s)
-                    """,
-                    (book_id, page_num, page_html)
+            cached_book = await find_converted_book(cursor, content_hash, user_id, s3_key)
+            if cached_book:
+                saved = await save_book_from_cache(
+                    cursor, user_id, file.filename, s3_key, cached_book, content_hash
                 )
+                pages = await load_book_pages(cursor, saved['book_id'])
+                total_sentences = cached_book['total_sentences']
+        
+        if not cached_book:
+            # Конвертируем DOCX в HTML и за один проход удаляем изображения,
+            # оборачиваем предложения в span, разбиваем на страницы и считаем
+            # предложения - в пуле процессов, не блокируя event loop
+            pages, total_sentences = await docx_pool.run(process_book_docx, file_content)
             
-            conn.commit()
+            # Сохраняем в БД
+            async with get_async_db_connection() as conn:
+                cursor = conn.cursor()
+                saved = await save_book(
+                    cursor, user_id, file.filename, s3_key, pages, total_sentences,
+                    content_hash=content_hash
+                )
         
         return {
             "success": True,
-            "book_id": book_id,
+            "book_id": saved['book_id'],
             "s3_key": s3_key,
             "pages": pages,
             "total_pages": len(pages),
-            "total_sentences": total_sentences
+            "total_sentences": total_sentences,
+            "cached": bool(cached_book),
+            "pages_written": saved['pages_written'],
+            "pages_deleted": saved['pages_deleted']
         }
     
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка загрузки: {str(e)}")
 
+@router.get("/jobs/{job_id}")
+async def get_upload_job(job_id: int, current_user: dict = Depends(get_current_user)):
+    """Этап и прогресс фоновой обработки загруженной книги"""
+    job = await get_ingestion_job(job_id, current_user["user_id"])
+    
+    if not job:
+        raise HTTPException(status_code=404, detail="Задача не найдена")
+    
+    return {"job": job}
+
+def group_versions_by_sentence(versions: list) -> dict:
+    """Группирует версии переводов по sentence_id"""
+    versions_by_sentence = {}
+    for version in versions:
+        sentence_id = version['sentence_id']
+        if sentence_id not in versions_by_sentence:
+            versions_by_sentence[sentence_id] = []
+        versions_by_sentence[sentence_id].append({
+            'text': version['text'],
+            'model': version['model'],
+            'timestamp': int(version['created_at'].timestamp() * 1000)  # Конвертируем в миллисекунды
+        })
+    return versions_by_sentence
+
+async def get_owned_book(cursor, book_id: int, user_id: int) -> dict:
+    """Книга пользователя или 404"""
+    await cursor.execute(
+        "SELECT id, title, s3_key, total_pages, total_sentences FROM books WHERE id = %s AND user_id = %s",
+        (book_id, user_id)
+    )
+    book = await cursor.fetchone()
+    
+    if not book:
+        raise HTTPException(status_code=404, detail="Книга не найдена")
+    
+    return book
+
+def resolve_page_range(book: dict, page_from: int, page_to: Optional[int]) -> tuple:
+    """Проверяет диапазон страниц и обрезает его по размеру книги"""
+    if page_to is None:
+        page_to = page_from + BOOK_PAGES_MAX_RANGE - 1
+    
+    if page_to < page_from:
+        raise HTTPException(status_code=400, detail="Параметр to меньше from")
+    if page_to - page_from + 1 > BOOK_PAGES_MAX_RANGE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Можно запросить не более {BOOK_PAGES_MAX_RANGE} страниц за раз"
+        )
+    if page_from > book['total_pages']:
+        raise HTTPException(status_code=404, detail="Страницы не найдены")
+    
+    return page_from, min(page_to, book['total_pages'])
+
+async def load_page_range_translations(cursor, book_id: int, page_from: int, page_to: int) -> tuple:
+    """Переводы и версии переводов предложений со страниц from..to"""
+    await cursor.execute(
+        """
+        SELECT sentence_id, page_number, current_translation, is_approved 
+        FROM translations 
+        WHERE book_id = %s AND page_number BETWEEN %s AND %s
+        """,
+        (book_id, page_from, page_to)
+    )
+    translations = await cursor.fetchall()
+    
+    await cursor.execute(
+        """
+        SELECT t.sentence_id, tv.text, tv.model, tv.created_at
+        FROM translation_versions tv
+        JOIN translations t ON tv.translation_id = t.id
+        WHERE t.book_id = %s AND t.page_number BETWEEN %s AND %s
+        ORDER BY t.sentence_id, tv.created_at ASC
+        """,
+        (book_id, page_from, page_to)
+    )
+    versions = await cursor.fetchall()
+    
+    return {t['sentence_id']: t for t in translations}, group_versions_by_sentence(versions)
+
 @router.get("/list")
 async def list_books(current_user: dict = Depends(get_current_user)):
-    """Список книг пользователя с статистикой переводов"""
+    """Список книг пользователя с статистикой переводов (счетчики хранятся в books)"""
     user_id = current_user["user_id"]
     
-    with get_db_connection() as conn:
+    async with get_async_db_connection() as conn:
         cursor = conn.cursor()
-        cursor.execute(
+        await cursor.execute(
             """
-            SELECT 
-                b.id, 
-                b.title, 
-                b.s3_key, 
-                b.uploaded_at,
-                b.total_pages,
-                b.total_sentences,
-                COUNT(DISTINCT t.sentence_id) as translated_sentences
-            FROM books b
-            LEFT JOIN translations t ON b.id = t.book_id
-            WHERE b.user_id = %s 
-            GROUP BY b.id, b.title, b.s3_key, b.uploaded_at, b.total_pages, b.total_sentences
-            ORDER BY b.uploaded_at DESC
+            SELECT id, title, s3_key, uploaded_at, total_pages, total_sentences,
+                   translated_sentences, approved_sentences
+            FROM books
+            WHERE user_id = %s
+            ORDER BY uploaded_at DESC
             """,
             (user_id,)
         )
-        books = cursor.fetchall()
+        books = await cursor.fetchall()
     
     return {"books": books}
 
 @router.get("/{book_id}")
 async def get_book(book_id: int, current_user: dict = Depends(get_current_user)):
-    """Получить книгу и её переводы из БД"""
+    """
+    Получить книгу и её переводы из БД
+
+    История версий не отдается: её можно получить для нужных предложений
+    через /translation/versions или вместе со страницами через /{book_id}/pages.
+    """
     user_id = current_user["user_id"]
     
-    with get_db_connection() as conn:
+    async with get_async_db_connection() as conn:
         cursor = conn.cursor()
         
         # Получаем книгу
-        cursor.execute(
+        await cursor.execute(
             "SELECT id, title, s3_key, total_pages, total_sentences FROM books WHERE id = %s AND user_id = %s",
             (book_id, user_id)
         )
-        book = cursor.fetchone()
+        book = await cursor.fetchone()
         
         if not book:
             raise HTTPException(status_code=404, detail="Книга не найдена")
         
         # Загружаем страницы из БД
         try:
-            cursor.execute(
+            await cursor.execute(
                 """
                 SELECT page_number, html_content 
                 FROM book_pages 
@@ -262,7 +304,7 @@ async def get_book(book_id: int, current_user: dict = Depends(get_current_user))
                 """,
                 (book_id,)
             )
-            pages_data = cursor.fetchall()
+            pages_data = await cursor.fetchall()
             
             if not pages_data:
                 raise HTTPException(status_code=500, detail="Страницы книги не найдены в БД")
@@ -272,7 +314,7 @@ async def get_book(book_id: int, current_user: dict = Depends(get_current_user))
             raise HTTPException(status_code=500, detail=f"Ошибка загрузки: {str(e)}")
         
         # Получаем переводы
-        cursor.execute(
+        await cursor.execute(
             """
             SELECT sentence_id, page_number, current_translation, is_approved 
             FROM translations 
@@ -280,51 +322,186 @@ async def get_book(book_id: int, current_user: dict = Depends(get_current_user))
             """,
             (book_id,)
         )
-        translations = cursor.fetchall()
-        
-        # Получаем все версии переводов для всех предложений
-        versions_by_sentence = {}
-        try:
-            cursor.execute(
-                """
-                SELECT t.sentence_id, tv.text, tv.model, tv.created_at
-                FROM translation_versions tv
-                JOIN translations t ON tv.translation_id = t.id
-                WHERE t.book_id = %s
-                ORDER BY t.sentence_id, tv.created_at ASC
-                """,
-                (book_id,)
-            )
-            versions = cursor.fetchall()
-            
-            # Группируем версии по sentence_id
-            for version in versions:
-                sentence_id = version['sentence_id']
-                if sentence_id not in versions_by_sentence:
-                    versions_by_sentence[sentence_id] = []
-                versions_by_sentence[sentence_id].append({
-                    'text': version['text'],
-                    'model': version['model'],
-                    'timestamp': int(version['created_at'].timestamp() * 1000)  # Конвертируем в миллисекунды
-                })
-            
-            print(f"[DEBUG BACKEND] book_id={book_id}, translations={len(translations)}, versions_total={len(versions)}, versions_by_sentence={len(versions_by_sentence)}")
-            if versions_by_sentence:
-                first_key = list(versions_by_sentence.keys())[0]
-                print(f"[DEBUG BACKEND] Sample: {first_key} has {len(versions_by_sentence[first_key])} versions")
-        except Exception as e:
-            print(f"[WARNING] Failed to load translation versions: {str(e)}")
-            # Если таблица не существует или есть ошибка, продолжаем без версий
-            versions_by_sentence = {}
+        translations = await cursor.fetchall()
     
     return {
         "book": book,
         "pages": pages,
         "total_pages": len(pages),
-        "translations": {t['sentence_id']: t for t in translations},
-        "versions": versions_by_sentence
+        "translations": {t['sentence_id']: t for t in translations}
+    }
+
+@router.get("/{book_id}/pages")
+async def get_book_pages(
+    book_id: int,
+    page_from: int = Query(1, alias="from", ge=1),
+    page_to: Optional[int] = Query(None, alias="to", ge=1),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Страницы книги from..to (включительно) с их переводами и версиями
+
+    Позволяет подгружать книгу по мере прокрутки, а не целиком.
+    Без to возвращает до BOOK_PAGES_MAX_RANGE страниц начиная с from.
+    """
+    user_id = current_user["user_id"]
+    
+    async with get_async_db_connection() as conn:
+        cursor = conn.cursor()
+        book = await get_owned_book(cursor, book_id, user_id)
+        page_from, page_to = resolve_page_range(book, page_from, page_to)
+        
+        await cursor.execute(
+            """
+            SELECT page_number, html_content, approved_sentences 
+            FROM book_pages 
+            WHERE book_id = %s AND page_number BETWEEN %s AND %s
+            ORDER BY page_number
+            """,
+            (book_id, page_from, page_to)
+        )
+        pages = await cursor.fetchall()
+        
+        translations, versions = await load_page_range_translations(cursor, book_id, page_from, page_to)
+    
+    return {
+        "book": book,
+        "from": page_from,
+        "to": page_to,
+        "total_pages": book['total_pages'],
+        "pages": pages,
+        "translations": translations,
+        "versions": versions
+    }
+
+@router.get("/{book_id}/translations")
+async def get_book_translations(
+    book_id: int,
+    page_from: int = Query(1, alias="from", ge=1),
+    page_to: Optional[int] = Query(None, alias="to", ge=1),
+    current_user: dict = Depends(get_current_user)
+):
+    """Переводы и версии переводов для страниц from..to без HTML страниц"""
+    user_id = current_user["user_id"]
+    
+    async with get_async_db_connection() as conn:
+        cursor = conn.cursor()
+        book = await get_owned_book(cursor, book_id, user_id)
+        page_from, page_to = resolve_page_range(book, page_from, page_to)
+        translations, versions = await load_page_range_translations(cursor, book_id, page_from, page_to)
+    
+    return {
+        "from": page_from,
+        "to": page_to,
+        "translations": translations,
+        "versions": versions
     }
 
+@router.post("/{book_id}/pages/{page_number}/translate")
+async def translate_page_stream(
+    book_id: int,
+    page_number: int,
+    request: PageTranslateRequest,
+    format: str = Query("sse", pattern="^(sse|ndjson)$"),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Перевод предложений страницы потоком: каждое предложение отправляется сразу,
+    как только готов его перевод (в порядке готовности, а не в порядке на странице)
+
+    События (SSE или NDJSON с ?format=ndjson):
+        {"type": "start", "total": N}
+        {"type": "translation", "sentence_id", "text", "cached"}
+        {"type": "error", "sentence_id", "status_code", "error"}
+        {"type": "done", "translated", "failed", "cached"}
+    Переводы не сохраняются - это делает клиент, как и после /api/translate.
+    """
+    user_id = current_user["user_id"]
+    
+    async with get_async_db_connection() as conn:
+        cursor = conn.cursor()
+        await get_owned_book(cursor, book_id, user_id)
+        await cursor.execute(
+            "SELECT html_content FROM book_pages WHERE book_id = %s AND page_number = %s",
+            (book_id, page_number)
+        )
+        page = await cursor.fetchone()
+    
+    if not page:
+        raise HTTPException(status_code=404, detail="Страница не найдена")
+    
+    sentences = extract_sentences(page_number, page['html_content'])
+    if request.sentence_ids is not None:
+        requested = set(request.sentence_ids)
+        sentences = [sentence for sentence in sentences if sentence.sentence_id in requested]
+    
+    model = resolve_model(request.model)
+    
+    async def events():
+        yield {"type": "start", "total": len(sentences), "model": model}
+        translated = failed = cached = 0
+        async for result in translate_as_completed(
+            sentences, request.source_language, request.target_language, model
+        ):
+            success = result.pop("success")
+            if success:
+                translated += 1
+                cached += result["cached"]
+            else:
+                failed += 1
+            yield {"type": "translation" if success else "error", **result}
+        yield {"type": "done", "translated": translated, "failed": failed, "cached": cached}
+    
+    return stream_response(events(), format)
+
+@router.post("/{book_id}/translate")
+async def translate_book(
+    book_id: int,
+    request: BookTranslateRequest,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Запускает фоновый перевод всех непереведенных предложений книги
+
+    Если перевод книги уже идет, возвращает его задачу.
+    Прогресс - GET /api/books/{book_id}/translate.
+    """
+    user_id = current_user["user_id"]
+    
+    async with get_async_db_connection() as conn:
+        cursor = conn.cursor()
+        await get_owned_book(cursor, book_id, user_id)
+    
+    job = await create_book_translation_job(
+        user_id, book_id, resolve_model(request.model), request.source_language, request.target_language
+    )
+    if not job:
+        raise HTTPException(status_code=404, detail="Книга не найдена")
+    if job["created"]:
+        start_book_translation_job(job["job_id"])
+    
+    return {"success": True, **job}
+
+@router.get("/{book_id}/translate")
+async def get_book_translation_status(book_id: int, current_user: dict = Depends(get_current_user)):
+    """Состояние и прогресс последнего перевода книги"""
+    job = await get_book_translation_job(book_id, current_user["user_id"])
+    
+    if not job:
+        raise HTTPException(status_code=404, detail="Задача не найдена")
+    
+    return {"job": job}
+
+@router.post("/{book_id}/translate/cancel")
+async def cancel_book_translation(book_id: int, current_user: dict = Depends(get_current_user)):
+    """Отменяет перевод книги, уже сохраненные переводы остаются"""
+    job_id = await cancel_book_translation_job(book_id, current_user["user_id"])
+    
+    if not job_id:
+        raise HTTPException(status_code=404, detail="Активная задача не найдена")
+    
+    return {"success": True, "job_id": job_id, "status": "cancelled"}
+
 @router.post("/translation/save")
 async def save_translation(
     request: TranslationSaveRequest,
@@ -333,42 +510,74 @@ async def save_translation(
     """Сохранить перевод предложения"""
     user_id = current_user["user_id"]
     
-    with get_db_connection() as conn:
+    async with get_async_db_connection() as conn:
         cursor = conn.cursor()
         
         # Проверяем что книга принадлежит пользователю
-        cursor.execute(
+        await cursor.execute(
             "SELECT id FROM books WHERE id = %s AND user_id = %s",
             (request.book_id, user_id)
         )
-        if not cursor.fetchone():
+        if not await cursor.fetchone():
             raise HTTPException(status_code=403, detail="Доступ запрещен")
         
-        # Сохраняем или обновляем перевод
-        cursor.execute(
-            """
-            INSERT INTO translations (book_id, page_number, sentence_id, original_text, current_translation)
-            VALUES (%s, %s, %s, %s, %s)
-            ON CONFLICT (book_id, sentence_id) 
-            DO UPDATE SET current_translation = EXCLUDED.current_translation, updated_at = CURRENT_TIMESTAMP
-            RETURNING id
-            """,
-            (request.book_id, request.page_number, request.sentence_id, request.original_text, request.translation)
+        # Сохраняем или обновляем перевод и добавляем версию в историю
+        saved = await save_translations(
+            cursor,
+            request.book_id,
+            [(request.page_number, request.sentence_id, request.original_text, request.translation, request.model)]
         )
-        translation_id = cursor.fetchone()['id']
+        translation_id = saved[0]['id']
         
-        # Добавляем версию в историю
-        cursor.execute(
-            """
-            INSERT INTO translation_versions (translation_id, text, model)
-            VALUES (%s, %s, %s)
-            """,
-            (translation_id, request.translation, request.model)
+        await conn.commit()
+    
+    return {"success": True, "translation_id": translation_id}
+
+@router.post("/translation/save-batch")
+async def save_translations_batch(
+    request: TranslationSaveBatchRequest,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Сохранить переводы нескольких предложений (например, всей страницы) за один запрос
+
+    Переводы и версии записываются в одной транзакции: либо все, либо ничего.
+    """
+    user_id = current_user["user_id"]
+    
+    if len(request.items) > TRANSLATION_SAVE_BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Слишком много предложений: не больше {TRANSLATION_SAVE_BATCH_MAX_ITEMS} за запрос"
+        )
+    
+    async with get_async_db_connection() as conn:
+        cursor = conn.cursor()
+        
+        # Проверяем что книга принадлежит пользователю (один раз на весь пакет)
+        await cursor.execute(
+            "SELECT id FROM books WHERE id = %s AND user_id = %s",
+            (request.book_id, user_id)
         )
+        if not await cursor.fetchone():
+            raise HTTPException(status_code=403, detail="Доступ запрещен")
         
-        conn.commit()
+        saved = await save_translations(
+            cursor,
+            request.book_id,
+            [
+                (item.page_number, item.sentence_id, item.original_text, item.translation, item.model)
+                for item in request.items
+            ]
+        )
+        
+        await conn.commit()
     
-    return {"success": True, "translation_id": translation_id}
+    return {
+        "success": True,
+        "saved": len(saved),
+        "translation_ids": {row['sentence_id']: row['id'] for row in saved}
+    }
 
 @router.get("/translation/{book_id}/history")
 async def get_translation_history(
@@ -379,19 +588,19 @@ async def get_translation_history(
     """Получить историю версий перевода"""
     user_id = current_user["user_id"]
     
-    with get_db_connection() as conn:
+    async with get_async_db_connection() as conn:
         cursor = conn.cursor()
         
         # Проверяем доступ
-        cursor.execute(
+        await cursor.execute(
             "SELECT id FROM books WHERE id = %s AND user_id = %s",
             (book_id, user_id)
         )
-        if not cursor.fetchone():
+        if not await cursor.fetchone():
             raise HTTPException(status_code=403, detail="Доступ запрещен")
         
         # Получаем историю
-        cursor.execute(
+        await cursor.execute(
             """
             SELECT tv.text, tv.model, tv.created_at
             FROM translation_versions tv
@@ -401,10 +610,49 @@ async def get_translation_history(
             """,
             (book_id, sentence_id)
         )
-        history = cursor.fetchall()
+        history = await cursor.fetchall()
     
     return {"history": history}
 
+@router.post("/translation/versions")
+async def get_translation_versions(
+    request: TranslationVersionsRequest,
+    current_user: dict = Depends(get_current_user)
+):
+    """Версии переводов только для запрошенных предложений"""
+    user_id = current_user["user_id"]
+    
+    if len(request.sentence_ids) > TRANSLATION_SAVE_BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Слишком много предложений: не больше {TRANSLATION_SAVE_BATCH_MAX_ITEMS} за запрос"
+        )
+    
+    async with get_async_db_connection() as conn:
+        cursor = conn.cursor()
+        
+        # Проверяем доступ
+        await cursor.execute(
+            "SELECT id FROM books WHERE id = %s AND user_id = %s",
+            (request.book_id, user_id)
+        )
+        if not await cursor.fetchone():
+            raise HTTPException(status_code=403, detail="Доступ запрещен")
+        
+        await cursor.execute(
+            """
+            SELECT t.sentence_id, tv.text, tv.model, tv.created_at
+            FROM translations t
+            JOIN translation_versions tv ON tv.translation_id = t.id
+            WHERE t.book_id = %s AND t.sentence_id = ANY(%s::text[])
+            ORDER BY t.sentence_id, tv.created_at ASC
+            """,
+            (request.book_id, request.sentence_ids)
+        )
+        versions = await cursor.fetchall()
+    
+    return {"versions": group_versions_by_sentence(versions)}
+
 @router.post("/translation/approve")
 async def approve_translation(
     request: ApproveTranslationRequest,
@@ -413,44 +661,88 @@ async def approve_translation(
     """Одобрить перевод"""
     user_id = current_user["user_id"]
     
-    with get_db_connection() as conn:
+    async with get_async_db_connection() as conn:
         cursor = conn.cursor()
         
         # Проверяем доступ
-        cursor.execute(
+        await cursor.execute(
             "SELECT id FROM books WHERE id = %s AND user_id = %s",
             (request.book_id, user_id)
         )
-        if not cursor.fetchone():
+        if not await cursor.fetchone():
             raise HTTPException(status_code=403, detail="Доступ запрещен")
         
-        # Обновляем статус
-        cursor.execute(
-            """
-            UPDATE translations 
-            SET is_approved = TRUE
-            WHERE book_id = %s AND sentence_id = %s
-            """,
-            (request.book_id, request.sentence_id)
-        )
-        conn.commit()
+        # Обновляем статус (и счетчик одобренных на странице)
+        await approve_translations(cursor, request.book_id, sentence_ids=[request.sentence_id])
+        await conn.commit()
     
     return {"success": True}
 
+@router.post("/translation/approve-batch")
+async def approve_translations_batch(
+    request: ApproveTranslationsBatchRequest,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Одобрить переводы списка предложений, страницы или всей книги одним запросом
+
+    Returns:
+        approved - сколько переводов одобрено сейчас (уже одобренные не считаются),
+        pages - число одобренных предложений на каждой затронутой странице
+    """
+    user_id = current_user["user_id"]
+    
+    selectors = (request.sentence_ids is not None) + (request.page_number is not None) + request.whole_book
+    if selectors != 1:
+        raise HTTPException(
+            status_code=400,
+            detail="Укажите ровно одно из полей: sentence_ids, page_number или whole_book"
+        )
+    if request.sentence_ids is not None and len(request.sentence_ids) > TRANSLATION_SAVE_BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Слишком много предложений: не больше {TRANSLATION_SAVE_BATCH_MAX_ITEMS} за запрос"
+        )
+    
+    async with get_async_db_connection() as conn:
+        cursor = conn.cursor()
+        
+        # Проверяем доступ
+        await cursor.execute(
+            "SELECT id FROM books WHERE id = %s AND user_id = %s",
+            (request.book_id, user_id)
+        )
+        if not await cursor.fetchone():
+            raise HTTPException(status_code=403, detail="Доступ запрещен")
+        
+        pages = await approve_translations(
+            cursor,
+            request.book_id,
+            sentence_ids=request.sentence_ids,
+            page_number=request.page_number
+        )
+        await conn.commit()
+    
+    return {
+        "success": True,
+        "approved": sum(page['approved'] for page in pages),
+        "pages": {page['page_number']: page['approved_sentences'] for page in pages}
+    }
+
 @router.delete("/{book_id}")
 async def delete_book(book_id: int, current_user: dict = Depends(get_current_user)):
     """Удалить книгу"""
     user_id = current_user["user_id"]
     
-    with get_db_connection() as conn:
+    async with get_async_db_connection() as conn:
         cursor = conn.cursor()
         
         # Получаем книгу
-        cursor.execute(
+        await cursor.execute(
             "SELECT s3_key FROM books WHERE id = %s AND user_id = %s",
             (book_id, user_id)
         )
-        book = cursor.fetchone()
+        book = await cursor.fetchone()
         
         if not book:
             raise HTTPException(status_code=404, detail="Книга не найдена")
@@ -459,7 +751,7 @@ async def delete_book(book_id: int, current_user: dict = Depends(get_current_use
         delete_file_from_s3(book['s3_key'])
         
         # Удаляем из БД (каскадное удаление переводов)
-        cursor.execute("DELETE FROM books WHERE id = %s", (book_id,))
-        conn.commit()
+        await cursor.execute("DELETE FROM books WHERE id = %s", (book_id,))
+        await conn.commit()
     
     return {"success": True}
@@ -0,0 +1,138 @@
+"""
+Потоковые ответы Claude и ChatGPT в виде SSE
+
+События клиенту:
+    data: {"type": "delta", "text": "..."}         - очередной фрагмент ответа
+    data: {"type": "done", "model": ..., "usage": {...}}  - конец ответа и расход токенов
+    data: {"type": "error", "detail": "..."}       - ошибка после начала потока
+
+Соединение с внешним API открывается до ответа клиенту, поэтому ошибки
+авторизации и лимитов возвращаются обычным HTTP статусом.
+"""
+import json
+import os
+from typing import AsyncIterator
+import openai
+from fastapi import HTTPException
+from http_clients import http_clients
+from sse import sse_event, iter_sse_data
+
+async def open_claude_stream(model: str, system_prompt: str, message: str,
+                             temperature: float, max_tokens: int) -> AsyncIterator[str]:
+    """Открывает поток Claude Messages API и возвращает генератор событий SSE"""
+    CLAUDE_API_KEY = os.getenv('CLAUDE_API_KEY')
+    CLAUDE_API_URL = os.getenv('CLAUDE_API_URL', 'https://api.anthropic.com/v1/messages')
+
+    if not CLAUDE_API_KEY:
+        raise HTTPException(status_code=500, detail="Claude API key not configured")
+
+    client = http_clients.claude
+    upstream_request = client.build_request(
+        "POST",
+        CLAUDE_API_URL,
+        headers={
+            'x-api-key': CLAUDE_API_KEY,
+            'anthropic-version': '2023-06-01',
+            'Content-Type': 'application/json',
+        },
+        json={
+            'model': model,
+            'max_tokens': max_tokens,
+            'temperature': temperature,
+            'system': system_prompt,
+            'stream': True,
+            'messages': [{
+                'role': 'user',
+                'content': message
+            }]
+        }
+    )
+    response = await client.send(upstream_request, stream=True)
+
+    if response.status_code != 200:
+        body = await response.aread()
+        await response.aclose()
+        raise HTTPException(
+            status_code=response.status_code,
+            detail=f"Claude API error: {body.decode('utf-8', errors='replace')}"
+        )
+
+    async def events():
+        usage = {"input_tokens": 0, "output_tokens": 0}
+        try:
+            async for data in iter_sse_data(response.aiter_lines()):
+                event = json.loads(data)
+                event_type = event.get('type')
+                if event_type == 'message_start':
+                    usage.update(event['message'].get('usage', {}))
+                elif event_type == 'content_block_delta' and event['delta'].get('type') == 'text_delta':
+                    yield sse_event({"type": "delta", "text": event['delta']['text']})
+                elif event_type == 'message_delta':
+                    usage.update(event.get('usage', {}))
+                elif event_type == 'error':
+                    yield sse_event({"type": "error", "detail": f"Claude API error: {event['error']}"})
+                    return
+
+            yield sse_event({
+                "type": "done",
+                "model": model,
+                "usage": {
+                    "input_tokens": usage.get('input_tokens', 0),
+                    "output_tokens": usage.get('output_tokens', 0)
+                }
+            })
+        except Exception as e:
+            yield sse_event({"type": "error", "detail": f"Error communicating with Claude: {str(e)}"})
+        finally:
+            await response.aclose()
+
+    return events()
+
+async def open_chatgpt_stream(model: str, system_prompt: str, message: str,
+                              temperature: float, max_tokens: int) -> AsyncIterator[str]:
+    """Открывает поток ChatGPT Chat Completions и возвращает генератор событий SSE"""
+    OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+
+    if not OPENAI_API_KEY:
+        raise HTTPException(status_code=500, detail="OpenAI API key not configured")
+
+    try:
+        stream = await http_clients.openai.chat.completions.create(
+            model=model,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": message}
+            ],
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+    except openai.APIStatusError as e:
+        # Статус OpenAI (401, 429, ...) отдаем как есть, до начала потока
+        raise HTTPException(status_code=e.status_code, detail=f"ChatGPT API error: {str(e)}")
+
+    async def events():
+        usage = None
+        try:
+            async for chunk in stream:
+                if chunk.usage:
+                    usage = chunk.usage
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield sse_event({"type": "delta", "text": chunk.choices[0].delta.content})
+
+            yield sse_event({
+                "type": "done",
+                "model": model,
+                "usage": {
+                    "prompt_tokens": usage.prompt_tokens if usage else 0,
+                    "completion_tokens": usage.completion_tokens if usage else 0,
+                    "total_tokens": usage.total_tokens if usage else 0
+                }
+            })
+        except Exception as e:
+            yield sse_event({"type": "error", "detail": f"Error communicating with ChatGPT: {str(e)}"})
+        finally:
+            await stream.close()
+
+    return events()
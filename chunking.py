@@ -0,0 +1,70 @@
+"""
+Разбивка длинного текста на части для перевода
+
+Текст режется по границам предложений (и абзацев) так, чтобы каждая часть
+укладывалась в бюджет токенов модели. Предложение больше бюджета режется
+по словам. Токены оцениваются локально (estimate_tokens), без обращения к сети.
+Разделители между частями сохраняются, чтобы собрать перевод в исходном виде.
+"""
+import re
+from typing import List, Tuple
+from translators import estimate_tokens
+
+# Пробелы после конца предложения (с закрывающей кавычкой или скобкой) или перевод строки
+_SENTENCE_BREAK = re.compile(
+    r'((?:(?<=[.!?…])|(?<=[.!?…][»"\'”’)\]]))\s+|\s*\n\s*)'
+)
+_WORD_BREAK = re.compile(r'(\s+)')
+
+def _pieces(text: str, pattern: re.Pattern) -> List[Tuple[str, str]]:
+    """Куски текста с разделителем после каждого"""
+    parts = pattern.split(text)
+    return [
+        (parts[i], parts[i + 1] if i + 1 < len(parts) else '')
+        for i in range(0, len(parts), 2)
+        if parts[i]
+    ]
+
+def _pack(pieces: List[Tuple[str, str]], max_tokens: int, split_long: bool) -> List[Tuple[str, str]]:
+    chunks = []
+    current = ''
+    current_tokens = 0
+    separator = ''
+    for piece, piece_separator in pieces:
+        tokens = estimate_tokens(piece)
+        if tokens > max_tokens and split_long:
+            if current:
+                chunks.append((current, separator))
+                current, current_tokens = '', 0
+            words = _pack(_pieces(piece, _WORD_BREAK), max_tokens, False)
+            words[-1] = (words[-1][0], piece_separator)
+            chunks.extend(words)
+            continue
+
+        # Разделитель внутри части тоже стоит токенов
+        joined_tokens = estimate_tokens(separator + piece) if current else tokens
+        if current and current_tokens + joined_tokens > max_tokens:
+            chunks.append((current, separator))
+            current, current_tokens, joined_tokens = '', 0, tokens
+        current = current + separator + piece if current else piece
+        current_tokens += joined_tokens
+        separator = piece_separator
+    if current:
+        chunks.append((current, separator))
+    return chunks
+
+def split_into_chunks(text: str, max_tokens: int) -> List[Tuple[str, str]]:
+    """
+    Делит текст на части не больше max_tokens
+
+    Returns:
+        [(часть, разделитель после нее)], для короткого текста - [(text, '')]
+    """
+    if max_tokens <= 0 or estimate_tokens(text) <= max_tokens:
+        return [(text, '')]
+    chunks = _pack(_pieces(text.strip(), _SENTENCE_BREAK), max_tokens, True)
+    return chunks or [(text, '')]
+
+def join_chunks(translations: List[str], chunks: List[Tuple[str, str]]) -> str:
+    """Собирает переводы частей с исходными разделителями"""
+    return ''.join(translation + separator for translation, (_, separator) in zip(translations, chunks)).strip()
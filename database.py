@@ -1,25 +1,259 @@
 import psycopg2
 from psycopg2.extras import RealDictCursor
+from psycopg2.extensions import STATUS_READY
+from psycopg2.pool import PoolError
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
 import os
-from contextlib import contextmanager
+import threading
+import time
+from contextlib import contextmanager, asynccontextmanager
+from typing import Optional
 from dotenv import load_dotenv
+from migrations import apply_migrations
 
 load_dotenv()
 
 DATABASE_URL = os.getenv('DATABASE_URL')
 
+# Настройки пула соединений (на каждый процесс)
+DB_POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', 1))
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', 10))
+# Максимальное время жизни соединения, секунд
+DB_POOL_MAX_LIFETIME = int(os.getenv('DB_POOL_MAX_LIFETIME', 1800))
+# Сколько ждать свободного соединения, секунд
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 30))
+# Соединение, простоявшее дольше этого (секунд), проверяется SELECT 1 при выдаче
+DB_POOL_HEALTH_CHECK_IDLE = float(os.getenv('DB_POOL_HEALTH_CHECK_IDLE', 10))
+
+class ConnectionPool:
+    """
+    Потокобезопасный пул соединений psycopg2
+
+    При выдаче соединение проверяется на живость, соединения старше
+    max_lifetime закрываются. Если все соединения заняты, ждет до timeout.
+    """
+
+    def __init__(self, dsn: str, min_size: int, max_size: int, max_lifetime: float,
+                 timeout: float, health_check_idle: float):
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max(1, max_size)
+        self.max_lifetime = max_lifetime
+        self.timeout = timeout
+        self.health_check_idle = health_check_idle
+
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.max_size)
+        # Свободные соединения: (conn, created_at, released_at)
+        self._idle = []
+        self._created_at = {}
+        self._pid = os.getpid()
+
+        self.checkouts = 0
+        self.connects = 0
+        self.discarded = 0
+        self.timeouts = 0
+        self.total_wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    def _connect(self):
+        conn = psycopg2.connect(self.dsn, cursor_factory=RealDictCursor)
+        with self._lock:
+            self._created_at[id(conn)] = time.monotonic()
+            self.connects += 1
+        return conn
+
+    def _close(self, conn):
+        with self._lock:
+            self._created_at.pop(id(conn), None)
+            self.discarded += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _is_expired(self, conn) -> bool:
+        created_at = self._created_at.get(id(conn), 0)
+        return time.monotonic() - created_at > self.max_lifetime
+
+    def _is_healthy(self, conn, released_at: float) -> bool:
+        if conn.closed:
+            return False
+        if time.monotonic() - released_at < self.health_check_idle:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _check_fork(self):
+        """После fork соединения родителя не используем"""
+        if self._pid != os.getpid():
+            with self._lock:
+                self._idle = []
+                self._created_at = {}
+                self._slots = threading.BoundedSemaphore(self.max_size)
+                self._pid = os.getpid()
+
+    def _fill(self):
+        """Досоздает соединения до min_size"""
+        while True:
+            with self._lock:
+                if len(self._created_at) >= self.min_size:
+                    return
+            conn = self._connect()
+            with self._lock:
+                self._idle.append((conn, time.monotonic(), time.monotonic()))
+
+    def getconn(self):
+        """Берет соединение из пула (или создает новое)"""
+        self._check_fork()
+        started_at = time.monotonic()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self.timeouts += 1
+            raise PoolError(f"Нет свободных соединений с БД за {self.timeout} сек")
+
+        wait_time = time.monotonic() - started_at
+        try:
+            if not self._created_at:
+                self._fill()
+            while True:
+                with self._lock:
+                    item = self._idle.pop() if self._idle else None
+                if item is None:
+                    conn = self._connect()
+                    break
+                conn, _, released_at = item
+                if self._is_expired(conn) or not self._is_healthy(conn, released_at):
+                    self._close(conn)
+                    continue
+                break
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self.checkouts += 1
+            self.total_wait_time += wait_time
+            self.max_wait_time = max(self.max_wait_time, wait_time)
+        return conn
+
+    def putconn(self, conn, discard: bool = False):
+        """Возвращает соединение в пул"""
+        try:
+            if not discard and not conn.closed and conn.status != STATUS_READY:
+                conn.rollback()
+            if discard or conn.closed or self._is_expired(conn):
+                self._close(conn)
+            else:
+                with self._lock:
+                    self._idle.append((conn, self._created_at[id(conn)], time.monotonic()))
+        except Exception:
+            self._close(conn)
+        finally:
+            self._slots.release()
+
+    def stats(self) -> dict:
+        """Метрики пула: занятые и свободные соединения, время ожидания"""
+        with self._lock:
+            size = len(self._created_at)
+            idle = len(self._idle)
+            return {
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "size": size,
+                "in_use": size - idle,
+                "idle": idle,
+                "checkouts": self.checkouts,
+                "connects": self.connects,
+                "discarded": self.discarded,
+                "timeouts": self.timeouts,
+                "avg_wait_ms": round(self.total_wait_time / self.checkouts * 1000, 2) if self.checkouts else 0.0,
+                "max_wait_ms": round(self.max_wait_time * 1000, 2)
+            }
+
+    def close_all(self):
+        """Закрывает все свободные соединения"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _, _ in idle:
+            self._close(conn)
+
+db_pool = ConnectionPool(
+    DATABASE_URL,
+    DB_POOL_MIN_SIZE,
+    DB_POOL_MAX_SIZE,
+    DB_POOL_MAX_LIFETIME,
+    DB_POOL_TIMEOUT,
+    DB_POOL_HEALTH_CHECK_IDLE
+)
+
 @contextmanager
 def get_db_connection():
-    """Context manager для безопасной работы с подключением к БД"""
-    conn = psycopg2.connect(DATABASE_URL, cursor_factory=RealDictCursor)
+    """Context manager для безопасной работы с подключением к БД (из пула)"""
+    conn = db_pool.getconn()
+    discard = False
     try:
         yield conn
         conn.commit()
     except Exception as e:
-        conn.rollback()
+        try:
+            conn.rollback()
+        except psycopg2.Error:
+            discard = True
+        if isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError)):
+            discard = True
         raise e
     finally:
-        conn.close()
+        db_pool.putconn(conn, discard=discard)
+
+# Асинхронный пул (psycopg 3) для роутеров FastAPI: запросы не блокируют event loop.
+# Открывается и закрывается в lifespan приложения.
+async_db_pool = AsyncConnectionPool(
+    DATABASE_URL or '',
+    min_size=DB_POOL_MIN_SIZE,
+    max_size=max(DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE),
+    max_lifetime=DB_POOL_MAX_LIFETIME,
+    timeout=DB_POOL_TIMEOUT,
+    check=AsyncConnectionPool.check_connection,
+    kwargs={'row_factory': dict_row},
+    open=False
+)
+
+@asynccontextmanager
+async def get_async_db_connection(timeout: Optional[float] = None):
+    """
+    Асинхронный context manager для работы с БД
+
+    Транзакция фиксируется при выходе из блока и откатывается при ошибке.
+    Запросы выполняются через await cursor.execute(...) с плейсхолдерами %s.
+    timeout - сколько ждать свободного соединения (по умолчанию DB_POOL_TIMEOUT),
+    по истечении - psycopg_pool.PoolTimeout.
+    """
+    async with async_db_pool.connection(timeout=timeout) as conn:
+        yield conn
+
+def async_db_pool_stats() -> dict:
+    """Метрики асинхронного пула"""
+    stats = async_db_pool.get_stats()
+    return {
+        "min_size": async_db_pool.min_size,
+        "max_size": async_db_pool.max_size,
+        "size": stats.get('pool_size', 0),
+        "in_use": stats.get('pool_size', 0) - stats.get('pool_available', 0),
+        "idle": stats.get('pool_available', 0),
+        "waiting": stats.get('requests_waiting', 0),
+        "requests": stats.get('requests_num', 0),
+        "queued_requests": stats.get('requests_queued', 0),
+        "avg_wait_ms": round(stats.get('requests_wait_ms', 0) / stats['requests_num'], 2)
+            if stats.get('requests_num') else 0.0,
+        "timeouts": stats.get('requests_errors', 0)
+    }
 
 def init_database():
     """Инициализация базы данных - создание таблиц"""
@@ -45,6 +279,7 @@ def init_database():
                 s3_key VARCHAR(500) NOT NULL,
                 total_pages INTEGER DEFAULT 0,
                 total_sentences INTEGER DEFAULT 0,
+                content_hash VARCHAR(64),
                 uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 UNIQUE(user_id, s3_key)
             )
@@ -62,6 +297,10 @@ def init_database():
                               WHERE table_name='books' AND column_name='total_sentences') THEN
                     ALTER TABLE books ADD COLUMN total_sentences INTEGER DEFAULT 0;
                 END IF;
+                IF NOT EXISTS (SELECT 1 FROM information_schema.columns 
+                              WHERE table_name='books' AND column_name='content_hash') THEN
+                    ALTER TABLE books ADD COLUMN content_hash VARCHAR(64);
+                END IF;
             END $$;
         """)
         
@@ -76,7 +315,27 @@ def init_database():
                 UNIQUE(book_id, page_number)
             )
         """)
-        
+
+        # Счетчик одобренных предложений страницы (миграция с пересчетом по translations)
+        cursor.execute("""
+            DO $$
+            BEGIN
+                IF NOT EXISTS (SELECT 1 FROM information_schema.columns
+                              WHERE table_name='book_pages' AND column_name='approved_sentences') THEN
+                    ALTER TABLE book_pages ADD COLUMN approved_sentences INTEGER NOT NULL DEFAULT 0;
+                    IF EXISTS (SELECT 1 FROM information_schema.tables WHERE table_name='translations') THEN
+                        UPDATE book_pages p SET approved_sentences = t.approved
+                        FROM (
+                            SELECT book_id, page_number, COUNT(*) AS approved
+                            FROM translations WHERE is_approved
+                            GROUP BY book_id, page_number
+                        ) t
+                        WHERE p.book_id = t.book_id AND p.page_number = t.page_number;
+                    END IF;
+                END IF;
+            END $$;
+        """)
+
         # Таблица предложений и переводов
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS translations (
@@ -93,6 +352,24 @@ def init_database():
             )
         """)
         
+        # Счетчики переведенных/одобренных предложений книги (миграция с пересчетом)
+        cursor.execute("""
+            DO $$
+            BEGIN
+                IF NOT EXISTS (SELECT 1 FROM information_schema.columns
+                              WHERE table_name='books' AND column_name='translated_sentences') THEN
+                    ALTER TABLE books ADD COLUMN translated_sentences INTEGER NOT NULL DEFAULT 0;
+                    ALTER TABLE books ADD COLUMN approved_sentences INTEGER NOT NULL DEFAULT 0;
+                    UPDATE books b SET translated_sentences = c.translated, approved_sentences = c.approved
+                    FROM (
+                        SELECT book_id, COUNT(*) AS translated, COUNT(*) FILTER (WHERE is_approved) AS approved
+                        FROM translations GROUP BY book_id
+                    ) c
+                    WHERE b.id = c.book_id;
+                END IF;
+            END $$;
+        """)
+        
         # Таблица версий переводов (история)
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS translation_versions (
@@ -104,15 +381,89 @@ def init_database():
             )
         """)
         
-        # Индексы для производительности
+        # Таблица фоновых задач обработки загруженных книг
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS ingestion_jobs (
+                id SERIAL PRIMARY KEY,
+                user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+                book_id INTEGER REFERENCES books(id) ON DELETE SET NULL,
+                filename VARCHAR(255) NOT NULL,
+                s3_key VARCHAR(500) NOT NULL,
+                content_hash VARCHAR(64),
+                status VARCHAR(20) NOT NULL DEFAULT 'pending',
+                stage VARCHAR(20) NOT NULL DEFAULT 'queued',
+                progress INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        
         cursor.execute("""
-            CREATE INDEX IF NOT EXISTS idx_books_user_id ON books(user_id);
-            CREATE INDEX IF NOT EXISTS idx_book_pages_book_id ON book_pages(book_id);
-            CREATE INDEX IF NOT EXISTS idx_translations_book_id ON translations(book_id);
-            CREATE INDEX IF NOT EXISTS idx_translation_versions_translation_id 
-                ON translation_versions(translation_id);
+            DO $$ 
+            BEGIN 
+                IF NOT EXISTS (SELECT 1 FROM information_schema.columns 
+                              WHERE table_name='ingestion_jobs' AND column_name='content_hash') THEN
+                    ALTER TABLE ingestion_jobs ADD COLUMN content_hash VARCHAR(64);
+                END IF;
+            END $$;
         """)
         
+        # Таблица фоновых задач перевода всей книги
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS book_translation_jobs (
+                id SERIAL PRIMARY KEY,
+                user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+                book_id INTEGER REFERENCES books(id) ON DELETE CASCADE,
+                model VARCHAR(50) NOT NULL,
+                source_language VARCHAR(10) NOT NULL,
+                target_language VARCHAR(10) NOT NULL,
+                status VARCHAR(20) NOT NULL DEFAULT 'pending',
+                total_sentences INTEGER NOT NULL DEFAULT 0,
+                translated_sentences INTEGER NOT NULL DEFAULT 0,
+                failed_sentences INTEGER NOT NULL DEFAULT 0,
+                last_page INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+
+        # Не больше одной активной задачи перевода на книгу
+        cursor.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_book_translation_jobs_active
+                ON book_translation_jobs(book_id)
+                WHERE status IN ('pending', 'processing')
+        """)
+
+        # Память переводов: готовые переводы по хешу нормализованного текста,
+        # языковой пары и модели
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS translation_memory (
+                key_hash CHAR(64) PRIMARY KEY,
+                source_language VARCHAR(10) NOT NULL,
+                target_language VARCHAR(10) NOT NULL,
+                model VARCHAR(50) NOT NULL,
+                source_text TEXT NOT NULL,
+                translated_text TEXT NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                last_used_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+
+        # Индексы для производительности (составные индексы - в migrations.py)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_ingestion_jobs_status ON ingestion_jobs(status);
+            CREATE INDEX IF NOT EXISTS idx_book_translation_jobs_status ON book_translation_jobs(status);
+            CREATE INDEX IF NOT EXISTS idx_books_content_hash ON books(content_hash);
+        """)
+        
+        # Версионные миграции поверх базовых таблиц
+        apply_migrations(cursor)
+        
         conn.commit()
         print("[OK] Database initialized successfully!")
 
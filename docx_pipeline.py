@@ -0,0 +1,318 @@
+"""
+Конвейер обработки DOCX: конвертация mammoth -> HTML -> страницы книги
+"""
+from typing import List, Tuple
+from bs4 import BeautifulSoup, NavigableString
+from html import unescape
+import mammoth
+import io
+import re
+
+STYLE_MAP = """
+p[style-name='Heading 1'] => h1.heading-1:fresh
+p[style-name='Heading 2'] => h2.heading-2:fresh
+p[style-name='Heading 3'] => h3.heading-3:fresh
+p[style-name='Title'] => h1.title:fresh
+p[style-name='Subtitle'] => h2.subtitle:fresh
+r[style-name='Strong'] => strong
+p[style-name='Quote'] => blockquote:fresh
+p[style-name='Normal'] => p.normal:fresh
+p[style-name='Body Text'] => p.body-text:fresh
+p[style-name='List Paragraph'] => p.list-paragraph:fresh
+"""
+
+CHARS_PER_PAGE = 1800
+
+# Элементы, которые оборачиваются в span.sentence
+SENTENCE_TAGS = ('p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'li')
+
+# Теги, внутри которых html.parser не схлопывает пробелы
+PRESERVE_WHITESPACE_TAGS = ('pre', 'textarea')
+ASCII_SPACES = ' \n\t\x0c\r'
+
+def convert_docx_to_html(file_content: bytes) -> str:
+    """Конвертирует DOCX в HTML через mammoth"""
+    result = mammoth.convert_to_html(
+        io.BytesIO(file_content),
+        style_map=STYLE_MAP,
+        include_default_style_map=True,
+        include_embedded_style_map=True
+    )
+    return result.value
+
+def process_book_docx(file_content: bytes) -> Tuple[List[str], int]:
+    """DOCX книги -> (страницы, количество предложений). Выполняется в пуле процессов"""
+    return build_book_pages(convert_docx_to_html(file_content))
+
+def process_preview_docx(file_content: bytes) -> List[str]:
+    """DOCX для просмотра без сохранения -> страницы. Выполняется в пуле процессов"""
+    soup = BeautifulSoup(convert_docx_to_html(file_content), 'html.parser')
+    for p in soup.find_all('p'):
+        if not p.get_text(strip=True) and not p.find('img'):
+            p.string = '\u00a0'
+
+    html_with_spans = wrap_text_sentences_in_html(str(soup))
+    return paginate_html(html_with_spans)
+
+def wrap_text_sentences_in_html(html: str, sentence_counter: list = None) -> str:
+    """Оборачивает предложения в span теги для подсветки с уникальными ID"""
+    if sentence_counter is None:
+        sentence_counter = [0]
+
+    soup = BeautifulSoup(html, 'html.parser')
+
+    def process_text_node(text):
+        if not text.strip():
+            return text
+
+        sentences = re.split(r'([.!?]+[\s\n]+|[.!?]+$)', text)
+        sentences = [s for s in sentences if s]
+
+        result = []
+        temp_sentence = ''
+
+        for part in sentences:
+            temp_sentence += part
+            if re.search(r'[.!?]+[\s\n]*$', part):
+                sentence_counter[0] += 1
+                result.append(f'<span class="sentence" data-sentence-id="sent-{sentence_counter[0]}">{temp_sentence}</span>')
+                temp_sentence = ''
+
+        if temp_sentence.strip():
+            sentence_counter[0] += 1
+            result.append(f'<span class="sentence" data-sentence-id="sent-{sentence_counter[0]}">{temp_sentence}</span>')
+
+        return ''.join(result)
+
+    def process_element(element):
+        if element.name is None:
+            return process_text_node(str(element))
+
+        for child in list(element.children):
+            if child.name is None:
+                new_html = process_text_node(str(child))
+                new_soup = BeautifulSoup(new_html, 'html.parser')
+                child.replace_with(new_soup)
+            else:
+                process_element(child)
+
+    process_element(soup)
+    return str(soup)
+
+def _normalize_children(node) -> None:
+    """
+    Удаляет изображения среди детей узла и склеивает соседние текстовые узлы
+
+    Повторный разбор HTML склеил бы их сам, а строку из одних пробелов
+    схлопнул бы в один пробел - делаем то же самое без повторного разбора.
+    """
+    for img in node.find_all('img', recursive=False):
+        img.decompose()
+
+    contents = node.contents
+    i = 0
+    while i < len(contents) - 1:
+        first, second = contents[i], contents[i + 1]
+        if type(first) is not NavigableString or type(second) is not NavigableString:
+            i += 1
+            continue
+
+        text = first + second
+        if not text.strip(ASCII_SPACES) and not any(
+            parent.name in PRESERVE_WHITESPACE_TAGS for parent in first.parents
+        ):
+            text = '\n' if '\n' in text else ' '
+        second.extract()
+        first.replace_with(NavigableString(text))
+
+def _is_stable_child(node) -> bool:
+    """Сохранит ли узел свой вид после str() и повторного разбора"""
+    if node.name is not None:
+        return True
+    return type(node) is NavigableString and '<' not in node and unescape(node) == node
+
+def _is_sentence_span(node) -> bool:
+    return node.name == 'span' and 'sentence' in node.get_attribute_list('class')
+
+def build_book_pages(html: str, chars_per_page: int = CHARS_PER_PAGE) -> Tuple[List[str], int]:
+    """
+    Однопроходная обработка HTML от mammoth
+
+    За один обход дерева удаляет изображения, заполняет пустые параграфы,
+    оборачивает абзацы в span.sentence, считает их и режет HTML на страницы.
+    Страницы побайтно совпадают с build_book_pages_multipass.
+
+    Returns:
+        (список HTML страниц, количество предложений)
+    """
+    soup = BeautifulSoup(html, 'html.parser')
+    counter = [0]
+
+    def wrap(node, sentence_number: int) -> int:
+        """Оборачивает содержимое элемента в span.sentence"""
+        # Вложенные элементы получают номер, но не оборачиваются повторно -
+        # в исходной цепочке к этому моменту они уже отсоединены от дерева
+        inner_sentences = walk_children(node, True)
+
+        if all(_is_stable_child(child) for child in node.contents):
+            span = soup.new_tag('span', attrs={
+                'class': 'sentence',
+                'data-sentence-id': f'sent-{sentence_number}'
+            })
+            span.extend(list(node.contents))
+            node.append(span)
+            return 1 + inner_sentences
+
+        # Текст с '<' или сущностями исходная цепочка вставляла без
+        # экранирования и разбирала заново - повторяем это для такого элемента
+        content = ''.join(str(child) for child in node.children)
+        markup = f'<span class="sentence" data-sentence-id="sent-{sentence_number}">{content}</span>'
+        fragment = BeautifulSoup(str(BeautifulSoup(markup, 'html.parser')), 'html.parser')
+        sentences = len(fragment.find_all('span', {'class': 'sentence'}))
+        node.clear()
+        node.append(fragment)
+        return sentences
+
+    def walk(node, inside_sentence: bool) -> int:
+        """Обрабатывает поддерево, возвращает число span.sentence в нём"""
+        if node.name in SENTENCE_TAGS:
+            has_text = any(True for _ in node.stripped_strings)
+            if node.name == 'p' and not has_text:
+                node.string = '\u00a0'
+                return 0
+            if has_text:
+                counter[0] += 1
+                if not inside_sentence:
+                    return wrap(node, counter[0])
+
+        sentences = 1 if _is_sentence_span(node) else 0
+        return sentences + walk_children(node, inside_sentence)
+
+    def walk_children(node, inside_sentence: bool) -> int:
+        _normalize_children(node)
+        return sum(walk(child, inside_sentence) for child in list(node.contents) if child.name)
+
+    _normalize_children(soup)
+    block_sentences = {id(child): walk(child, False) for child in list(soup.contents) if child.name}
+
+    root = soup.body if soup.body else soup
+
+    pages = []
+    total_sentences = 0
+    current_page = ''
+    current_chars = 0
+
+    for element in root.children:
+        if element.name is None:
+            continue
+
+        element_html = str(element)
+        element_length = len(element.get_text())
+
+        if current_chars > 0 and current_chars + element_length > chars_per_page:
+            pages.append(current_page)
+            current_page = element_html
+            current_chars = element_length
+        else:
+            current_page += element_html
+            current_chars += element_length
+
+        if id(element) in block_sentences:
+            total_sentences += block_sentences[id(element)]
+        else:
+            total_sentences += len(element.find_all('span', {'class': 'sentence'}))
+
+    if current_page:
+        pages.append(current_page)
+
+    if not pages:
+        return [str(soup)], len(soup.find_all('span', {'class': 'sentence'}))
+
+    return pages, total_sentences
+
+# Исходная многопроходная цепочка (эталон для проверки и бенчмарка)
+
+def wrap_sentences_in_html(html: str, sentence_counter: list = None) -> str:
+    """Оборачивает абзацы в span теги для подсветки с уникальными ID"""
+    if sentence_counter is None:
+        sentence_counter = [0]
+
+    soup = BeautifulSoup(html, 'html.parser')
+
+    # Ищем все параграфы и заголовки
+    for element in soup.find_all(['p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'li']):
+        # Пропускаем пустые элементы
+        if not element.get_text(strip=True):
+            continue
+
+        sentence_counter[0] += 1
+
+        # Извлекаем весь контент элемента (включая вложенные теги)
+        content = ''.join(str(child) for child in element.children)
+
+        # Очищаем элемент и добавляем span с контентом
+        element.clear()
+        span = BeautifulSoup(f'<span class="sentence" data-sentence-id="sent-{sentence_counter[0]}">{content}</span>', 'html.parser')
+        element.append(span)
+
+    return str(soup)
+
+def paginate_html(html: str, chars_per_page: int = CHARS_PER_PAGE) -> List[str]:
+    """Разбивает HTML на страницы"""
+    soup = BeautifulSoup(html, 'html.parser')
+
+    if soup.body:
+        elements = list(soup.body.children)
+    else:
+        elements = list(soup.children)
+
+    pages = []
+    current_page = ''
+    current_chars = 0
+
+    for element in elements:
+        if element.name is None:
+            continue
+
+        element_html = str(element)
+        element_text = element.get_text()
+        element_length = len(element_text)
+
+        if current_chars > 0 and current_chars + element_length > chars_per_page:
+            pages.append(current_page)
+            current_page = element_html
+            current_chars = element_length
+        else:
+            current_page += element_html
+            current_chars += element_length
+
+    if current_page:
+        pages.append(current_page)
+
+    return pages if pages else [html]
+
+def build_book_pages_multipass(html: str, chars_per_page: int = CHARS_PER_PAGE) -> Tuple[List[str], int]:
+    """Исходная цепочка: четыре разбора HTML через BeautifulSoup"""
+    # Удаляем все изображения из HTML
+    soup = BeautifulSoup(html, 'html.parser')
+    for img in soup.find_all('img'):
+        img.decompose()
+
+    # Обрабатываем пустые параграфы
+    for p in soup.find_all('p'):
+        if not p.get_text(strip=True):
+            p.string = '\u00a0'
+
+    # Оборачиваем предложения в span для подсветки
+    html_with_spans = wrap_sentences_in_html(str(soup))
+
+    # Разбиваем на страницы
+    pages = paginate_html(html_with_spans, chars_per_page)
+
+    # Подсчитываем общее количество предложений
+    total_sentences = 0
+    for page_html in pages:
+        page_soup = BeautifulSoup(page_html, 'html.parser')
+        total_sentences += len(page_soup.find_all('span', {'class': 'sentence'}))
+
+    return pages, total_sentences
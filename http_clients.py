@@ -0,0 +1,106 @@
+"""
+Общие HTTP клиенты для внешних API (KazLLM, Claude, OpenAI)
+
+Клиенты создаются один раз в lifespan приложения и переиспользуют
+соединения (keep-alive, HTTP/2), поэтому запрос перевода не платит
+за DNS, TCP и TLS при каждом вызове.
+"""
+import os
+import httpx
+from dotenv import load_dotenv
+from openai import AsyncOpenAI
+
+load_dotenv()
+
+HTTP_CLIENT_HTTP2 = os.getenv('HTTP_CLIENT_HTTP2', 'true').lower() == 'true'
+# Сколько секунд держать простаивающее соединение открытым
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv('HTTP_KEEPALIVE_EXPIRY', 60))
+
+# Лимиты соединений на каждый внешний сервис (на каждый воркер uvicorn)
+KAZLLM_MAX_CONNECTIONS = int(os.getenv('KAZLLM_MAX_CONNECTIONS', 20))
+CLAUDE_MAX_CONNECTIONS = int(os.getenv('CLAUDE_MAX_CONNECTIONS', 20))
+OPENAI_MAX_CONNECTIONS = int(os.getenv('OPENAI_MAX_CONNECTIONS', 20))
+
+KAZLLM_TIMEOUT = float(os.getenv('KAZLLM_TIMEOUT', 30))
+CLAUDE_TIMEOUT = float(os.getenv('CLAUDE_TIMEOUT', 60))
+OPENAI_TIMEOUT = float(os.getenv('OPENAI_TIMEOUT', 60))
+
+def _limits(max_connections: int) -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_connections,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+    )
+
+class UpstreamClients:
+    """Клиенты внешних API на время жизни приложения"""
+
+    def __init__(self):
+        self.kazllm = None
+        self.claude = None
+        self._openai_http = None
+        self._openai = None
+
+    def open(self):
+        """Создает клиенты (вызывается при запуске приложения)"""
+        if self.kazllm is not None:
+            return
+        self.kazllm = httpx.AsyncClient(
+            http2=HTTP_CLIENT_HTTP2,
+            limits=_limits(KAZLLM_MAX_CONNECTIONS),
+            timeout=KAZLLM_TIMEOUT
+        )
+        self.claude = httpx.AsyncClient(
+            http2=HTTP_CLIENT_HTTP2,
+            limits=_limits(CLAUDE_MAX_CONNECTIONS),
+            timeout=CLAUDE_TIMEOUT
+        )
+        self._openai_http = httpx.AsyncClient(
+            http2=HTTP_CLIENT_HTTP2,
+            limits=_limits(OPENAI_MAX_CONNECTIONS),
+            timeout=OPENAI_TIMEOUT
+        )
+
+    @property
+    def openai(self) -> AsyncOpenAI:
+        """
+        Клиент OpenAI поверх общего пула соединений
+
+        Создается при первом обращении, т.к. без OPENAI_API_KEY конструктор падает.
+        Собственные повторы SDK выключены: 429 повторяет rate_limiter, ошибки
+        сервиса - translation_policy, а задержки замеряются по одной попытке.
+        """
+        if self._openai is None:
+            self._openai = AsyncOpenAI(
+                api_key=os.getenv('OPENAI_API_KEY'),
+                http_client=self._openai_http,
+                max_retries=0
+            )
+        return self._openai
+
+    async def close(self):
+        """Закрывает соединения (вызывается при остановке приложения)"""
+        if self.kazllm is not None:
+            await self.kazllm.aclose()
+            await self.claude.aclose()
+            await self._openai_http.aclose()
+        self.kazllm = None
+        self.claude = None
+        self._openai_http = None
+        self._openai = None
+
+    def stats(self) -> dict:
+        """Настройки пулов соединений"""
+        return {
+            "open": self.kazllm is not None,
+            "http2": HTTP_CLIENT_HTTP2,
+            "keepalive_expiry": HTTP_KEEPALIVE_EXPIRY,
+            "max_connections": {
+                "kazllm": KAZLLM_MAX_CONNECTIONS,
+                "claude": CLAUDE_MAX_CONNECTIONS,
+                "chatgpt": OPENAI_MAX_CONNECTIONS
+            }
+        }
+
+# Общие клиенты приложения
+http_clients = UpstreamClients()
@@ -0,0 +1,234 @@
+"""
+Фоновая обработка загруженных книг
+
+Загрузка в режиме задачи возвращает ID сразу после записи в S3,
+а конвертация и сохранение страниц выполняются в фоне. Состояние задач
+хранится в таблице ingestion_jobs, поэтому незавершенные задачи
+подхватываются после перезапуска процесса.
+"""
+import asyncio
+import os
+import time
+from typing import Optional
+from dotenv import load_dotenv
+from psycopg_pool import PoolTimeout
+from database import get_async_db_connection
+from s3_storage import download_file_from_s3
+from docx_pipeline import process_book_docx
+from process_pool import docx_pool
+from book_storage import save_book, find_converted_book, save_book_from_cache
+
+load_dotenv()
+
+# Через сколько секунд без обновлений задача в статусе processing считается брошенной
+INGESTION_JOB_STALE_SECONDS = int(os.getenv('INGESTION_JOB_STALE_SECONDS', 600))
+INGESTION_JOB_MAX_ATTEMPTS = int(os.getenv('INGESTION_JOB_MAX_ATTEMPTS', 3))
+INGESTION_JOB_RETRY_DELAY_SECONDS = int(os.getenv('INGESTION_JOB_RETRY_DELAY_SECONDS', 10))
+# Прогресс сохранения страниц пишется не чаще раза в столько секунд
+INGESTION_PROGRESS_INTERVAL_SECONDS = float(os.getenv('INGESTION_PROGRESS_INTERVAL_SECONDS', 2))
+# Сколько ждать свободного соединения для записи прогресса (секунд). Транзакция
+# сохранения уже держит соединение: долгое ожидание второго при занятом пуле
+# заблокировало бы параллельные задачи друг другом, поэтому прогресс пропускается
+INGESTION_PROGRESS_CONNECTION_TIMEOUT = 0.05
+
+# Этапы задачи и процент готовности в начале этапа
+STAGE_PROGRESS = {
+    'queued': 0,
+    'downloading': 5,
+    'converting': 10,
+    'saving': 40,
+    'done': 100,
+    'failed': 0
+}
+
+# Ссылки на запущенные задачи, чтобы их не собрал сборщик мусора
+_running_tasks = set()
+
+async def create_ingestion_job(user_id: int, filename: str, s3_key: str, content_hash: str = None) -> int:
+    """Создает задачу обработки уже загруженного в S3 файла"""
+    async with get_async_db_connection() as conn:
+        cursor = conn.cursor()
+        await cursor.execute(
+            """
+            INSERT INTO ingestion_jobs (user_id, filename, s3_key, content_hash, status, stage, progress)
+            VALUES (%s, %s, %s, %s, 'pending', 'queued', 0)
+            RETURNING id
+            """,
+            (user_id, filename, s3_key, content_hash)
+        )
+        return (await cursor.fetchone())['id']
+
+async def get_ingestion_job(job_id: int, user_id: int) -> Optional[dict]:
+    """Состояние задачи пользователя"""
+    async with get_async_db_connection() as conn:
+        cursor = conn.cursor()
+        await cursor.execute(
+            """
+            SELECT id, book_id, filename, s3_key, status, stage, progress, error,
+                   attempts, created_at, updated_at
+            FROM ingestion_jobs
+            WHERE id = %s AND user_id = %s
+            """,
+            (job_id, user_id)
+        )
+        return await cursor.fetchone()
+
+async def _claim_job(job_id: int) -> Optional[dict]:
+    """
+    Захватывает задачу для выполнения
+
+    Задачу можно взять, если она ожидает или брошена другим процессом.
+    Условие в UPDATE гарантирует, что её выполняет только один воркер.
+    """
+    async with get_async_db_connection() as conn:
+        cursor = conn.cursor()
+        await cursor.execute(
+            """
+            UPDATE ingestion_jobs
+            SET status = 'processing', attempts = attempts + 1, updated_at = CURRENT_TIMESTAMP
+            WHERE id = %s
+              AND (status = 'pending'
+                   OR (status = 'processing'
+                       AND updated_at < CURRENT_TIMESTAMP - make_interval(secs => %s)))
+            RETURNING id, user_id, filename, s3_key, content_hash, attempts
+            """,
+            (job_id, INGESTION_JOB_STALE_SECONDS)
+        )
+        return await cursor.fetchone()
+
+async def _update_job(job_id: int, stage: str, progress: int = None, status: str = None,
+                      book_id: int = None, error: str = None, connection_timeout: float = None):
+    """Обновляет этап и прогресс задачи (заодно служит heartbeat)"""
+    if progress is None:
+        progress = STAGE_PROGRESS[stage]
+    async with get_async_db_connection(connection_timeout) as conn:
+        cursor = conn.cursor()
+        await cursor.execute(
+            """
+            UPDATE ingestion_jobs
+            SET stage = %s, progress = %s,
+                status = COALESCE(%s, status),
+                book_id = COALESCE(%s, book_id),
+                error = %s,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE id = %s
+            """,
+            (stage, progress, status, book_id, error, job_id)
+        )
+
+async def _save_from_cache(job: dict) -> Optional[int]:
+    """Сохраняет книгу из готовой конвертации того же DOCX, если она есть"""
+    if not job['content_hash']:
+        return None
+    async with get_async_db_connection() as conn:
+        cursor = conn.cursor()
+        cached_book = await find_converted_book(cursor, job['content_hash'], job['user_id'], job['s3_key'])
+        if not cached_book:
+            return None
+        result = await save_book_from_cache(
+            cursor, job['user_id'], job['filename'], job['s3_key'], cached_book, job['content_hash']
+        )
+        return result['book_id']
+
+async def _save_pages(job: dict, pages: list, total_sentences: int) -> int:
+    """
+    Сохраняет страницы книги, обновляя прогресс задачи
+
+    Прогресс пишется отдельным соединением не чаще INGESTION_PROGRESS_INTERVAL_SECONDS
+    и только если в пуле есть свободное соединение: задача не ждет второе
+    соединение, держа первое под транзакцией сохранения.
+    """
+    job_id = job['id']
+    saving_start = STAGE_PROGRESS['saving']
+    last_report = time.monotonic()
+
+    async def on_progress(saved: int, total: int):
+        nonlocal last_report
+        if saved >= total or time.monotonic() - last_report < INGESTION_PROGRESS_INTERVAL_SECONDS:
+            return
+        last_report = time.monotonic()
+        try:
+            await _update_job(
+                job_id, 'saving', saving_start + (100 - saving_start) * saved // total,
+                connection_timeout=INGESTION_PROGRESS_CONNECTION_TIMEOUT
+            )
+        except PoolTimeout:
+            pass
+
+    async with get_async_db_connection() as conn:
+        cursor = conn.cursor()
+        result = await save_book(
+            cursor, job['user_id'], job['filename'], job['s3_key'],
+            pages, total_sentences, on_progress, job['content_hash']
+        )
+    print(f"[INGESTION] Job {job_id}: {result['pages_written']} page(s) written, "
+          f"{result['pages_deleted']} deleted")
+    return result['book_id']
+
+async def run_ingestion_job(job_id: int):
+    """Выполняет задачу обработки книги"""
+    job = await _claim_job(job_id)
+    if not job:
+        # Задачу уже выполняет другой процесс или она завершена
+        return
+
+    try:
+        book_id = await _save_from_cache(job)
+        if book_id:
+            await _update_job(job_id, 'done', status='done', book_id=book_id)
+            return
+
+        await _update_job(job_id, 'downloading')
+        file_content = await asyncio.to_thread(download_file_from_s3, job['s3_key'])
+
+        await _update_job(job_id, 'converting')
+        pages, total_sentences = await docx_pool.run(process_book_docx, file_content)
+
+        await _update_job(job_id, 'saving')
+        book_id = await _save_pages(job, pages, total_sentences)
+
+        await _update_job(job_id, 'done', status='done', book_id=book_id)
+    except Exception as e:
+        print(f"[INGESTION] Job {job_id} failed (attempt {job['attempts']}): {str(e)}")
+        if job['attempts'] >= INGESTION_JOB_MAX_ATTEMPTS:
+            await _update_job(job_id, 'failed', 0, 'failed', None, str(e))
+            return
+
+        # Повторяем позже, пока не исчерпаны попытки
+        await _update_job(job_id, 'queued', 0, 'pending', None, str(e))
+        await asyncio.sleep(INGESTION_JOB_RETRY_DELAY_SECONDS * job['attempts'])
+        start_ingestion_job(job_id)
+
+def start_ingestion_job(job_id: int):
+    """Запускает задачу в фоне текущего event loop"""
+    task = asyncio.create_task(run_ingestion_job(job_id))
+    _running_tasks.add(task)
+    task.add_done_callback(_running_tasks.discard)
+
+async def _find_resumable_jobs() -> list:
+    async with get_async_db_connection() as conn:
+        cursor = conn.cursor()
+        await cursor.execute(
+            """
+            SELECT id FROM ingestion_jobs
+            WHERE status = 'pending'
+               OR (status = 'processing'
+                   AND updated_at < CURRENT_TIMESTAMP - make_interval(secs => %s))
+            ORDER BY created_at
+            """,
+            (INGESTION_JOB_STALE_SECONDS,)
+        )
+        return [row['id'] for row in await cursor.fetchall()]
+
+async def resume_ingestion_jobs():
+    """Подхватывает незавершенные задачи после перезапуска"""
+    try:
+        job_ids = await _find_resumable_jobs()
+    except Exception as e:
+        print(f"[WARNING] Failed to resume ingestion jobs: {str(e)}")
+        return
+
+    for job_id in job_ids:
+        start_ingestion_job(job_id)
+    if job_ids:
+        print(f"[INGESTION] Resumed {len(job_ids)} job(s)")
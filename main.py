@@ -2,23 +2,45 @@ from fastapi import FastAPI, UploadFile, File, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
-import mammoth
-import io
 from typing import List
-from bs4 import BeautifulSoup
-import re
+from contextlib import asynccontextmanager
 import httpx
 import os
 from dotenv import load_dotenv
-from openai import OpenAI
 
 # Импорт роутеров для авторизации и работы с книгами
 from auth_routes import router as auth_router
 from books_routes import router as books_router
+from docx_pipeline import process_preview_docx
+from process_pool import docx_pool
+from ingestion_jobs import resume_ingestion_jobs
+from book_translation_jobs import resume_book_translation_jobs
+from database import async_db_pool, async_db_pool_stats
+from http_clients import http_clients
+from translation_memory import translation_memory, make_key
+from rate_limiter import rate_limit_stats
+from translators import resolve_model, translation_backends
+from translation_policy import translation_policy
+from single_flight import translation_flights
+from batch_translation import translate_batch, TRANSLATE_BATCH_MAX_ITEMS
+from chat_streams import open_claude_stream, open_chatgpt_stream
+from sse import sse_response
 
 load_dotenv()
 
-app = FastAPI(title="DOCX Viewer API (Mazmundama)")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Запуск и остановка общих ресурсов приложения"""
+    await async_db_pool.open()
+    http_clients.open()
+    await resume_ingestion_jobs()
+    await resume_book_translation_jobs()
+    yield
+    await http_clients.close()
+    docx_pool.shutdown()
+    await async_db_pool.close()
+
+app = FastAPI(title="DOCX Viewer API (Mazmundama)", lifespan=lifespan)
 
 # Подключаем роутеры
 app.include_router(auth_router)
@@ -46,92 +68,22 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-def wrap_sentences_in_html(html: str, sentence_counter: list = None) -> str:
-    """Оборачивает предложения в span теги для подсветки с уникальными ID"""
-    if sentence_counter is None:
-        sentence_counter = [0]
-
-    soup = BeautifulSoup(html, 'html.parser')
-
-    def process_text_node(text):
-        if not text.strip():
-            return text
-
-        sentences = re.split(r'([.!?]+[\s\n]+|[.!?]+$)', text)
-        sentences = [s for s in sentences if s]
-
-        result = []
-        temp_sentence = ''
-
-        for part in sentences:
-            temp_sentence += part
-            if re.search(r'[.!?]+[\s\n]*$', part):
-                sentence_counter[0] += 1
-                result.append(f'<span class="sentence" data-sentence-id="sent-{sentence_counter[0]}">{temp_sentence}</span>')
-                temp_sentence = ''
-
-        if temp_sentence.strip():
-            sentence_counter[0] += 1
-            result.append(f'<span class="sentence" data-sentence-id="sent-{sentence_counter[0]}">{temp_sentence}</span>')
-
-        return ''.join(result)
-    
-    def process_element(element):
-        if element.name is None:
-            return process_text_node(str(element))
-        
-        for child in list(element.children):
-            if child.name is None:
-                new_html = process_text_node(str(child))
-                from bs4 import BeautifulSoup as BS
-                new_soup = BS(new_html, 'html.parser')
-                child.replace_with(new_soup)
-            else:
-                process_element(child)
-    
-    process_element(soup)
-    return str(soup)
-
-def paginate_html(html: str, chars_per_page: int = 1800) -> List[str]:
-    """Разбивает HTML на страницы"""
-    soup = BeautifulSoup(html, 'html.parser')
-    
-    if soup.body:
-        elements = list(soup.body.children)
-    else:
-        elements = list(soup.children)
-    
-    pages = []
-    current_page = ''
-    current_chars = 0
-    
-    for element in elements:
-        if element.name is None:
-            continue
-            
-        element_html = str(element)
-        element_text = element.get_text()
-        element_length = len(element_text)
-        
-        if current_chars > 0 and current_chars + element_length > chars_per_page:
-            pages.append(current_page)
-            current_page = element_html
-            current_chars = element_length
-        else:
-            current_page += element_html
-            current_chars += element_length
-    
-    if current_page:
-        pages.append(current_page)
-    
-    return pages if pages else [html]
-
 class TranslateRequest(BaseModel):
     text: str
     source_language: str = "eng"
     target_language: str = "kaz"
     model: str = "kazllm"  # "kazllm", "claude" или "chatgpt"
 
+class BatchTranslateItem(BaseModel):
+    sentence_id: str
+    text: str
+
+class BatchTranslateRequest(BaseModel):
+    items: List[BatchTranslateItem]
+    source_language: str = "eng"
+    target_language: str = "kaz"
+    model: str = "kazllm"  # "kazllm", "claude" или "chatgpt"
+
 class ChatGPTRequest(BaseModel):
     message: str
     system_prompt: str = "You are a helpful assistant."
@@ -150,6 +102,20 @@ class ClaudeRequest(BaseModel):
 async def root():
     return {"message": "DOCX Viewer API is running"}
 
+@app.get("/api/metrics")
+async def get_metrics():
+    """Метрики пулов обработки"""
+    return {
+        "docx_pool": docx_pool.stats(),
+        "db_pool": async_db_pool_stats(),
+        "http_clients": http_clients.stats(),
+        "translation_memory": translation_memory.stats(),
+        "translation_backends": translation_backends.stats(),
+        "rate_limits": rate_limit_stats(),
+        "translation_policy": translation_policy.stats(),
+        "single_flight": translation_flights.stats()
+    }
+
 @app.post("/api/upload")
 async def upload_docx(file: UploadFile = File(...)):
     if not file.filename.endswith('.docx'):
@@ -158,39 +124,8 @@ async def upload_docx(file: UploadFile = File(...)):
     try:
         contents = await file.read()
         
-        style_map = """
-        p[style-name='Heading 1'] => h1.heading-1:fresh
-        p[style-name='Heading 2'] => h2.heading-2:fresh
-        p[style-name='Heading 3'] => h3.heading-3:fresh
-        p[style-name='Title'] => h1.title:fresh
-        p[style-name='Subtitle'] => h2.subtitle:fresh
-        r[style-name='Strong'] => strong
-        p[style-name='Quote'] => blockquote:fresh
-        p[style-name='Normal'] => p.normal:fresh
-        p[style-name='Body Text'] => p.body-text:fresh
-        p[style-name='List Paragraph'] => p.list-paragraph:fresh
-        """
-        
-        result = mammoth.convert_to_html(
-            io.BytesIO(contents),
-            style_map=style_map,
-            include_default_style_map=True,
-            include_embedded_style_map=True
-        )
-        
-        html_content = result.value
-        
-        soup = BeautifulSoup(html_content, 'html.parser')
-        paragraphs = soup.find_all('p')
-        for p in paragraphs:
-            if not p.get_text(strip=True) and not p.find('img'):
-                p.string = '\u00a0'
-        
-        html_content = str(soup)
-        
-        html_with_spans = wrap_sentences_in_html(html_content)
-        
-        pages = paginate_html(html_with_spans)
+        # Конвертация и разбивка на страницы в пуле процессов
+        pages = await docx_pool.run(process_preview_docx, contents)
         
         return JSONResponse({
             "success": True,
@@ -202,133 +137,49 @@ async def upload_docx(file: UploadFile = File(...)):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing file: {str(e)}")
 
+async def translate_with_memory(text: str, source_language: str, target_language: str, model: str) -> tuple:
+    """
+    Перевод через память переводов и политику вызова моделей
+
+    Returns:
+        (перевод, модель, которая его сделала, взят ли из памяти)
+    """
+    # Повторяющийся текст берем из памяти переводов
+    translated_text = await translation_memory.get(text, source_language, target_language, model)
+    if translated_text is not None:
+        return translated_text, model, True
+    
+    # Повторы, hedging и запасные модели - см. translation_policy
+    translated_text, answered_by = await translation_policy.translate(text, source_language, target_language, model)
+    await translation_memory.put(text, translated_text, source_language, target_language, answered_by)
+    return translated_text, answered_by, False
+
 @app.post("/api/translate")
 async def translate_text(request: TranslateRequest):
     """Прокси endpoint для перевода текста через внешний API"""
 
     try:
-        if request.model == "chatgpt":
-            # Используем ChatGPT API для перевода
-            OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
-            
-            if not OPENAI_API_KEY:
-                raise HTTPException(status_code=500, detail="OpenAI API key not configured")
-            
-            try:
-                from openai import OpenAI
-                client = OpenAI(api_key=OPENAI_API_KEY)
-                
-                # Определяем языки
-                lang_map = {
-                    "eng": "English",
-                    "kaz": "Kazakh",
-                    "rus": "Russian"
-                }
-                
-                source_lang = lang_map.get(request.source_language, request.source_language)
-                target_lang = lang_map.get(request.target_language, request.target_language)
-                
-                response = client.chat.completions.create(
-                    model="gpt-4",
-                    messages=[
-                        {"role": "system", "content": "You are a professional translator. Translate the given text accurately, preserving its meaning and tone. Only provide the translation without any explanations or additional text."},
-                        {"role": "user", "content": f"Translate the following text from {source_lang} to {target_lang}:\n\n{request.text}"}
-                    ],
-                    temperature=0.3,
-                    max_tokens=1000
-                )
-                
-                translated_text = response.choices[0].message.content.strip()
-                
-                return JSONResponse({
-                    "success": True,
-                    "text": translated_text,
-                    "source_language": request.source_language,
-                    "target_language": request.target_language,
-                    "model": "chatgpt"
-                })
-            except Exception as e:
-                raise HTTPException(status_code=500, detail=f"ChatGPT translation error: {str(e)}")
-                
-        elif request.model == "claude":
-            # Используем Claude API
-            CLAUDE_API_KEY = os.getenv('CLAUDE_API_KEY')
-            CLAUDE_API_URL = os.getenv('CLAUDE_API_URL', 'https://api.anthropic.com/v1/messages')
-            
-            if not CLAUDE_API_KEY:
-                raise HTTPException(status_code=500, detail="Claude API key not configured")
-
-            async with httpx.AsyncClient(timeout=60.0) as client:
-                response = await client.post(
-                    CLAUDE_API_URL,
-                    headers={
-                        'x-api-key': CLAUDE_API_KEY,
-                        'anthropic-version': '2023-06-01',
-                        'Content-Type': 'application/json',
-                    },
-                    json={
-                        'model': 'claude-sonnet-4-5-20250929',
-                        'max_tokens': 4096,
-                        'messages': [{
-                            'role': 'user',
-                            'content': f'Translate the following text from English to Kazakh. Only provide the translation, no explanations:\n\n{request.text}'
-                        }]
-                    }
-                )
-
-                if response.status_code != 200:
-                    raise HTTPException(
-                        status_code=response.status_code,
-                        detail=f"Claude API error: {response.text}"
-                    )
-
-                data = response.json()
-                translated_text = data['content'][0]['text'].strip()
-
-                return JSONResponse({
-                    "success": True,
-                    "text": translated_text,
-                    "source_language": request.source_language,
-                    "target_language": request.target_language,
-                    "model": "claude"
-                })
-        else:
-            # Используем KazLLM API
-            TRANSLATION_API_URL = os.getenv('TRANSLATION_API_URL', 'https://mangisoz.nu.edu.kz/external-api/v1/translate/text/')
-            TRANSLATION_API_KEY = os.getenv('TRANSLATION_API_KEY')
-            
-            if not TRANSLATION_API_KEY:
-                raise HTTPException(status_code=500, detail="Translation API key not configured")
-
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(
-                    TRANSLATION_API_URL,
-                    headers={
-                        'Authorization': f'Bearer {TRANSLATION_API_KEY}',
-                        'Content-Type': 'application/json',
-                    },
-                    json={
-                        'source_language': request.source_language,
-                        'target_language': request.target_language,
-                        'text': request.text,
-                    }
-                )
-
-                if response.status_code != 200:
-                    raise HTTPException(
-                        status_code=response.status_code,
-                        detail=f"Translation API error: {response.text}"
-                    )
-
-                data = response.json()
-                return JSONResponse({
-                    "success": True,
-                    "text": data.get('text', request.text),
-                    "source_language": request.source_language,
-                    "target_language": request.target_language,
-                    "model": "kazllm"
-                })
+        model = resolve_model(request.model)
+        
+        # Одинаковые одновременные запросы ждут один вызов модели
+        translated_text, answered_by, cached = await translation_flights.run(
+            ("translate", make_key(request.text, request.source_language, request.target_language, model)),
+            lambda: translate_with_memory(request.text, request.source_language, request.target_language, model)
+        )
+        
+        return JSONResponse({
+            "success": True,
+            "text": translated_text,
+            "source_language": request.source_language,
+            "target_language": request.target_language,
+            "model": answered_by,
+            "requested_model": model,
+            "cached": cached
+        })
 
+    except HTTPException:
+        # Статус внешнего сервиса (например, 429) отдаем как есть
+        raise
     except httpx.TimeoutException:
         raise HTTPException(status_code=504, detail="Translation service timeout")
     except httpx.RequestError as e:
@@ -336,9 +187,38 @@ async def translate_text(request: TranslateRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error translating text: {str(e)}")
 
+@app.post("/api/translate/batch")
+async def translate_text_batch(request: BatchTranslateRequest):
+    """
+    Перевод списка предложений одним запросом
+
+    Результат возвращается для каждого предложения отдельно,
+    ошибки одних предложений не мешают переводу остальных.
+    """
+    if len(request.items) > TRANSLATE_BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many items: at most {TRANSLATE_BATCH_MAX_ITEMS} per request"
+        )
+    
+    model = resolve_model(request.model)
+    result = await translate_batch(request.items, request.source_language, request.target_language, model)
+    
+    return JSONResponse({
+        "success": result["failed"] == 0,
+        "source_language": request.source_language,
+        "target_language": request.target_language,
+        "model": model,
+        **result
+    })
+
 @app.post("/api/chatgpt")
-async def chat_with_gpt(request: ChatGPTRequest):
-    """Endpoint для общения с ChatGPT API"""
+async def chat_with_gpt(request: ChatGPTRequest, stream: bool = False):
+    """
+    Endpoint для общения с ChatGPT API
+
+    С ?stream=true ответ приходит по мере генерации как SSE (см. chat_streams)
+    """
     
     try:
         OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
@@ -346,9 +226,15 @@ async def chat_with_gpt(request: ChatGPTRequest):
         if not OPENAI_API_KEY:
             raise HTTPException(status_code=500, detail="OpenAI API key not configured")
         
-        client = OpenAI(api_key=OPENAI_API_KEY)
+        if stream:
+            return sse_response(await open_chatgpt_stream(
+                request.model, request.system_prompt, request.message,
+                request.temperature, request.max_tokens
+            ))
+        
+        client = http_clients.openai
         
-        response = client.chat.completions.create(
+        response = await client.chat.completions.create(
             model=request.model,
             messages=[
                 {"role": "system", "content": request.system_prompt},
@@ -371,12 +257,18 @@ async def chat_with_gpt(request: ChatGPTRequest):
             }
         })
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error communicating with ChatGPT: {str(e)}")
 
 @app.post("/api/claude")
-async def chat_with_claude(request: ClaudeRequest):
-    """Endpoint для общения с Claude API"""
+async def chat_with_claude(request: ClaudeRequest, stream: bool = False):
+    """
+    Endpoint для общения с Claude API
+
+    С ?stream=true ответ приходит по мере генерации как SSE (см. chat_streams)
+    """
     
     try:
         CLAUDE_API_KEY = os.getenv('CLAUDE_API_KEY')
@@ -385,45 +277,53 @@ async def chat_with_claude(request: ClaudeRequest):
         if not CLAUDE_API_KEY:
             raise HTTPException(status_code=500, detail="Claude API key not configured")
         
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            response = await client.post(
-                CLAUDE_API_URL,
-                headers={
-                    'x-api-key': CLAUDE_API_KEY,
-                    'anthropic-version': '2023-06-01',
-                    'Content-Type': 'application/json',
-                },
-                json={
-                    'model': request.model,
-                    'max_tokens': request.max_tokens,
-                    'temperature': request.temperature,
-                    'system': request.system_prompt,
-                    'messages': [{
-                        'role': 'user',
-                        'content': request.message
-                    }]
-                }
+        if stream:
+            return sse_response(await open_claude_stream(
+                request.model, request.system_prompt, request.message,
+                request.temperature, request.max_tokens
+            ))
+        
+        client = http_clients.claude
+        response = await client.post(
+            CLAUDE_API_URL,
+            headers={
+                'x-api-key': CLAUDE_API_KEY,
+                'anthropic-version': '2023-06-01',
+                'Content-Type': 'application/json',
+            },
+            json={
+                'model': request.model,
+                'max_tokens': request.max_tokens,
+                'temperature': request.temperature,
+                'system': request.system_prompt,
+                'messages': [{
+                    'role': 'user',
+                    'content': request.message
+                }]
+            }
+        )
+        
+        if response.status_code != 200:
+            raise HTTPException(
+                status_code=response.status_code,
+                detail=f"Claude API error: {response.text}"
             )
-            
-            if response.status_code != 200:
-                raise HTTPException(
-                    status_code=response.status_code,
-                    detail=f"Claude API error: {response.text}"
-                )
-            
-            data = response.json()
-            assistant_message = data['content'][0]['text']
-            
-            return JSONResponse({
-                "success": True,
-                "message": assistant_message,
-                "model": request.model,
-                "usage": {
-                    "input_tokens": data['usage']['input_tokens'],
-                    "output_tokens": data['usage']['output_tokens']
-                }
-            })
         
+        data = response.json()
+        assistant_message = data['content'][0]['text']
+        
+        return JSONResponse({
+            "success": True,
+            "message": assistant_message,
+            "model": request.model,
+            "usage": {
+                "input_tokens": data['usage']['input_tokens'],
+                "output_tokens": data['usage']['output_tokens']
+            }
+        })
+        
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error communicating with Claude: {str(e)}")
 
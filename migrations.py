@@ -0,0 +1,79 @@
+"""
+Версионные миграции схемы БД
+
+Каждая миграция применяется один раз, по порядку номеров; примененные
+записываются в таблицу schema_migrations. init_database создает базовые
+таблицы и затем применяет новые миграции (python init_db.py).
+
+Новая миграция добавляется в конец MIGRATIONS со следующим номером,
+уже примененные миграции не редактируются.
+"""
+from typing import List
+
+# Ключ advisory lock: миграции не применяются одновременно из двух процессов
+MIGRATIONS_LOCK_ID = 7310001
+
+MIGRATIONS = [
+    (
+        1,
+        "Составные и покрывающие индексы для запросов книг и переводов",
+        """
+        -- Список книг: WHERE user_id ORDER BY uploaded_at DESC без сортировки.
+        -- Выборки только по user_id покрывает UNIQUE(user_id, s3_key)
+        CREATE INDEX IF NOT EXISTS idx_books_user_uploaded ON books(user_id, uploaded_at DESC);
+        DROP INDEX IF EXISTS idx_books_user_id;
+
+        -- Страницы книги и диапазоны страниц покрывает UNIQUE(book_id, page_number)
+        DROP INDEX IF EXISTS idx_book_pages_book_id;
+
+        -- Переводы диапазона страниц и join с версиями: id и sentence_id
+        -- берутся из индекса. Выборки по book_id и (book_id, sentence_id)
+        -- покрывает UNIQUE(book_id, sentence_id)
+        CREATE INDEX IF NOT EXISTS idx_translations_book_page_covering
+            ON translations(book_id, page_number) INCLUDE (id, sentence_id, is_approved);
+        DROP INDEX IF EXISTS idx_translations_book_page;
+        DROP INDEX IF EXISTS idx_translations_book_id;
+
+        -- Версии перевода по времени: история, последняя версия при сохранении,
+        -- отсечение старых версий
+        CREATE INDEX IF NOT EXISTS idx_translation_versions_translation_created
+            ON translation_versions(translation_id, created_at, id);
+        DROP INDEX IF EXISTS idx_translation_versions_translation_id;
+
+        -- Последняя задача перевода книги
+        CREATE INDEX IF NOT EXISTS idx_book_translation_jobs_book_created
+            ON book_translation_jobs(book_id, created_at DESC);
+        """
+    ),
+]
+
+def apply_migrations(cursor) -> List[int]:
+    """
+    Применяет еще не примененные миграции в транзакции вызывающего кода
+
+    Returns:
+        номера примененных сейчас миграций
+    """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATIONS_LOCK_ID,))
+    cursor.execute("SELECT version FROM schema_migrations")
+    applied = {row['version'] for row in cursor.fetchall()}
+
+    new_versions = []
+    for version, description, sql in MIGRATIONS:
+        if version in applied:
+            continue
+        cursor.execute(sql)
+        cursor.execute(
+            "INSERT INTO schema_migrations (version, description) VALUES (%s, %s)",
+            (version, description)
+        )
+        print(f"[OK] Migration {version} applied: {description}")
+        new_versions.append(version)
+    return new_versions
@@ -0,0 +1,110 @@
+"""
+Пул процессов для CPU-тяжелой обработки DOCX
+
+Конвертация mammoth и разбор BeautifulSoup выполняются вне event loop,
+чтобы одна большая загрузка не блокировала остальные запросы воркера.
+"""
+import asyncio
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Количество процессов пула и лимит одновременных задач (на каждый воркер uvicorn)
+DOCX_POOL_WORKERS = int(os.getenv('DOCX_POOL_WORKERS', 2))
+DOCX_POOL_MAX_JOBS = int(os.getenv('DOCX_POOL_MAX_JOBS', DOCX_POOL_WORKERS))
+
+class ProcessPool:
+    """Пул процессов с ограничением одновременных задач и метриками очереди"""
+
+    def __init__(self, name: str, max_workers: int, max_jobs: int):
+        self.name = name
+        self.max_workers = max(1, max_workers)
+        self.max_jobs = max(1, max_jobs)
+        self._executor = None
+        self._semaphore = None
+
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.max_queued = 0
+        self.total_wait_time = 0.0
+        self.max_wait_time = 0.0
+        self.total_run_time = 0.0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_jobs)
+        return self._semaphore
+
+    async def run(self, func, *args):
+        """
+        Выполняет func(*args) в отдельном процессе
+
+        Если уже выполняется max_jobs задач, ждет в очереди.
+        func и аргументы должны сериализоваться через pickle.
+        """
+        semaphore = self._get_semaphore()
+        queued_at = time.monotonic()
+
+        self.queued += 1
+        if semaphore.locked():
+            self.max_queued = max(self.max_queued, self.queued)
+        try:
+            await semaphore.acquire()
+        finally:
+            self.queued -= 1
+
+        wait_time = time.monotonic() - queued_at
+        self.total_wait_time += wait_time
+        self.max_wait_time = max(self.max_wait_time, wait_time)
+
+        self.running += 1
+        started_at = time.monotonic()
+        try:
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(self._get_executor(), func, *args)
+            self.completed += 1
+            return result
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.running -= 1
+            self.total_run_time += time.monotonic() - started_at
+            semaphore.release()
+
+    def stats(self) -> dict:
+        """Метрики пула: глубина очереди, занятость, время ожидания"""
+        finished = self.completed + self.failed
+        started = finished + self.running
+        return {
+            "name": self.name,
+            "max_workers": self.max_workers,
+            "max_jobs": self.max_jobs,
+            "queued": self.queued,
+            "running": self.running,
+            "max_queued": self.max_queued,
+            "completed": self.completed,
+            "failed": self.failed,
+            "avg_wait_ms": round(self.total_wait_time / started * 1000, 1) if started else 0.0,
+            "max_wait_ms": round(self.max_wait_time * 1000, 1),
+            "avg_run_ms": round(self.total_run_time / finished * 1000, 1) if finished else 0.0
+        }
+
+    def shutdown(self):
+        """Останавливает процессы пула"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+# Общий пул для конвертации DOCX
+docx_pool = ProcessPool("docx", DOCX_POOL_WORKERS, DOCX_POOL_MAX_JOBS)
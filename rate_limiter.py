@@ -0,0 +1,242 @@
+"""
+Ограничение частоты запросов к внешним API перевода
+
+Для каждого сервиса (kazllm, claude, chatgpt) свой governor: два token bucket -
+запросы в минуту (RPM) и токены в минуту (TPM). Запрос, который не помещается
+в лимит, ждет в очереди, а не падает. На 429 governor делает паузу (по
+retry-after, если сервис его прислал), снижает свои лимиты и повторяет запрос;
+успешные ответы постепенно возвращают лимиты к настроенным.
+"""
+import asyncio
+import email.utils
+import os
+import time
+from typing import Awaitable, Callable, Optional
+from fastapi import HTTPException
+from dotenv import load_dotenv
+
+load_dotenv()
+
+RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+
+# Лимиты сервисов, 0 - без лимита (только паузы по 429)
+KAZLLM_RPM = int(os.getenv('KAZLLM_RPM', 0))
+KAZLLM_TPM = int(os.getenv('KAZLLM_TPM', 0))
+CLAUDE_RPM = int(os.getenv('CLAUDE_RPM', 0))
+CLAUDE_TPM = int(os.getenv('CLAUDE_TPM', 0))
+OPENAI_RPM = int(os.getenv('OPENAI_RPM', 0))
+OPENAI_TPM = int(os.getenv('OPENAI_TPM', 0))
+
+# Сколько секунд лимита можно потратить разом
+RATE_LIMIT_BURST_SECONDS = float(os.getenv('RATE_LIMIT_BURST_SECONDS', 10))
+# Во сколько раз снижаются лимиты на 429 и до какой доли от настроенных
+RATE_LIMIT_DECREASE = float(os.getenv('RATE_LIMIT_DECREASE', 0.5))
+RATE_LIMIT_MIN_FACTOR = float(os.getenv('RATE_LIMIT_MIN_FACTOR', 0.1))
+# На сколько растет доля лимита после каждого успешного запроса
+RATE_LIMIT_RECOVERY_STEP = float(os.getenv('RATE_LIMIT_RECOVERY_STEP', 0.02))
+# Пауза на 429 без retry-after: удваивается с каждым 429 подряд
+RATE_LIMIT_BACKOFF_SECONDS = float(os.getenv('RATE_LIMIT_BACKOFF_SECONDS', 1))
+RATE_LIMIT_MAX_BACKOFF_SECONDS = float(os.getenv('RATE_LIMIT_MAX_BACKOFF_SECONDS', 60))
+# Сколько раз повторять запрос после 429, прежде чем вернуть 429 клиенту
+RATE_LIMIT_MAX_RETRIES = int(os.getenv('RATE_LIMIT_MAX_RETRIES', 5))
+
+class RateLimited(Exception):
+    """Внешний сервис ответил 429"""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+def parse_retry_after(headers) -> Optional[float]:
+    """Секунды из retry-after-ms / retry-after (число или HTTP дата)"""
+    value = headers.get('retry-after-ms')
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+
+    value = headers.get('retry-after')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+class RateGovernor:
+    """Token bucket по запросам и токенам одного сервиса с адаптацией к 429"""
+
+    def __init__(self, name: str, rpm: int, tpm: int):
+        self.name = name
+        self.rpm = rpm
+        self.tpm = tpm
+        # Доля настроенных лимитов, которую сейчас можно использовать
+        self.factor = 1.0
+        self._requests = self._capacity(rpm)
+        self._tokens = self._capacity(tpm)
+        self._refilled_at = time.monotonic()
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self._consecutive_throttles = 0
+        self._lock = None
+
+        self.waiting = 0
+        self.calls = 0
+        self.queued_calls = 0
+        self.throttled = 0
+        self.rejected = 0
+        self.queue_wait_total = 0.0
+        self.queue_wait_max = 0.0
+
+    def _get_lock(self) -> asyncio.Lock:
+        # Lock создается внутри event loop приложения
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    def _capacity(self, per_minute: int) -> float:
+        return max(1.0, per_minute * self.factor * RATE_LIMIT_BURST_SECONDS / 60) if per_minute else 0.0
+
+    def _refill(self, now: float):
+        elapsed = now - self._refilled_at
+        self._refilled_at = now
+        if self.rpm:
+            self._requests = min(self._capacity(self.rpm), self._requests + elapsed * self.rpm * self.factor / 60)
+        if self.tpm:
+            self._tokens = min(self._capacity(self.tpm), self._tokens + elapsed * self.tpm * self.factor / 60)
+
+    def _delay(self, tokens: int, now: float) -> float:
+        """Сколько ждать, пока запрос поместится в оба лимита"""
+        delay = self._paused_until - now
+        if self.rpm and self._requests < 1:
+            delay = max(delay, (1 - self._requests) * 60 / (self.rpm * self.factor))
+        if self.tpm:
+            # Запрос больше емкости пропускается при полном bucket (уходит в минус)
+            needed = min(tokens, self._capacity(self.tpm))
+            if self._tokens < needed:
+                delay = max(delay, (needed - self._tokens) * 60 / (self.tpm * self.factor))
+        return delay
+
+    async def acquire(self, tokens: int):
+        """Ждет своей очереди и места в лимитах (очередь FIFO)"""
+        queued_at = time.monotonic()
+        self.waiting += 1
+        try:
+            async with self._get_lock():
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    delay = self._delay(tokens, now)
+                    if delay <= 0:
+                        break
+                    await asyncio.sleep(delay)
+                if self.rpm:
+                    self._requests -= 1
+                if self.tpm:
+                    self._tokens -= tokens
+        finally:
+            self.waiting -= 1
+
+        waited = time.monotonic() - queued_at
+        self.calls += 1
+        if waited >= 0.001:
+            self.queued_calls += 1
+        self.queue_wait_total += waited
+        self.queue_wait_max = max(self.queue_wait_max, waited)
+
+    def on_success(self):
+        self._consecutive_throttles = 0
+        self.factor = min(1.0, self.factor + RATE_LIMIT_RECOVERY_STEP)
+
+    def on_throttle(self, retry_after: Optional[float]) -> float:
+        """Пауза и снижение лимитов после 429. Возвращает длину паузы"""
+        now = time.monotonic()
+        self.throttled += 1
+        if retry_after is None:
+            retry_after = min(
+                RATE_LIMIT_MAX_BACKOFF_SECONDS,
+                RATE_LIMIT_BACKOFF_SECONDS * 2 ** self._consecutive_throttles
+            )
+        self._paused_until = max(self._paused_until, now + retry_after)
+
+        # Одновременные запросы получают 429 пачкой - снижаем лимиты один раз за паузу
+        if now >= self._last_decrease + retry_after:
+            self._last_decrease = now
+            self._consecutive_throttles += 1
+            self.factor = max(RATE_LIMIT_MIN_FACTOR, self.factor * RATE_LIMIT_DECREASE)
+            # После паузы запросы идут с новой скоростью, без накопленного запаса
+            self._refill(now)
+            self._requests = min(self._requests, 0.0)
+            self._tokens = min(self._tokens, 0.0)
+            print(f"[RATE LIMIT] {self.name} throttled, pausing {retry_after:.1f}s, "
+                  f"limits lowered to {self.factor:.0%}")
+        return retry_after
+
+    async def run(self, tokens: int, call: Callable[[], Awaitable]):
+        """
+        Выполняет запрос к сервису в рамках лимитов
+
+        call - функция без аргументов, возвращающая корутину запроса;
+        на 429 она должна бросать RateLimited.
+        """
+        if not RATE_LIMIT_ENABLED:
+            try:
+                return await call()
+            except RateLimited as e:
+                raise HTTPException(status_code=429, detail=str(e))
+
+        attempt = 0
+        while True:
+            await self.acquire(tokens)
+            try:
+                result = await call()
+            except RateLimited as e:
+                pause = self.on_throttle(e.retry_after)
+                attempt += 1
+                if attempt > RATE_LIMIT_MAX_RETRIES:
+                    self.rejected += 1
+                    raise HTTPException(
+                        status_code=429,
+                        detail=f"{self.name} rate limit exceeded, try again later: {str(e)}",
+                        headers={"Retry-After": str(max(1, round(pause)))}
+                    )
+                continue
+            self.on_success()
+            return result
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        return {
+            "rpm_limit": self.rpm,
+            "tpm_limit": self.tpm,
+            "factor": round(self.factor, 3),
+            "effective_rpm": round(self.rpm * self.factor, 1),
+            "effective_tpm": round(self.tpm * self.factor, 1),
+            "paused_for_seconds": round(max(0.0, self._paused_until - now), 2),
+            "waiting": self.waiting,
+            "calls": self.calls,
+            "queued_calls": self.queued_calls,
+            "throttled": self.throttled,
+            "rejected": self.rejected,
+            "queue_wait_avg_ms": round(self.queue_wait_total * 1000 / self.calls, 1) if self.calls else 0,
+            "queue_wait_max_ms": round(self.queue_wait_max * 1000, 1)
+        }
+
+# Governor на каждый сервис перевода (на каждый воркер uvicorn)
+rate_governors = {
+    "kazllm": RateGovernor("kazllm", KAZLLM_RPM, KAZLLM_TPM),
+    "claude": RateGovernor("claude", CLAUDE_RPM, CLAUDE_TPM),
+    "chatgpt": RateGovernor("chatgpt", OPENAI_RPM, OPENAI_TPM)
+}
+
+def rate_limit_stats() -> dict:
+    """Метрики всех governor'ов"""
+    return {
+        "enabled": RATE_LIMIT_ENABLED,
+        **{name: governor.stats() for name, governor in rate_governors.items()}
+    }
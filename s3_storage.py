@@ -1,6 +1,7 @@
 import boto3
 from botocore.client import Config
 import os
+from typing import Optional
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -75,7 +76,8 @@ def ensure_bucket_exists():
         except Exception as e:
             print(f"[ERROR] Bucket creation failed: {e}")
 
-def upload_file_to_s3(file_content: bytes, s3_key: str, content_type: str = 'application/octet-stream') -> str:
+def upload_file_to_s3(file_content: bytes, s3_key: str, content_type: str = 'application/octet-stream',
+                      metadata: dict = None) -> str:
     """
     Загружает файл в S3
     
@@ -83,17 +85,21 @@ def upload_file_to_s3(file_content: bytes, s3_key: str, content_type: str = 'app
         file_content: содержимое файла в байтах
         s3_key: путь к файлу в S3 (например: "users/1/books/filename.docx")
         content_type: MIME-тип файла
+        metadata: пользовательские метаданные объекта (x-amz-meta-*)
         
     Returns:
         S3 key загруженного файла
     """
+    extra_args = {'Metadata': metadata} if metadata else {}
+
     # Пробуем сначала с unsigned клиентом (без payload signing)
     try:
         s3_client_unsigned.put_object(
             Bucket=S3_BUCKET_NAME,
             Key=s3_key,
             Body=file_content,
-            ContentType=content_type
+            ContentType=content_type,
+            **extra_args
         )
         return s3_key
     except Exception as e1:
@@ -104,7 +110,8 @@ def upload_file_to_s3(file_content: bytes, s3_key: str, content_type: str = 'app
                 Bucket=S3_BUCKET_NAME,
                 Key=s3_key,
                 Body=file_content,
-                ContentType=content_type
+                ContentType=content_type,
+                **extra_args
             )
             print(f"[S3] Upload successful with auto client")
             return s3_key
@@ -116,7 +123,8 @@ def upload_file_to_s3(file_content: bytes, s3_key: str, content_type: str = 'app
                     Bucket=S3_BUCKET_NAME,
                     Key=s3_key,
                     Body=file_content,
-                    ContentType=content_type
+                    ContentType=content_type,
+                    **extra_args
                 )
                 print(f"[S3] Upload successful with v4 client")
                 return s3_key
@@ -127,6 +135,22 @@ def upload_file_to_s3(file_content: bytes, s3_key: str, content_type: str = 'app
                 print(error_details)
                 raise Exception(f"Ошибка загрузки файла в S3: {str(e3)}")
 
+def get_file_sha256_from_s3(s3_key: str) -> Optional[str]:
+    """
+    SHA-256 содержимого объекта из его метаданных
+    
+    Args:
+        s3_key: путь к файлу в S3
+        
+    Returns:
+        hex-хеш, или None если объекта нет или хеш не был сохранен
+    """
+    try:
+        response = s3_client.head_object(Bucket=S3_BUCKET_NAME, Key=s3_key)
+        return response.get('Metadata', {}).get('sha256')
+    except Exception:
+        return None
+
 def download_file_from_s3(s3_key: str) -> bytes:
     """
     Скачивает файл из S3
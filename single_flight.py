@@ -0,0 +1,51 @@
+"""
+Объединение одинаковых одновременных запросов (single-flight)
+
+Пока запрос с ключом выполняется, такие же запросы не идут во внешний API,
+а ждут результат первого. Ключ перевода - ключ памяти переводов (текст,
+языковая пара и модель), поэтому двойной клик или несколько редакторов
+одной книги стоят одного вызова модели.
+"""
+import asyncio
+from typing import Awaitable, Callable, Hashable
+
+class SingleFlight:
+    """Общий результат для одновременных вызовов с одним ключом"""
+
+    def __init__(self):
+        self._inflight = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def run(self, key: Hashable, call: Callable[[], Awaitable]):
+        """
+        Выполняет call() или ждет уже запущенный вызов с тем же ключом
+
+        Вызов идет отдельной задачей: если отключится клиент, который его
+        начал, остальные все равно получат результат.
+        """
+        self.calls += 1
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(call())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _finish(self, key: Hashable, task: asyncio.Task):
+        self._inflight.pop(key, None)
+        # Ошибку забираем, даже если результат уже никто не ждет
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "inflight": len(self._inflight)
+        }
+
+# Переводы одного текста (на каждый воркер uvicorn)
+translation_flights = SingleFlight()
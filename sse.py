@@ -0,0 +1,45 @@
+"""
+Потоковые ответы: Server-Sent Events и NDJSON
+"""
+import json
+from typing import AsyncIterator
+from fastapi.responses import StreamingResponse
+
+# Без буферизации в nginx/прокси, иначе события приходят пачкой в конце
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no"
+}
+
+def sse_event(data: dict, event: str = None) -> str:
+    """Одно событие SSE с JSON в data"""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def sse_response(events: AsyncIterator[str]) -> StreamingResponse:
+    """Ответ text/event-stream из асинхронного генератора событий"""
+    return StreamingResponse(events, media_type="text/event-stream", headers=SSE_HEADERS)
+
+def ndjson_line(data: dict) -> str:
+    """Одна строка NDJSON"""
+    return json.dumps(data, ensure_ascii=False) + "\n"
+
+def stream_response(events: AsyncIterator[dict], stream_format: str = "sse") -> StreamingResponse:
+    """Поток событий-словарей как SSE (по умолчанию) или NDJSON"""
+    if stream_format == "ndjson":
+        lines = (ndjson_line(event) async for event in events)
+        return StreamingResponse(lines, media_type="application/x-ndjson", headers=SSE_HEADERS)
+    return sse_response(sse_event(event) async for event in events)
+
+async def iter_sse_data(lines: AsyncIterator[str]) -> AsyncIterator[str]:
+    """Строки data из входящего потока SSE (по одной на событие)"""
+    data = []
+    async for line in lines:
+        if not line:
+            if data:
+                yield '\n'.join(data)
+                data = []
+        elif line.startswith('data:'):
+            data.append(line[5:].lstrip())
+    if data:
+        yield '\n'.join(data)
@@ -0,0 +1,97 @@
+"""
+Общие фикстуры тестов на локальном Postgres
+
+Тесты работают в отдельной базе <имя из DATABASE_URL>_tests: она создается
+в начале прогона через init_database (с миграциями) и удаляется в конце.
+Без DATABASE_URL тесты пропускаются.
+
+Запуск:
+    python -m pytest -q tests
+"""
+import asyncio
+import os
+import sys
+import uuid
+import pytest
+import psycopg
+from psycopg.conninfo import conninfo_to_dict, make_conninfo
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+load_dotenv()
+
+BASE_DATABASE_URL = os.getenv('DATABASE_URL')
+TEST_DATABASE = f"{conninfo_to_dict(BASE_DATABASE_URL)['dbname']}_tests" if BASE_DATABASE_URL else None
+
+# Модули приложения читают настройки при импорте: подменяем их до импорта тестов
+if BASE_DATABASE_URL:
+    os.environ['DATABASE_URL'] = make_conninfo(BASE_DATABASE_URL, dbname=TEST_DATABASE)
+os.environ['TRANSLATION_STUB_ENABLED'] = 'true'
+os.environ['TRANSLATION_MEMORY_ENABLED'] = 'false'
+
+def pytest_sessionstart(session):
+    if not BASE_DATABASE_URL:
+        return
+    with psycopg.connect(BASE_DATABASE_URL, autocommit=True) as conn:
+        conn.execute(f'DROP DATABASE IF EXISTS "{TEST_DATABASE}" WITH (FORCE)')
+        conn.execute(f'CREATE DATABASE "{TEST_DATABASE}"')
+
+    from database import init_database, db_pool
+    init_database()
+    db_pool.close_all()
+
+def pytest_sessionfinish(session, exitstatus):
+    if not BASE_DATABASE_URL:
+        return
+    with psycopg.connect(BASE_DATABASE_URL, autocommit=True) as conn:
+        conn.execute(f'DROP DATABASE IF EXISTS "{TEST_DATABASE}" WITH (FORCE)')
+
+@pytest.fixture(scope="session")
+def run():
+    """Выполняет корутину в общем event loop, где открыт async_db_pool"""
+    if not BASE_DATABASE_URL:
+        pytest.skip("DATABASE_URL is not set")
+
+    from database import async_db_pool
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(async_db_pool.open())
+    yield loop.run_until_complete
+    loop.run_until_complete(async_db_pool.close())
+    loop.close()
+
+async def fetch(sql: str, params: tuple = ()) -> list:
+    """Строки запроса в отдельной транзакции"""
+    from database import get_async_db_connection
+    async with get_async_db_connection() as conn:
+        cursor = conn.cursor()
+        await cursor.execute(sql, params)
+        return await cursor.fetchall()
+
+def page_html(page_number: int, sentences: int) -> str:
+    """Страница в формате docx_pipeline: предложения в span.sentence"""
+    return "<p>" + " ".join(
+        f'<span class="sentence" data-sentence-id="sent-{page_number}-{i}">Sentence {i} of page {page_number}.</span>'
+        for i in range(1, sentences + 1)
+    ) + "</p>"
+
+@pytest.fixture
+def book(run):
+    """Книга нового пользователя: 3 страницы по 4 предложения. Возвращает book_id"""
+    from database import get_async_db_connection
+    from book_storage import save_book
+
+    async def create() -> int:
+        async with get_async_db_connection() as conn:
+            cursor = conn.cursor()
+            await cursor.execute(
+                "INSERT INTO users (username, password_hash) VALUES (%s, 'x') RETURNING id",
+                (f"test_{uuid.uuid4().hex[:12]}",)
+            )
+            user_id = (await cursor.fetchone())['id']
+            saved = await save_book(
+                cursor, user_id, "Test book", f"users/{user_id}/books/test.docx",
+                [page_html(page, 4) for page in range(1, 4)], 12
+            )
+            return saved['book_id']
+
+    return run(create())
@@ -0,0 +1,156 @@
+"""
+save_translations, approve_translations и счетчики книги на локальном Postgres
+"""
+import book_storage
+from book_storage import approve_translations, reconcile_book_counters, save_translations
+from database import get_async_db_connection
+from conftest import fetch
+
+def save(run, book_id: int, rows: list, overwrite: bool = True) -> list:
+    async def call():
+        async with get_async_db_connection() as conn:
+            return await save_translations(conn.cursor(), book_id, rows, overwrite=overwrite)
+    return run(call())
+
+def approve(run, book_id: int, **selector) -> list:
+    async def call():
+        async with get_async_db_connection() as conn:
+            return await approve_translations(conn.cursor(), book_id, **selector)
+    return run(call())
+
+def reconcile(run, book_id: int) -> dict:
+    async def call():
+        async with get_async_db_connection() as conn:
+            return await reconcile_book_counters(conn.cursor(), book_id)
+    return run(call())
+
+def translations(run, book_id: int) -> dict:
+    rows = run(fetch(
+        "SELECT sentence_id, current_translation, is_approved FROM translations WHERE book_id = %s",
+        (book_id,)
+    ))
+    return {row['sentence_id']: row for row in rows}
+
+def versions(run, book_id: int, sentence_id: str, with_time: bool = False) -> list:
+    rows = run(fetch(
+        """
+        SELECT tv.text, tv.model, tv.created_at
+        FROM translation_versions tv JOIN translations t ON t.id = tv.translation_id
+        WHERE t.book_id = %s AND t.sentence_id = %s
+        ORDER BY tv.created_at, tv.id
+        """,
+        (book_id, sentence_id)
+    ))
+    if with_time:
+        return [(row['text'], row['model'], row['created_at']) for row in rows]
+    return [(row['text'], row['model']) for row in rows]
+
+def book_counters(run, book_id: int) -> tuple:
+    row = run(fetch("SELECT translated_sentences, approved_sentences FROM books WHERE id = %s", (book_id,)))[0]
+    return row['translated_sentences'], row['approved_sentences']
+
+def test_save_inserts_translations_versions_and_counter(run, book):
+    saved = save(run, book, [
+        (1, "sent-1-1", "Sentence 1", "Бірінші", "claude"),
+        (1, "sent-1-2", "Sentence 2", "Екінші", "claude"),
+    ])
+
+    assert sorted(row['sentence_id'] for row in saved) == ["sent-1-1", "sent-1-2"]
+    assert translations(run, book)["sent-1-1"]['current_translation'] == "Бірінші"
+    assert versions(run, book, "sent-1-2") == [("Екінші", "claude")]
+    assert book_counters(run, book) == (2, 0)
+
+def test_save_updates_translation_without_counting_it_again(run, book):
+    save(run, book, [(1, "sent-1-1", "Sentence 1", "v1", "claude")])
+    save(run, book, [(1, "sent-1-1", "Sentence 1", "v2", "chatgpt")])
+
+    assert translations(run, book)["sent-1-1"]['current_translation'] == "v2"
+    assert versions(run, book, "sent-1-1") == [("v1", "claude"), ("v2", "chatgpt")]
+    assert book_counters(run, book) == (1, 0)
+
+def test_save_without_overwrite_keeps_existing_translations(run, book):
+    save(run, book, [(1, "sent-1-1", "Sentence 1", "MINE", None)])
+    saved = save(run, book, [
+        (1, "sent-1-1", "Sentence 1", "machine", "stub"),
+        (1, "sent-1-2", "Sentence 2", "machine", "stub"),
+    ], overwrite=False)
+
+    assert [row['sentence_id'] for row in saved] == ["sent-1-2"]
+    assert translations(run, book)["sent-1-1"]['current_translation'] == "MINE"
+    assert versions(run, book, "sent-1-1") == [("MINE", None)]
+    assert book_counters(run, book) == (2, 0)
+
+def test_save_skips_version_that_repeats_the_latest(run, book):
+    for text in ("x", "x", "y", "y"):
+        save(run, book, [(1, "sent-1-1", "Sentence 1", text, None)])
+
+    assert versions(run, book, "sent-1-1") == [("x", None), ("y", None)]
+
+def test_save_keeps_last_row_for_repeated_sentence(run, book):
+    saved = save(run, book, [
+        (1, "sent-1-1", "Sentence 1", "first", "claude"),
+        (1, "sent-1-1", "Sentence 1", "second", "claude"),
+    ])
+
+    assert len(saved) == 1
+    assert translations(run, book)["sent-1-1"]['current_translation'] == "second"
+    assert versions(run, book, "sent-1-1") == [("second", "claude")]
+
+def test_save_does_not_collapse_versions_by_default(run, book):
+    save(run, book, [(1, "sent-1-1", "Sentence 1", "v1", "claude")])
+    save(run, book, [(1, "sent-1-1", "Sentence 1", "v2", "claude")])
+
+    assert versions(run, book, "sent-1-1") == [("v1", "claude"), ("v2", "claude")]
+
+def test_save_collapses_same_model_versions_within_window(run, book, monkeypatch):
+    monkeypatch.setattr(book_storage, 'TRANSLATION_VERSIONS_COLLAPSE_SECONDS', 60)
+    save(run, book, [(1, "sent-1-1", "Sentence 1", "v1", "claude")])
+    [(_, _, first_saved_at)] = versions(run, book, "sent-1-1", with_time=True)
+    save(run, book, [(1, "sent-1-1", "Sentence 1", "v2", "claude")])
+    [(_, _, collapsed_at)] = versions(run, book, "sent-1-1", with_time=True)
+    save(run, book, [(1, "sent-1-1", "Sentence 1", "v3", "chatgpt")])
+
+    assert versions(run, book, "sent-1-1") == [("v2", "claude"), ("v3", "chatgpt")]
+    # Окно отсчитывается от последнего сохранения, а не от первого
+    assert collapsed_at > first_saved_at
+
+def test_save_never_collapses_manual_edits(run, book, monkeypatch):
+    monkeypatch.setattr(book_storage, 'TRANSLATION_VERSIONS_COLLAPSE_SECONDS', 60)
+    for text in ("one", "one", "two"):
+        save(run, book, [(1, "sent-1-1", "Sentence 1", text, None)])
+
+    assert versions(run, book, "sent-1-1") == [("one", None), ("two", None)]
+
+def test_save_keeps_only_latest_versions(run, book, monkeypatch):
+    monkeypatch.setattr(book_storage, 'TRANSLATION_VERSIONS_KEEP', 3)
+    for i in range(6):
+        save(run, book, [(1, "sent-1-1", "Sentence 1", f"v{i}", "claude")])
+
+    assert versions(run, book, "sent-1-1") == [("v3", "claude"), ("v4", "claude"), ("v5", "claude")]
+
+def test_approve_page_updates_page_and_book_counters(run, book):
+    save(run, book, [(page, f"sent-{page}-{i}", "o", "t", None) for page in (1, 2) for i in (1, 2, 3)])
+
+    pages = approve(run, book, page_number=1)
+
+    assert [(row['page_number'], row['approved'], row['approved_sentences']) for row in pages] == [(1, 3, 3)]
+    assert book_counters(run, book) == (6, 3)
+    assert not translations(run, book)["sent-2-1"]['is_approved']
+
+def test_approve_counts_each_sentence_once(run, book):
+    save(run, book, [(page, f"sent-{page}-{i}", "o", "t", None) for page in (1, 2) for i in (1, 2)])
+
+    approve(run, book, sentence_ids=["sent-1-1"])
+    assert approve(run, book, sentence_ids=["sent-1-1"]) == []
+    pages = approve(run, book)
+
+    assert [(row['page_number'], row['approved'], row['approved_sentences']) for row in pages] == [(1, 1, 2), (2, 2, 2)]
+    assert book_counters(run, book) == (4, 4)
+    assert all(row['is_approved'] for row in translations(run, book).values())
+
+def test_counters_match_translations(run, book):
+    save(run, book, [(1, f"sent-1-{i}", "o", "t", None) for i in (1, 2, 3)])
+    save(run, book, [(2, "sent-2-1", "o", "t", "stub"), (1, "sent-1-1", "o", "t2", "stub")], overwrite=False)
+    approve(run, book, sentence_ids=["sent-1-2", "sent-2-1"])
+
+    assert reconcile(run, book) == {"books": 0, "pages": 0}
@@ -0,0 +1,104 @@
+"""
+Задачи перевода книги: создание, захват, продолжение после перезапуска, отмена
+"""
+from book_translation_jobs import (
+    _claim_job,
+    _find_resumable_jobs,
+    _record_progress,
+    cancel_book_translation_job,
+    create_book_translation_job,
+    run_book_translation_job,
+)
+from book_storage import save_translations
+from database import get_async_db_connection
+from conftest import fetch
+
+def owner(run, book_id: int) -> int:
+    return run(fetch("SELECT user_id FROM books WHERE id = %s", (book_id,)))[0]['user_id']
+
+def create_job(run, book_id: int) -> dict:
+    return run(create_book_translation_job(owner(run, book_id), book_id, "stub", "eng", "kaz"))
+
+def job_row(run, job_id: int) -> dict:
+    return run(fetch("SELECT * FROM book_translation_jobs WHERE id = %s", (job_id,)))[0]
+
+def make_stale(run, job_id: int):
+    async def call():
+        async with get_async_db_connection() as conn:
+            await conn.execute(
+                "UPDATE book_translation_jobs SET updated_at = updated_at - interval '1 day' WHERE id = %s",
+                (job_id,)
+            )
+    run(call())
+
+def test_create_returns_active_job_instead_of_second_one(run, book):
+    first = create_job(run, book)
+    second = create_job(run, book)
+
+    assert first['created'] and not second['created']
+    assert second['job_id'] == first['job_id']
+    assert job_row(run, first['job_id'])['total_sentences'] == 12
+
+def test_claim_takes_pending_job_once(run, book):
+    job_id = create_job(run, book)['job_id']
+
+    claimed = run(_claim_job(job_id))
+
+    assert claimed['attempts'] == 1 and claimed['last_page'] == 0
+    assert job_row(run, job_id)['status'] == 'processing'
+    # Свежую задачу в работе уже выполняет другой процесс
+    assert run(_claim_job(job_id)) is None
+    assert job_id not in run(_find_resumable_jobs())
+
+def test_stale_processing_job_is_resumed_and_reclaimed(run, book):
+    job_id = create_job(run, book)['job_id']
+    run(_claim_job(job_id))
+    make_stale(run, job_id)
+
+    assert job_id in run(_find_resumable_jobs())
+    assert run(_claim_job(job_id))['attempts'] == 2
+
+def test_resumed_job_continues_after_last_page(run, book):
+    job_id = create_job(run, book)['job_id']
+    run(_claim_job(job_id))
+
+    # Прошлая попытка успела сохранить первую страницу и упала
+    async def save_first_page():
+        async with get_async_db_connection() as conn:
+            await save_translations(conn.cursor(), book, [
+                (1, f"sent-1-{i}", f"Sentence {i} of page 1.", f"before {i}", "stub") for i in range(1, 5)
+            ])
+            await conn.execute("UPDATE book_translation_jobs SET last_page = 1 WHERE id = %s", (job_id,))
+    run(save_first_page())
+
+    # Пользователь сам перевел предложение следующей страницы
+    async def save_own_translation():
+        async with get_async_db_connection() as conn:
+            await save_translations(conn.cursor(), book, [(2, "sent-2-1", "Sentence 1 of page 2.", "MINE", None)])
+    run(save_own_translation())
+
+    make_stale(run, job_id)
+
+    run(run_book_translation_job(job_id))
+
+    job = job_row(run, job_id)
+    assert (job['status'], job['last_page'], job['attempts']) == ('done', 3, 2)
+    assert job['translated_sentences'] == 12 and job['failed_sentences'] == 0
+    rows = {
+        row['sentence_id']: row['current_translation']
+        for row in run(fetch("SELECT sentence_id, current_translation FROM translations WHERE book_id = %s", (book,)))
+    }
+    assert rows["sent-1-1"] == "before 1"
+    assert rows["sent-2-1"] == "MINE"
+    assert rows["sent-3-4"] == "[kaz] Sentence 4 of page 3."
+    book_row = run(fetch("SELECT translated_sentences FROM books WHERE id = %s", (book,)))[0]
+    assert book_row['translated_sentences'] == 12
+
+def test_cancelled_job_stops_at_next_progress(run, book):
+    job_id = create_job(run, book)['job_id']
+    job = run(_claim_job(job_id))
+
+    assert run(cancel_book_translation_job(book, owner(run, book))) == job_id
+    assert run(_record_progress(job, 1, 0)) is False
+    assert job_row(run, job_id)['status'] == 'cancelled'
+    assert run(_claim_job(job_id)) is None
@@ -0,0 +1,22 @@
+"""
+Асинхронный пул: одновременные запросы к БД идут параллельно, а не по очереди
+"""
+import asyncio
+import time
+from database import get_async_db_connection
+
+QUERY_SECONDS = 0.3
+
+async def slow_query():
+    async with get_async_db_connection() as conn:
+        await conn.execute("SELECT pg_sleep(%s)", (QUERY_SECONDS,))
+
+def test_concurrent_queries_overlap(run):
+    async def call():
+        # Соединения пула открываются заранее, чтобы замерять только запросы
+        await asyncio.gather(*(slow_query() for _ in range(4)))
+        started = time.perf_counter()
+        await asyncio.gather(*(slow_query() for _ in range(4)))
+        return time.perf_counter() - started
+
+    assert run(call()) < 2 * QUERY_SECONDS
@@ -0,0 +1,337 @@
+"""
+Память переводов перед KazLLM, Claude и ChatGPT
+
+Готовый перевод ищется сначала в LRU кеше процесса (с TTL), затем в таблице
+translation_memory. Ключ - SHA-256 от нормализованного текста, языковой пары
+и модели, поэтому повторяющиеся заголовки, реплики и служебный текст
+не отправляются во внешний API повторно.
+
+Заполнение из уже сохраненных переводов книг:
+    python translation_memory.py seed
+    python translation_memory.py seed --source eng --target kaz
+"""
+import argparse
+import asyncio
+import hashlib
+import os
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, List, Optional
+from dotenv import load_dotenv
+from database import get_async_db_connection, async_db_pool
+
+load_dotenv()
+
+TRANSLATION_MEMORY_ENABLED = os.getenv('TRANSLATION_MEMORY_ENABLED', 'true').lower() == 'true'
+TRANSLATION_MEMORY_CACHE_SIZE = int(os.getenv('TRANSLATION_MEMORY_CACHE_SIZE', 10000))
+TRANSLATION_MEMORY_CACHE_TTL = int(os.getenv('TRANSLATION_MEMORY_CACHE_TTL', 3600))
+
+# Сколько строк записывается в БД за раз при заполнении
+SEED_BATCH_SIZE = 500
+
+def normalize_text(text: str) -> str:
+    """Приводит текст к виду, по которому сравниваются переводы"""
+    return ' '.join(unicodedata.normalize('NFC', text).split())
+
+def make_key(text: str, source_language: str, target_language: str, model: str) -> str:
+    """Ключ памяти переводов"""
+    raw = '\x1f'.join((model, source_language, target_language, normalize_text(text)))
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+class TTLCache:
+    """LRU кеш с ограничением размера и временем жизни записей"""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max(1, max_size)
+        self.ttl = ttl
+        self._items = OrderedDict()
+
+    def get(self, key: str) -> Optional[str]:
+        item = self._items.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at < time.monotonic():
+            del self._items[key]
+            return None
+        self._items.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: str):
+        self._items[key] = (value, time.monotonic() + self.ttl)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def clear(self):
+        self._items.clear()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+class TranslationMemory:
+    """Память переводов: кеш процесса + таблица translation_memory"""
+
+    def __init__(self, max_size: int, ttl: float, enabled: bool = True):
+        self.enabled = enabled
+        self._cache = TTLCache(max_size, ttl)
+        # Модели, переводы которых не запоминаются (например, stub)
+        self._bypass_models = set()
+
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.errors = 0
+
+    def bypass(self, model: str):
+        """Не искать и не сохранять переводы модели"""
+        self._bypass_models.add(model)
+
+    def _skip(self, model: str) -> bool:
+        return not self.enabled or model in self._bypass_models
+
+    async def get(self, text: str, source_language: str, target_language: str, model: str) -> Optional[str]:
+        """Готовый перевод или None"""
+        if self._skip(model):
+            return None
+
+        key = make_key(text, source_language, target_language, model)
+        translated = self._cache.get(key)
+        if translated is not None:
+            self.memory_hits += 1
+            return translated
+
+        try:
+            async with get_async_db_connection() as conn:
+                cursor = conn.cursor()
+                await cursor.execute(
+                    """
+                    UPDATE translation_memory
+                    SET hits = hits + 1, last_used_at = CURRENT_TIMESTAMP
+                    WHERE key_hash = %s
+                    RETURNING translated_text
+                    """,
+                    (key,)
+                )
+                row = await cursor.fetchone()
+        except Exception as e:
+            self.errors += 1
+            print(f"[WARNING] Translation memory lookup failed: {str(e)}")
+            return None
+
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.db_hits += 1
+        self._cache.set(key, row['translated_text'])
+        return row['translated_text']
+
+    async def put(self, text: str, translated_text: str, source_language: str,
+                  target_language: str, model: str):
+        """Запоминает перевод"""
+        if self._skip(model) or not translated_text:
+            return
+
+        key = make_key(text, source_language, target_language, model)
+        self._cache.set(key, translated_text)
+        try:
+            async with get_async_db_connection() as conn:
+                cursor = conn.cursor()
+                await cursor.execute(
+                    """
+                    INSERT INTO translation_memory
+                        (key_hash, source_language, target_language, model, source_text, translated_text)
+                    VALUES (%s, %s, %s, %s, %s, %s)
+                    ON CONFLICT (key_hash)
+                    DO UPDATE SET translated_text = EXCLUDED.translated_text,
+                                  last_used_at = CURRENT_TIMESTAMP
+                    """,
+                    (key, source_language, target_language, model, normalize_text(text), translated_text)
+                )
+            self.stores += 1
+        except Exception as e:
+            self.errors += 1
+            print(f"[WARNING] Failed to store translation in memory: {str(e)}")
+
+    async def get_many(self, texts: List[str], source_language: str, target_language: str,
+                       model: str) -> Dict[str, str]:
+        """
+        Готовые переводы для нескольких текстов одним запросом к БД
+
+        Returns:
+            {текст: перевод} только для найденных
+        """
+        if self._skip(model) or not texts:
+            return {}
+
+        found = {}
+        missing = {}
+        for text in texts:
+            key = make_key(text, source_language, target_language, model)
+            translated = self._cache.get(key)
+            if translated is not None:
+                self.memory_hits += 1
+                found[text] = translated
+            else:
+                missing.setdefault(key, []).append(text)
+
+        if not missing:
+            return found
+
+        try:
+            async with get_async_db_connection() as conn:
+                cursor = conn.cursor()
+                await cursor.execute(
+                    """
+                    UPDATE translation_memory
+                    SET hits = hits + 1, last_used_at = CURRENT_TIMESTAMP
+                    WHERE key_hash = ANY(%s::bpchar[])
+                    RETURNING key_hash, translated_text
+                    """,
+                    (list(missing),)
+                )
+                rows = await cursor.fetchall()
+        except Exception as e:
+            self.errors += 1
+            print(f"[WARNING] Translation memory lookup failed: {str(e)}")
+            return found
+
+        for row in rows:
+            key = row['key_hash']
+            self._cache.set(key, row['translated_text'])
+            for text in missing.pop(key):
+                self.db_hits += 1
+                found[text] = row['translated_text']
+        self.misses += sum(len(texts) for texts in missing.values())
+        return found
+
+    async def put_many(self, translations: Dict[str, str], source_language: str,
+                       target_language: str, model: str):
+        """Запоминает несколько переводов {текст: перевод} одним раундом к БД"""
+        if self._skip(model):
+            return
+
+        rows = {}
+        for text, translated_text in translations.items():
+            if not translated_text:
+                continue
+            key = make_key(text, source_language, target_language, model)
+            self._cache.set(key, translated_text)
+            rows[key] = (key, source_language, target_language, model, normalize_text(text), translated_text)
+        if not rows:
+            return
+
+        try:
+            async with get_async_db_connection() as conn:
+                cursor = conn.cursor()
+                await cursor.executemany(
+                    """
+                    INSERT INTO translation_memory
+                        (key_hash, source_language, target_language, model, source_text, translated_text)
+                    VALUES (%s, %s, %s, %s, %s, %s)
+                    ON CONFLICT (key_hash)
+                    DO UPDATE SET translated_text = EXCLUDED.translated_text,
+                                  last_used_at = CURRENT_TIMESTAMP
+                    """,
+                    list(rows.values())
+                )
+            self.stores += len(rows)
+        except Exception as e:
+            self.errors += 1
+            print(f"[WARNING] Failed to store translations in memory: {str(e)}")
+
+    def stats(self) -> dict:
+        """Счетчики попаданий и промахов"""
+        lookups = self.memory_hits + self.db_hits + self.misses
+        hits = self.memory_hits + self.db_hits
+        return {
+            "enabled": self.enabled,
+            "cached_entries": len(self._cache),
+            "memory_hits": self.memory_hits,
+            "db_hits": self.db_hits,
+            "misses": self.misses,
+            "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+            "stores": self.stores,
+            "errors": self.errors
+        }
+
+async def seed_from_translations(source_language: str = 'eng', target_language: str = 'kaz') -> int:
+    """
+    Заполняет память из сохраненных переводов книг
+
+    Берется последняя версия каждого перевода, если она совпадает с текущим
+    переводом (не правилась вручную после модели) и известна модель.
+    Язык в таблице translations не хранится, поэтому пара передается явно.
+
+    Returns:
+        сколько записей добавлено
+    """
+    async with get_async_db_connection() as conn:
+        cursor = conn.cursor()
+        await cursor.execute(
+            """
+            SELECT original_text, current_translation, model
+            FROM (
+                SELECT DISTINCT ON (t.id) t.original_text, t.current_translation, tv.text, tv.model
+                FROM translations t
+                JOIN translation_versions tv ON tv.translation_id = t.id
+                WHERE t.current_translation IS NOT NULL
+                ORDER BY t.id, tv.created_at DESC, tv.id DESC
+            ) latest
+            WHERE text = current_translation
+            """
+        )
+        rows = await cursor.fetchall()
+
+        entries = {}
+        for row in rows:
+            if not row['model'] or not row['current_translation'].strip():
+                continue
+            key = make_key(row['original_text'], source_language, target_language, row['model'])
+            entries[key] = (
+                key, source_language, target_language, row['model'],
+                normalize_text(row['original_text']), row['current_translation']
+            )
+
+        values = list(entries.values())
+        added = 0
+        for start in range(0, len(values), SEED_BATCH_SIZE):
+            await cursor.executemany(
+                """
+                INSERT INTO translation_memory
+                    (key_hash, source_language, target_language, model, source_text, translated_text)
+                VALUES (%s, %s, %s, %s, %s, %s)
+                ON CONFLICT (key_hash) DO NOTHING
+                """,
+                values[start:start + SEED_BATCH_SIZE]
+            )
+            added += cursor.rowcount
+    return added
+
+# Общая память переводов приложения
+translation_memory = TranslationMemory(
+    TRANSLATION_MEMORY_CACHE_SIZE,
+    TRANSLATION_MEMORY_CACHE_TTL,
+    TRANSLATION_MEMORY_ENABLED
+)
+
+async def _seed_command(source_language: str, target_language: str):
+    await async_db_pool.open(wait=True)
+    try:
+        added = await seed_from_translations(source_language, target_language)
+        print(f"[OK] Translation memory seeded: {added} new entr{'y' if added == 1 else 'ies'}")
+    finally:
+        await async_db_pool.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Память переводов")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    seed_parser = subparsers.add_parser("seed", help="заполнить из сохраненных переводов книг")
+    seed_parser.add_argument("--source", default="eng", help="язык оригинала (по умолчанию eng)")
+    seed_parser.add_argument("--target", default="kaz", help="язык перевода (по умолчанию kaz)")
+    args = parser.parse_args()
+
+    asyncio.run(_seed_command(args.source, args.target))
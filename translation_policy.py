@@ -0,0 +1,194 @@
+"""
+Политика вызова моделей перевода для /api/translate: повторы, hedging, запасные модели
+
+Вызов модели повторяется со случайной (jitter) экспоненциальной задержкой
+при таймаутах, ошибках соединения и 5xx. Если включен hedging и модель
+отвечает дольше своего перцентиля задержки, параллельно уходит второй такой же
+запрос - побеждает первый успешный. Когда повторы исчерпаны, перевод
+запрашивается у следующей модели цепочки TRANSLATE_FALLBACK_CHAIN.
+
+429 здесь не повторяется: паузы и повторы по лимитам делает RateGovernor
+(rate_limiter.py), и 429 доходит сюда, только когда они исчерпаны, -
+сразу берется следующая модель.
+
+Текст длиннее chunk_tokens сервиса делится по предложениям на части,
+которые переводятся параллельно (каждая со своими повторами) и собираются по порядку.
+"""
+import asyncio
+import os
+import random
+from typing import Optional
+import httpx
+from fastapi import HTTPException
+from dotenv import load_dotenv
+from translators import translation_backends
+from chunking import split_into_chunks, join_chunks
+
+load_dotenv()
+
+# Повторов после первой попытки (на каждую модель)
+TRANSLATE_RETRY_ATTEMPTS = int(os.getenv('TRANSLATE_RETRY_ATTEMPTS', 2))
+TRANSLATE_RETRY_BASE_DELAY = float(os.getenv('TRANSLATE_RETRY_BASE_DELAY', 0.5))
+TRANSLATE_RETRY_MAX_DELAY = float(os.getenv('TRANSLATE_RETRY_MAX_DELAY', 8))
+
+# Второй запрос, если первый дольше перцентиля задержек модели
+TRANSLATE_HEDGE_ENABLED = os.getenv('TRANSLATE_HEDGE_ENABLED', 'false').lower() == 'true'
+TRANSLATE_HEDGE_PERCENTILE = float(os.getenv('TRANSLATE_HEDGE_PERCENTILE', 95))
+# Сколько успешных ответов модели нужно, прежде чем перцентилю можно верить
+TRANSLATE_HEDGE_MIN_SAMPLES = int(os.getenv('TRANSLATE_HEDGE_MIN_SAMPLES', 20))
+
+# Порядок запасных моделей, пустая строка - без запасных
+TRANSLATE_FALLBACK_CHAIN = [
+    model.strip()
+    for model in os.getenv('TRANSLATE_FALLBACK_CHAIN', 'kazllm,claude,chatgpt').split(',')
+    if model.strip() in translation_backends
+]
+
+# Без 429: повторы по лимитам уже сделал RateGovernor
+RETRYABLE_STATUS_CODES = {500, 502, 503, 504, 529}
+
+def is_retryable(error: Exception) -> bool:
+    """Таймаут, обрыв соединения или 5xx - стоит повторить"""
+    if isinstance(error, httpx.RequestError):
+        return True
+    if isinstance(error, HTTPException):
+        return error.status_code in RETRYABLE_STATUS_CODES
+    return False
+
+def backoff_delay(attempt: int) -> float:
+    """Задержка перед повтором: full jitter от экспоненциальной границы"""
+    return random.uniform(0, min(TRANSLATE_RETRY_MAX_DELAY, TRANSLATE_RETRY_BASE_DELAY * 2 ** attempt))
+
+def fallback_chain(model: str) -> list:
+    """Запрошенная модель, затем остальные модели цепочки по порядку"""
+    return [model] + [other for other in TRANSLATE_FALLBACK_CHAIN if other != model]
+
+class TranslationPolicy:
+    """Повторы, hedging и запасные модели с метриками"""
+
+    def __init__(self):
+        self.retries = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.fallbacks = 0
+        self.failures = 0
+        self.chunked = 0
+        self.chunks = 0
+
+    def hedge_delay(self, model: str) -> Optional[float]:
+        """Перцентиль задержки модели или None, пока ответов мало"""
+        return translation_backends.get(model).latency_percentile(
+            TRANSLATE_HEDGE_PERCENTILE, TRANSLATE_HEDGE_MIN_SAMPLES
+        )
+
+    async def _call(self, model: str, text: str, source_language: str, target_language: str) -> str:
+        return await translation_backends.get(model).translate(text, source_language, target_language)
+
+    async def _hedged_call(self, model: str, text: str, source_language: str, target_language: str) -> str:
+        """Вызов модели; если он затянулся, параллельно второй такой же"""
+        delay = self.hedge_delay(model) if TRANSLATE_HEDGE_ENABLED else None
+        if delay is None:
+            return await self._call(model, text, source_language, target_language)
+
+        primary = asyncio.create_task(self._call(model, text, source_language, target_language))
+        pending = {primary}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=delay)
+            if done:
+                return primary.result()
+
+            self.hedged += 1
+            hedge = asyncio.create_task(self._call(model, text, source_language, target_language))
+            pending.add(hedge)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # Проигравший запрос больше не нужен
+            for task in pending:
+                task.cancel()
+
+    async def _call_with_retries(self, model: str, text: str, source_language: str, target_language: str) -> str:
+        attempt = 0
+        while True:
+            try:
+                return await self._hedged_call(model, text, source_language, target_language)
+            except Exception as e:
+                if attempt >= TRANSLATE_RETRY_ATTEMPTS or not is_retryable(e):
+                    raise
+                delay = backoff_delay(attempt)
+                attempt += 1
+                self.retries += 1
+                print(f"[WARNING] {model} translation failed ({str(e)}), "
+                      f"retry {attempt}/{TRANSLATE_RETRY_ATTEMPTS} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+
+    async def _translate_chunks(self, model: str, text: str, source_language: str, target_language: str) -> str:
+        """Перевод моделью, длинный текст - по частям параллельно"""
+        chunks = split_into_chunks(text, translation_backends.get(model).chunk_tokens)
+        if len(chunks) == 1:
+            return await self._call_with_retries(model, text, source_language, target_language)
+
+        self.chunked += 1
+        self.chunks += len(chunks)
+        tasks = [
+            asyncio.create_task(self._call_with_retries(model, chunk, source_language, target_language))
+            for chunk, _ in chunks
+        ]
+        try:
+            translations = await asyncio.gather(*tasks)
+        finally:
+            # Одна часть не удалась - остальные уже не нужны
+            for task in tasks:
+                task.cancel()
+        return join_chunks(translations, chunks)
+
+    async def translate(self, text: str, source_language: str, target_language: str, model: str) -> tuple:
+        """
+        Переводит текст запрошенной моделью или запасными
+
+        Returns:
+            (перевод, модель, которая его сделала)
+        """
+        last_error = None
+        for candidate in fallback_chain(model):
+            # Модель без ключа API пропускаем; если это запрошенная модель,
+            # клиент увидит эту ошибку, когда запасных моделей нет
+            if not translation_backends.get(candidate).is_configured():
+                if candidate == model:
+                    last_error = HTTPException(status_code=500, detail=f"{candidate} API key not configured")
+                continue
+            if last_error is not None:
+                self.fallbacks += 1
+                print(f"[WARNING] Falling back to {candidate}: {str(last_error)}")
+            try:
+                translated_text = await self._translate_chunks(candidate, text, source_language, target_language)
+                return translated_text, candidate
+            except Exception as e:
+                last_error = e
+
+        self.failures += 1
+        raise last_error
+
+    def stats(self) -> dict:
+        return {
+            "fallback_chain": TRANSLATE_FALLBACK_CHAIN,
+            "hedge_enabled": TRANSLATE_HEDGE_ENABLED,
+            "retries": self.retries,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "fallbacks": self.fallbacks,
+            "failures": self.failures,
+            "chunked": self.chunked,
+            "chunks": self.chunks
+        }
+
+# Политика процесса (на каждый воркер uvicorn)
+translation_policy = TranslationPolicy()
@@ -0,0 +1,378 @@
+"""
+Сервисы перевода: KazLLM, Claude, ChatGPT (и stub для локальной проверки)
+
+Каждый сервис - реализация TranslationBackend в реестре translation_backends.
+Общая часть горячего пути живет в базовом классе: проверка ключа API, лимиты
+частоты (rate_limiter), замер задержек и счетчики ошибок, названия языков для
+промптов. Реализация отвечает только за сам запрос к своему API. Соединения и
+таймауты берутся из общих клиентов http_clients.
+
+Новый сервис: наследник TranslationBackend (или LLMBackend для чат-моделей)
+и translation_backends.register(...). Сервис без нужных методов не
+регистрируется (TypeError при запуске, а не на первом запросе).
+"""
+import asyncio
+import json
+import os
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Awaitable, Callable, Dict, List, Optional
+import openai
+from fastapi import HTTPException
+from dotenv import load_dotenv
+from http_clients import http_clients
+from rate_limiter import rate_governors, RateLimited, parse_retry_after
+from translation_memory import translation_memory
+
+load_dotenv()
+
+# Языки для промптов LLM
+LANG_MAP = {
+    "eng": "English",
+    "kaz": "Kazakh",
+    "rus": "Russian"
+}
+
+TRANSLATE_BATCH_MAX_SEGMENTS = int(os.getenv('TRANSLATE_BATCH_MAX_SEGMENTS', 40))
+
+# Сколько последних задержек каждого сервиса хранится для метрик и hedging
+TRANSLATE_LATENCY_WINDOW = int(os.getenv('TRANSLATE_LATENCY_WINDOW', 200))
+
+# Локальный сервис без сети: перевод - текст с пометкой языка
+TRANSLATION_STUB_ENABLED = os.getenv('TRANSLATION_STUB_ENABLED', 'false').lower() == 'true'
+TRANSLATION_STUB_DELAY = float(os.getenv('TRANSLATION_STUB_DELAY', 0))
+
+TRANSLATOR_SYSTEM_PROMPT = "You are a professional translator. Translate the given text accurately, preserving its meaning and tone. Only provide the translation without any explanations or additional text."
+
+class BatchFormatError(Exception):
+    """Модель вернула не тот формат ответа на пакетный перевод"""
+
+def estimate_tokens(text: str) -> int:
+    """
+    Грубая оценка числа токенов без обращения к сети
+
+    Латиница - около 4 символов на токен, кириллица и прочие - около 2.
+    """
+    ascii_chars = sum(1 for char in text if ord(char) < 128)
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars + 1) // 2
+
+def _language_names(source_language: str, target_language: str) -> tuple:
+    return (
+        LANG_MAP.get(source_language, source_language),
+        LANG_MAP.get(target_language, target_language)
+    )
+
+def _batch_prompt(texts: List[str], source_language: str, target_language: str) -> str:
+    source_lang, target_lang = _language_names(source_language, target_language)
+    return (
+        f"Translate each of the following {len(texts)} text segments from {source_lang} to {target_lang}. "
+        f"The segments are given as a JSON array. Reply with only a JSON array of exactly {len(texts)} "
+        f"strings: the translations in the same order, without any explanations.\n\n"
+        f"{json.dumps(texts, ensure_ascii=False)}"
+    )
+
+def _parse_batch_reply(reply: str, expected: int) -> List[str]:
+    """Достает JSON массив переводов из ответа модели"""
+    start, end = reply.find('['), reply.rfind(']')
+    if start == -1 or end < start:
+        raise BatchFormatError("No JSON array in model reply")
+    try:
+        translations = json.loads(reply[start:end + 1])
+    except ValueError as e:
+        raise BatchFormatError(f"Invalid JSON in model reply: {str(e)}")
+    if (not isinstance(translations, list) or len(translations) != expected
+            or not all(isinstance(text, str) for text in translations)):
+        raise BatchFormatError(f"Expected {expected} translations in model reply")
+    return [text.strip() for text in translations]
+
+class TranslationBackend(ABC):
+    """
+    Сервис перевода
+
+    Наследник реализует _translate, а при batch_tokens > 0 - и _translate_batch.
+
+    Атрибуты класса:
+        name          - имя модели в запросах ("kazllm", "claude", ...)
+        api_key_env   - переменная окружения с ключом API (None - ключ не нужен)
+        batch_tokens  - бюджет входных токенов пакетного запроса, 0 - без пакетов
+        chunk_tokens  - части длинного текста /api/translate не больше стольких токенов
+        cacheable     - запоминать ли переводы в памяти переводов
+    """
+    name = None
+    api_key_env = None
+    batch_tokens = 0
+    chunk_tokens = 500
+    cacheable = True
+
+    def __init__(self):
+        self._latencies = deque(maxlen=TRANSLATE_LATENCY_WINDOW)
+        self.calls = 0
+        self.errors = 0
+
+    @property
+    def supports_batch(self) -> bool:
+        return self.batch_tokens > 0
+
+    @property
+    def api_key(self) -> Optional[str]:
+        return os.getenv(self.api_key_env) if self.api_key_env else None
+
+    def is_configured(self) -> bool:
+        """Задан ли ключ API"""
+        return not self.api_key_env or bool(self.api_key)
+
+    def latency_percentile(self, percentile: float, min_samples: int = 1) -> Optional[float]:
+        """Перцентиль последних задержек в секундах или None, пока замеров мало"""
+        if len(self._latencies) < max(1, min_samples):
+            return None
+        ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * percentile / 100))]
+
+    async def _measured(self, tokens: int, call: Callable[[], Awaitable]):
+        """Запрос к API под лимитами сервиса с замером задержки"""
+        if not self.is_configured():
+            raise HTTPException(status_code=500, detail=f"{self.name} API key not configured")
+
+        governor = rate_governors.get(self.name)
+        started = time.monotonic()
+        self.calls += 1
+        try:
+            result = await (governor.run(tokens, call) if governor else call())
+        except Exception:
+            self.errors += 1
+            raise
+        self._latencies.append(time.monotonic() - started)
+        return result
+
+    async def translate(self, text: str, source_language: str, target_language: str) -> str:
+        """Перевод одного текста"""
+        return await self._measured(
+            2 * estimate_tokens(text),
+            lambda: self._translate(text, source_language, target_language)
+        )
+
+    async def translate_batch(self, texts: List[str], source_language: str, target_language: str) -> List[str]:
+        """Перевод нескольких фрагментов одним запросом (если supports_batch)"""
+        return await self._measured(
+            2 * sum(estimate_tokens(text) for text in texts),
+            lambda: self._translate_batch(texts, source_language, target_language)
+        )
+
+    @abstractmethod
+    async def _translate(self, text: str, source_language: str, target_language: str) -> str:
+        """Запрос перевода одного текста к API сервиса"""
+
+    async def _translate_batch(self, texts: List[str], source_language: str, target_language: str) -> List[str]:
+        """Запрос пакетного перевода, обязателен при batch_tokens > 0"""
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        p50 = self.latency_percentile(50)
+        p95 = self.latency_percentile(95)
+        return {
+            "configured": self.is_configured(),
+            "batch": self.supports_batch,
+            "calls": self.calls,
+            "errors": self.errors,
+            "latency_p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+            "latency_p95_ms": round(p95 * 1000, 1) if p95 is not None else None
+        }
+
+class KazLLMBackend(TranslationBackend):
+    """KazLLM: один текст за запрос, языки передаются кодами"""
+    name = "kazllm"
+    api_key_env = "TRANSLATION_API_KEY"
+    chunk_tokens = int(os.getenv('TRANSLATE_CHUNK_TOKENS_KAZLLM', 500))
+
+    async def _translate(self, text: str, source_language: str, target_language: str) -> str:
+        TRANSLATION_API_URL = os.getenv('TRANSLATION_API_URL', 'https://mangisoz.nu.edu.kz/external-api/v1/translate/text/')
+
+        response = await http_clients.kazllm.post(
+            TRANSLATION_API_URL,
+            headers={
+                'Authorization': f'Bearer {self.api_key}',
+                'Content-Type': 'application/json',
+            },
+            json={
+                'source_language': source_language,
+                'target_language': target_language,
+                'text': text,
+            }
+        )
+
+        if response.status_code == 429:
+            raise RateLimited(f"Translation API rate limit: {response.text}", parse_retry_after(response.headers))
+        if response.status_code != 200:
+            raise HTTPException(
+                status_code=response.status_code,
+                detail=f"Translation API error: {response.text}"
+            )
+
+        data = response.json()
+        return data.get('text', text)
+
+class LLMBackend(TranslationBackend):
+    """
+    Чат-модель: перевод и пакетный перевод через промпт
+
+    Наследник реализует _complete(prompt, max_tokens).
+    min_output_tokens/max_output_tokens - границы max_tokens ответа.
+    """
+    min_output_tokens = 1000
+    max_output_tokens = 4000
+
+    def _output_tokens(self, input_tokens: int) -> int:
+        """max_tokens ответа: с запасом на перевод, который длиннее оригинала"""
+        return min(self.max_output_tokens, max(self.min_output_tokens, 200 + 3 * input_tokens))
+
+    @abstractmethod
+    async def _complete(self, prompt: str, max_tokens: int) -> str:
+        """Ответ модели на промпт"""
+
+    async def _translate(self, text: str, source_language: str, target_language: str) -> str:
+        source_lang, target_lang = _language_names(source_language, target_language)
+        return await self._complete(
+            f"Translate the following text from {source_lang} to {target_lang}. "
+            f"Only provide the translation, no explanations:\n\n{text}",
+            self._output_tokens(estimate_tokens(text))
+        )
+
+    async def _translate_batch(self, texts: List[str], source_language: str, target_language: str) -> List[str]:
+        # Для пакета нижняя граница не нужна: ответ - только JSON массив переводов
+        max_tokens = min(self.max_output_tokens, 200 + 3 * sum(estimate_tokens(text) for text in texts))
+        reply = await self._complete(_batch_prompt(texts, source_language, target_language), max_tokens)
+        return _parse_batch_reply(reply, len(texts))
+
+class ClaudeBackend(LLMBackend):
+    name = "claude"
+    api_key_env = "CLAUDE_API_KEY"
+    batch_tokens = int(os.getenv('TRANSLATE_BATCH_TOKENS_CLAUDE', 1500))
+    chunk_tokens = int(os.getenv('TRANSLATE_CHUNK_TOKENS_CLAUDE', 2000))
+    min_output_tokens = 4096
+    max_output_tokens = 16000
+
+    async def _complete(self, prompt: str, max_tokens: int) -> str:
+        CLAUDE_API_URL = os.getenv('CLAUDE_API_URL', 'https://api.anthropic.com/v1/messages')
+
+        response = await http_clients.claude.post(
+            CLAUDE_API_URL,
+            headers={
+                'x-api-key': self.api_key,
+                'anthropic-version': '2023-06-01',
+                'Content-Type': 'application/json',
+            },
+            json={
+                'model': 'claude-sonnet-4-5-20250929',
+                'max_tokens': max_tokens,
+                'system': TRANSLATOR_SYSTEM_PROMPT,
+                'messages': [{
+                    'role': 'user',
+                    'content': prompt
+                }]
+            }
+        )
+
+        if response.status_code == 429:
+            raise RateLimited(f"Claude API rate limit: {response.text}", parse_retry_after(response.headers))
+        if response.status_code != 200:
+            raise HTTPException(
+                status_code=response.status_code,
+                detail=f"Claude API error: {response.text}"
+            )
+
+        data = response.json()
+        return data['content'][0]['text'].strip()
+
+class ChatGPTBackend(LLMBackend):
+    name = "chatgpt"
+    api_key_env = "OPENAI_API_KEY"
+    batch_tokens = int(os.getenv('TRANSLATE_BATCH_TOKENS_CHATGPT', 1000))
+    chunk_tokens = int(os.getenv('TRANSLATE_CHUNK_TOKENS_CHATGPT', 1200))
+    min_output_tokens = 1000
+    max_output_tokens = 4000
+
+    async def _complete(self, prompt: str, max_tokens: int) -> str:
+        try:
+            response = await http_clients.openai.chat.completions.create(
+                model="gpt-4",
+                messages=[
+                    {"role": "system", "content": TRANSLATOR_SYSTEM_PROMPT},
+                    {"role": "user", "content": prompt}
+                ],
+                temperature=0.3,
+                max_tokens=max_tokens
+            )
+        except openai.RateLimitError as e:
+            if e.code == 'insufficient_quota':
+                raise HTTPException(status_code=429, detail=f"ChatGPT quota exceeded: {str(e)}")
+            raise RateLimited(f"ChatGPT rate limit: {str(e)}", parse_retry_after(e.response.headers))
+        except openai.APITimeoutError:
+            raise HTTPException(status_code=504, detail="ChatGPT translation timeout")
+        except openai.APIConnectionError as e:
+            raise HTTPException(status_code=503, detail=f"ChatGPT translation error: {str(e)}")
+        except openai.APIStatusError as e:
+            raise HTTPException(status_code=e.status_code, detail=f"ChatGPT translation error: {str(e)}")
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"ChatGPT translation error: {str(e)}")
+        return response.choices[0].message.content.strip()
+
+class StubBackend(TranslationBackend):
+    """
+    Локальный сервис для проверки без внешних API (TRANSLATION_STUB_ENABLED=true)
+
+    Перевод - исходный текст с пометкой целевого языка. Переводы не
+    попадают в память переводов.
+    """
+    name = "stub"
+    batch_tokens = 1500
+    cacheable = False
+
+    async def _translate(self, text: str, source_language: str, target_language: str) -> str:
+        if TRANSLATION_STUB_DELAY:
+            await asyncio.sleep(TRANSLATION_STUB_DELAY)
+        return f"[{target_language}] {text}"
+
+    async def _translate_batch(self, texts: List[str], source_language: str, target_language: str) -> List[str]:
+        if TRANSLATION_STUB_DELAY:
+            await asyncio.sleep(TRANSLATION_STUB_DELAY)
+        return [f"[{target_language}] {text}" for text in texts]
+
+class BackendRegistry:
+    """Сервисы перевода по имени модели"""
+
+    def __init__(self):
+        self._backends: Dict[str, TranslationBackend] = {}
+
+    def register(self, backend: TranslationBackend):
+        if not backend.name:
+            raise TypeError(f"{type(backend).__name__} has no name")
+        if backend.supports_batch and type(backend)._translate_batch is TranslationBackend._translate_batch:
+            raise TypeError(f"{type(backend).__name__} has batch_tokens but does not implement _translate_batch")
+        self._backends[backend.name] = backend
+        if not backend.cacheable:
+            translation_memory.bypass(backend.name)
+
+    def get(self, name: str) -> TranslationBackend:
+        return self._backends[name]
+
+    def names(self) -> List[str]:
+        return list(self._backends)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._backends
+
+    def stats(self) -> dict:
+        return {name: backend.stats() for name, backend in self._backends.items()}
+
+# Сервисы перевода приложения
+translation_backends = BackendRegistry()
+translation_backends.register(KazLLMBackend())
+translation_backends.register(ClaudeBackend())
+translation_backends.register(ChatGPTBackend())
+if TRANSLATION_STUB_ENABLED:
+    translation_backends.register(StubBackend())
+
+def resolve_model(model: str) -> str:
+    """Неизвестные модели, как и раньше, переводятся через KazLLM"""
+    return model if model in translation_backends else "kazllm"